@@ -0,0 +1,152 @@
+"""Move old finished sessions out of the `auth_session` collection.
+
+Sessions in a terminal state that were created more than
+CONTROLLER_SESSION_ARCHIVE_AFTER seconds ago are reduced to a summary (id,
+state, timestamps, proof configuration and a hash of the metadata) and
+written either to the `auth_session_archive` collection or to daily
+NDJSON.gz files, then removed from the hot collection together with their
+proof configuration mapping.
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import canonicaljson
+import structlog
+from bson import ObjectId
+from pymongo import ReplaceOne
+from pymongo.database import Database
+
+from ..core.config import settings
+from ..core.jobs import Job
+from ..db.collections import COLLECTION_NAMES
+from ..db.profiles import DB_PROFILES, get_collection
+from .models import TERMINAL_STATES
+from .pres_exch_cleanup import MAX_ATTEMPTS as CLEANUP_MAX_ATTEMPTS
+from .status_cache import cache as status_cache
+
+logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
+
+ARCHIVE_TARGET_COLLECTION = "collection"
+ARCHIVE_TARGET_FILE = "file"
+
+stats = {"runs": 0, "archived": 0, "errors": 0, "last_run_at": None}
+
+
+def metadata_hash(metadata: Optional[dict]) -> Optional[str]:
+    if metadata is None:
+        return None
+    return hashlib.sha256(canonicaljson.encode_canonical_json(metadata)).hexdigest()
+
+
+def summarize(auth_session: dict, proof_req_config_id: Optional[str]) -> Dict:
+    return {
+        "_id": auth_session["_id"],
+        "pres_exch_id": auth_session.get("pres_exch_id"),
+        "proof_status": auth_session.get("proof_status"),
+        "proof_req_config_id": proof_req_config_id,
+        "created_at": auth_session["_id"].generation_time.replace(tzinfo=None),
+        "expired_timestamp": auth_session.get("expired_timestamp"),
+        "lifecycle_timestamps": auth_session.get("lifecycle_timestamps", {}),
+        "metadata_hash": metadata_hash(auth_session.get("metadata")),
+        "archived_at": datetime.now(),
+    }
+
+
+def _candidates_query(cutoff: datetime) -> Dict:
+    query = {
+        "_id": {"$lt": ObjectId.from_datetime(cutoff)},
+        "proof_status": {"$in": [str(state) for state in TERMINAL_STATES]},
+    }
+    if settings.CONTROLLER_PRES_EXCH_CLEANUP_ENABLED:
+        # Leave sessions in place until the agent's record is gone, otherwise
+        # the cleanup would never find them again.
+        query["$or"] = [
+            {"pres_exch_deleted_at": {"$ne": None}},
+            {"pres_exch_cleanup_attempts": {"$gte": CLEANUP_MAX_ATTEMPTS}},
+        ]
+    return query
+
+
+def _write_file(summaries: List[Dict], directory: str):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(
+        directory, f"auth_session-{datetime.now().strftime('%Y%m%d')}.ndjson.gz"
+    )
+    # Appending creates a new gzip member, which readers handle transparently
+    with gzip.open(path, "at") as out:
+        for summary in summaries:
+            out.write(json.dumps(summary, default=str) + "\n")
+
+
+def archive_batch(db: Database, older_than: timedelta, batch_size: int) -> int:
+    """Archive one batch of sessions, returns the number archived."""
+    sessions = get_collection(db, COLLECTION_NAMES.AUTH_SESSION, DB_PROFILES.DEFAULT)
+    mappings = get_collection(
+        db, COLLECTION_NAMES.PRES_EX_ID_TO_PROOF_REQ_CONFIG_ID, DB_PROFILES.DEFAULT
+    )
+
+    batch = list(
+        sessions.find(_candidates_query(datetime.now() - older_than))
+        .sort("_id", 1)
+        .limit(batch_size)
+    )
+    if not batch:
+        return 0
+
+    pres_exch_ids = [s["pres_exch_id"] for s in batch if s.get("pres_exch_id")]
+    proof_configs = {
+        m["pres_exch_id"]: m.get("proof_req_config_id")
+        for m in mappings.find(
+            {"pres_exch_id": {"$in": pres_exch_ids}},
+            {"pres_exch_id": 1, "proof_req_config_id": 1},
+        )
+    }
+    summaries = [summarize(s, proof_configs.get(s.get("pres_exch_id"))) for s in batch]
+
+    if settings.CONTROLLER_SESSION_ARCHIVE_TARGET == ARCHIVE_TARGET_FILE:
+        _write_file(summaries, settings.CONTROLLER_SESSION_ARCHIVE_DIR)
+    else:
+        # Upserts keep a run that failed half way safe to repeat, and the
+        # summaries have to be durable before the sessions are deleted
+        get_collection(
+            db, COLLECTION_NAMES.AUTH_SESSION_ARCHIVE, DB_PROFILES.CRITICAL_TRANSITION
+        ).bulk_write(
+            [ReplaceOne({"_id": s["_id"]}, s, upsert=True) for s in summaries],
+            ordered=False,
+        )
+
+    mappings.delete_many({"pres_exch_id": {"$in": pres_exch_ids}})
+    sessions.delete_many({"_id": {"$in": [s["_id"] for s in batch]}})
+    for auth_session in batch:
+        status_cache.invalidate(str(auth_session["_id"]))
+    return len(batch)
+
+
+async def run(db: Database) -> bool:
+    batch_size = settings.CONTROLLER_SESSION_ARCHIVE_BATCH_SIZE
+    archived = 0
+    try:
+        archived = await asyncio.to_thread(
+            archive_batch,
+            db,
+            timedelta(seconds=settings.CONTROLLER_SESSION_ARCHIVE_AFTER),
+            batch_size,
+        )
+        stats["archived"] += archived
+    except Exception as err:
+        stats["errors"] += 1
+        logger.error("session archive run failed", err=str(err))
+    stats["runs"] += 1
+    stats["last_run_at"] = datetime.now()
+    if archived:
+        logger.info("archived sessions", count=archived)
+    # Keep going while there is a backlog
+    return archived >= batch_size
+
+
+JOB = Job("session_archive", run, lambda: settings.CONTROLLER_SESSION_ARCHIVE_INTERVAL)
@@ -1,7 +1,7 @@
 import structlog
 
-from typing import Union
-from pymongo import ReturnDocument
+from datetime import datetime
+from typing import Dict, List, Optional, Union
 from pymongo.database import Database
 from fastapi import HTTPException
 from fastapi import status as http_status
@@ -12,8 +12,13 @@ from .models import (
     AuthSession,
     AuthSessionCreate,
     AuthSessionPatch,
+    AuthSessionState,
+    AuthSessionStatus,
+    TERMINAL_STATES,
 )
-from api.db.session import COLLECTION_NAMES
+from .status_cache import cache as status_cache
+from api.db.profiles import DB_PROFILES
+from api.db.store import get_store
 
 
 logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
@@ -22,19 +27,19 @@ logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
 class AuthSessionCRUD:
     def __init__(self, db: Database):
         self._db = db
+        self._store = get_store(db)
 
     async def create(self, auth_session: AuthSessionCreate) -> AuthSession:
-        col = self._db.get_collection(COLLECTION_NAMES.AUTH_SESSION)
-        result = col.insert_one(jsonable_encoder(auth_session))
-        return AuthSession(**col.find_one({"_id": result.inserted_id}))
+        auth_sess = self._store.insert_session(jsonable_encoder(auth_session))
+        status_cache.invalidate(str(auth_sess["_id"]))
+        return AuthSession(**auth_sess)
 
     async def get(self, id: str) -> AuthSession:
         if not PyObjectId.is_valid(id):
             raise HTTPException(
                 status_code=http_status.HTTP_400_BAD_REQUEST, detail=f"Invalid id: {id}"
             )
-        col = self._db.get_collection(COLLECTION_NAMES.AUTH_SESSION)
-        auth_sess = col.find_one({"_id": PyObjectId(id)})
+        auth_sess = self._store.get_session(PyObjectId(id))
 
         if auth_sess is None:
             raise HTTPException(
@@ -44,19 +49,62 @@ class AuthSessionCRUD:
 
         return AuthSession(**auth_sess)
 
+    async def get_status(self, id: str) -> AuthSessionStatus:
+        """Only the fields status checks need, see AuthSessionStatus.
+
+        Served from the status cache when it can be, the result is shared
+        and must not be modified. Read from the primary: the result fills
+        the cache and expiry is decided on it, so it may not lag a write.
+        """
+        if not PyObjectId.is_valid(id):
+            raise HTTPException(
+                status_code=http_status.HTTP_400_BAD_REQUEST, detail=f"Invalid id: {id}"
+            )
+        if status_cache.enabled:
+            cached = status_cache.get(id)
+            if cached is not None:
+                return cached
+            token = status_cache.token()
+        auth_sess = self._store.get_session(
+            PyObjectId(id), AuthSessionStatus.projection(), DB_PROFILES.DEFAULT
+        )
+
+        if auth_sess is None:
+            raise HTTPException(
+                status_code=http_status.HTTP_404_NOT_FOUND,
+                detail="The auth_session hasn't been found!",
+            )
+
+        status = AuthSessionStatus(**auth_sess)
+        if status_cache.enabled:
+            status_cache.put(id, status, token)
+        return status
+
     async def patch(
-        self, id: Union[str, PyObjectId], data: AuthSessionPatch
+        self,
+        id: Union[str, PyObjectId],
+        data: AuthSessionPatch,
+        expected_status: Optional[AuthSessionState] = None,
     ) -> AuthSession:
+        """Write the session, with `expected_status` only while it is in it.
+
+        Returns None when there is no such session or it has moved on.
+        """
         if not PyObjectId.is_valid(id):
             raise HTTPException(
                 status_code=http_status.HTTP_400_BAD_REQUEST, detail=f"Invalid id: {id}"
             )
-        col = self._db.get_collection(COLLECTION_NAMES.AUTH_SESSION)
-        auth_sess = col.find_one_and_update(
-            {"_id": PyObjectId(id)},
-            {"$set": data.dict(exclude_unset=True)},
-            return_document=ReturnDocument.AFTER,
+        match = None
+        if expected_status is not None:
+            statuses = [str(expected_status)]
+            if expected_status == AuthSessionState.INITIATED:
+                # Created without a proof_status, AuthSession defaults it
+                statuses.append(None)
+            match = {"proof_status": statuses}
+        auth_sess = self._store.update_session(
+            PyObjectId(id), data.dict(exclude_unset=True), match=match
         )
+        status_cache.invalidate(str(id))
 
         return auth_sess
 
@@ -65,13 +113,12 @@ class AuthSessionCRUD:
             raise HTTPException(
                 status_code=http_status.HTTP_400_BAD_REQUEST, detail=f"Invalid id: {id}"
             )
-        col = self._db.get_collection(COLLECTION_NAMES.AUTH_SESSION)
-        auth_sess = col.find_one_and_delete({"_id": PyObjectId(id)})
-        return bool(auth_sess)
+        deleted = self._store.delete_session(PyObjectId(id))
+        status_cache.invalidate(str(id))
+        return deleted
 
     async def get_by_pres_exch_id(self, pres_exch_id: str) -> AuthSession:
-        col = self._db.get_collection(COLLECTION_NAMES.AUTH_SESSION)
-        auth_sess = col.find_one({"pres_exch_id": pres_exch_id})
+        auth_sess = self._store.find_session(pres_exch_id)
 
         if auth_sess is None:
             raise HTTPException(
@@ -80,3 +127,32 @@ class AuthSessionCRUD:
             )
 
         return AuthSession(**auth_sess)
+
+    async def get_pres_exch_cleanup_batch(
+        self, batch_size: int, max_attempts: int
+    ) -> List[AuthSession]:
+        """Terminal sessions whose agent record has not been deleted yet."""
+        batch = self._store.pres_exch_cleanup_batch(
+            [str(state) for state in TERMINAL_STATES], batch_size, max_attempts
+        )
+        return [AuthSession(**auth_sess) for auth_sess in batch]
+
+    async def set_revealed_attributes(
+        self, id: Union[str, PyObjectId], revealed_attributes: Dict[str, str]
+    ):
+        self._store.update_session(
+            PyObjectId(id), {"revealed_attributes": revealed_attributes}
+        )
+        status_cache.invalidate(str(id))
+
+    async def mark_pres_exch_deleted(self, id: Union[str, PyObjectId]):
+        self._store.update_session(
+            PyObjectId(id),
+            {"pres_exch_deleted_at": datetime.now()},
+            DB_PROFILES.BEST_EFFORT_AUDIT,
+        )
+        status_cache.invalidate(str(id))
+
+    async def mark_pres_exch_cleanup_failed(self, id: Union[str, PyObjectId]):
+        self._store.increment_session(PyObjectId(id), "pres_exch_cleanup_attempts")
+        status_cache.invalidate(str(id))
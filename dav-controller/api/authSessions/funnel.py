@@ -0,0 +1,169 @@
+"""Per-minute funnel analytics of the session lifecycle.
+
+Each session records when it reached every `LifecycleStage` in
+`lifecycle_timestamps`, persisted by the caller's next patch. At the same
+time the cohort of the session (the minute it was created) is counted in the
+session store, in the `session_funnel` collection with MongoDB: one counter
+per stage, and one latency histogram per step of the lifecycle. Reading the
+funnel only touches one small document per minute, never the sessions
+themselves.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import structlog
+from pymongo.database import Database
+from pymongo.errors import PyMongoError
+
+from ..db.store import get_store
+from .models import AuthSessionBase, LifecycleStage
+
+logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
+
+# (name, from stage, to stages)
+LATENCY_STEPS: List[Tuple[str, LifecycleStage, Tuple[LifecycleStage, ...]]] = [
+    ("scan", LifecycleStage.CREATED, (LifecycleStage.SCANNED,)),
+    (
+        "present",
+        LifecycleStage.SCANNED,
+        (LifecycleStage.PRESENTATION_RECEIVED,),
+    ),
+    (
+        "verify",
+        LifecycleStage.PRESENTATION_RECEIVED,
+        (LifecycleStage.SUCCESS, LifecycleStage.FAILURE),
+    ),
+    (
+        "total",
+        LifecycleStage.CREATED,
+        (LifecycleStage.SUCCESS, LifecycleStage.FAILURE),
+    ),
+]
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS_MS = [
+    250,
+    500,
+    1000,
+    2000,
+    5000,
+    10000,
+    20000,
+    30000,
+    60000,
+    120000,
+    300000,
+    600000,
+]
+OVERFLOW_BUCKET = "inf"
+PERCENTILES = (50, 90, 95, 99)
+
+
+def _bucket(latency_ms: float) -> str:
+    for bound in LATENCY_BUCKETS_MS:
+        if latency_ms <= bound:
+            return str(bound)
+    return OVERFLOW_BUCKET
+
+
+def _cohort(timestamp: datetime) -> datetime:
+    return timestamp.replace(second=0, microsecond=0)
+
+
+def mark_stage(db: Database, auth_session: AuthSessionBase, stage: LifecycleStage):
+    """Timestamp `stage` on the session and count it in its funnel cohort.
+
+    Stages are only counted once, so replayed webhooks do not inflate the
+    funnel. The session itself is not written, the caller's patch does it.
+    """
+    if stamp_stage(auth_session, stage):
+        count_stage(db, auth_session, stage)
+
+
+def stamp_stage(auth_session: AuthSessionBase, stage: LifecycleStage) -> bool:
+    """Timestamp `stage` on the session, False when it already was."""
+    if stage in auth_session.lifecycle_timestamps:
+        return False
+    auth_session.lifecycle_timestamps[stage] = datetime.now()
+    return True
+
+
+def count_stage(db: Database, auth_session: AuthSessionBase, stage: LifecycleStage):
+    """Count a stage stamped with `stamp_stage` in the session's funnel cohort.
+
+    Separate from the stamp for transitions that may lose a race, which are
+    only counted once their write went through. Best effort, a count that
+    fails to be written is logged and the transition goes on.
+    """
+    timestamps = auth_session.lifecycle_timestamps
+    now = timestamps[stage]
+
+    inc = {f"counts.{stage}": 1}
+    for name, start, ends in LATENCY_STEPS:
+        if stage in ends and start in timestamps:
+            latency_ms = (now - timestamps[start]).total_seconds() * 1000
+            inc[f"latency.{name}.{_bucket(latency_ms)}"] = 1
+
+    try:
+        get_store(db).count_funnel(
+            _cohort(timestamps.get(LifecycleStage.CREATED, now)), inc
+        )
+    except PyMongoError as err:
+        logger.warning("could not count the funnel stage", stage=stage, err=str(err))
+
+
+def _percentile(histogram: Dict[str, int], pct: float) -> Optional[float]:
+    total = sum(histogram.values())
+    if not total:
+        return None
+    target = pct / 100 * total
+    seen = 0
+    for bound in [str(b) for b in LATENCY_BUCKETS_MS] + [OVERFLOW_BUCKET]:
+        seen += histogram.get(bound, 0)
+        if seen >= target:
+            return float(bound) if bound != OVERFLOW_BUCKET else None
+    return None
+
+
+def get_funnel(db: Database, since: datetime, until: datetime) -> Dict:
+    """Sum the per-minute cohorts created in [since, until)."""
+    counts = {stage.value: 0 for stage in LifecycleStage}
+    histograms: Dict[str, Dict[str, int]] = {name: {} for name, _, _ in LATENCY_STEPS}
+    minutes = 0
+    for doc in get_store(db).get_funnel(_cohort(since), until):
+        minutes += 1
+        for stage, count in doc.get("counts", {}).items():
+            counts[stage] = counts.get(stage, 0) + count
+        for name, buckets in doc.get("latency", {}).items():
+            histogram = histograms.setdefault(name, {})
+            for bound, count in buckets.items():
+                histogram[bound] = histogram.get(bound, 0) + count
+
+    created = counts[LifecycleStage.CREATED]
+    conversion = {
+        stage: (count / created if created else None)
+        for stage, count in counts.items()
+        if stage != LifecycleStage.CREATED
+    }
+    latency = {
+        name: {
+            "count": sum(histogram.values()),
+            # Upper bound of the bucket holding the percentile, None if it
+            # is above the largest bucket
+            **{f"p{p}_ms": _percentile(histogram, p) for p in PERCENTILES},
+        }
+        for name, histogram in histograms.items()
+    }
+    return {
+        "since": _cohort(since),
+        "until": until,
+        "minutes_with_sessions": minutes,
+        "counts": counts,
+        "conversion": conversion,
+        "latency": latency,
+    }
+
+
+def get_recent_funnel(db: Database, minutes: int) -> Dict:
+    until = datetime.now()
+    return get_funnel(db, until - timedelta(minutes=minutes), until)
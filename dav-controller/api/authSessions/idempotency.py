@@ -0,0 +1,209 @@
+"""Idempotency-Key support for creating sessions.
+
+The first request with a key claims it with an `idempotency_key` record of
+the session store, creates the session and stores the response on the record. Repeats
+of the key get the stored response back without another presentation
+request being created with the agent. When the response could not be
+stored, the claim is kept and marked failed, and repeats get a 409 rather
+than a second session. Duplicates arriving while the first
+request is still running wait for it: in the same worker on its future, in
+other workers on the record. Records expire after
+CONTROLLER_IDEMPOTENCY_KEY_TTL seconds.
+"""
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import canonicaljson
+import structlog
+from fastapi import HTTPException
+from fastapi import status as http_status
+from pymongo.database import Database
+
+from ..core.config import settings
+from ..core.models import AgeVerificationModelCreate, AgeVerificationModelCreateRead
+from ..db.collections import COLLECTION_NAMES
+from ..db.profiles import DB_PROFILES
+from ..db.store import SessionStore, get_store
+
+logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
+
+KIND = COLLECTION_NAMES.IDEMPOTENCY_KEY
+PROFILE = DB_PROFILES.CRITICAL_TRANSITION
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.1
+# Agent calls of one creation: the multi-tenant token and the request itself
+AGENT_CALLS_PER_CREATION = 2
+
+_in_flight: Dict[str, Tuple[str, asyncio.Future]] = {}
+
+
+def max_creation_seconds() -> float:
+    """The longest a creation can hold its claim while still alive."""
+    return float(settings.CONTROLLER_EXCHANGE_CREATION_QUEUE_TIMEOUT) + (
+        AGENT_CALLS_PER_CREATION * float(settings.CONTROLLER_AGENT_TIMEOUT)
+    )
+
+
+def check_settings():
+    """Raise when a live claim could be taken for an abandoned one."""
+    abandoned_after = float(settings.CONTROLLER_IDEMPOTENCY_ABANDONED_AFTER)
+    if abandoned_after <= max_creation_seconds():
+        raise ValueError(
+            f"CONTROLLER_IDEMPOTENCY_ABANDONED_AFTER ({abandoned_after}s) must "
+            f"exceed the longest a creation can take ({max_creation_seconds()}s), "
+            "the exchange creation queue timeout plus two agent timeouts"
+        )
+
+
+def record_id(api_key: Optional[str], idempotency_key: str) -> str:
+    # Keys are scoped to the caller, without storing the api key itself
+    return hashlib.sha256(f"{api_key or ''}:{idempotency_key}".encode()).hexdigest()
+
+
+def fingerprint(request: AgeVerificationModelCreate) -> str:
+    return hashlib.sha256(
+        canonicaljson.encode_canonical_json(request.dict())
+    ).hexdigest()
+
+
+def _key_reused():
+    raise HTTPException(
+        status_code=http_status.HTTP_422_UNPROCESSABLE_ENTITY,
+        detail="Idempotency-Key was already used with a different request",
+    )
+
+
+def _failed():
+    raise HTTPException(
+        status_code=http_status.HTTP_409_CONFLICT,
+        detail="The request with this Idempotency-Key created a session, "
+        "but its response was lost",
+    )
+
+
+def _still_in_progress():
+    raise HTTPException(
+        status_code=http_status.HTTP_409_CONFLICT,
+        detail="A request with this Idempotency-Key is still in progress",
+    )
+
+
+async def _wait_for_response(
+    store: SessionStore, id: str, request_fingerprint: str
+) -> Optional[AgeVerificationModelCreateRead]:
+    """Stored response of a claimed key, None if the claim went away."""
+    waited = 0.0
+    while True:
+        record = store.get_record(KIND, id, PROFILE)
+        if record is None:
+            return None
+        if record["fingerprint"] != request_fingerprint:
+            _key_reused()
+        if record.get("response") is not None:
+            return AgeVerificationModelCreateRead.parse_obj(record["response"])
+        if record.get("failed"):
+            _failed()
+        # A claim without a response after this long belongs to a worker
+        # that died
+        abandoned_after = timedelta(
+            seconds=float(settings.CONTROLLER_IDEMPOTENCY_ABANDONED_AFTER)
+        )
+        if datetime.utcnow() - record["created_at"] > abandoned_after:
+            store.delete_record(
+                KIND, id, PROFILE, match={"created_at": record["created_at"]}
+            )
+            return None
+        if waited >= settings.CONTROLLER_IDEMPOTENCY_WAIT_TIMEOUT:
+            _still_in_progress()
+        await asyncio.sleep(POLL_INTERVAL)
+        waited += POLL_INTERVAL
+
+
+async def _claim_and_create(
+    db: Database,
+    id: str,
+    request_fingerprint: str,
+    create: Callable[[], Awaitable[AgeVerificationModelCreateRead]],
+) -> Tuple[AgeVerificationModelCreateRead, bool]:
+    store = get_store(db)
+    while True:
+        now = datetime.utcnow()
+        if store.insert_record(
+            KIND,
+            {
+                "_id": id,
+                "fingerprint": request_fingerprint,
+                "created_at": now,
+                "expires_at": now
+                + timedelta(seconds=settings.CONTROLLER_IDEMPOTENCY_KEY_TTL),
+                "response": None,
+            },
+            PROFILE,
+        ):
+            break
+        response = await _wait_for_response(store, id, request_fingerprint)
+        if response is not None:
+            return response, True
+
+    try:
+        response = await create()
+    except BaseException:
+        # Let a retry of the request have another go
+        store.delete_record(KIND, id, PROFILE)
+        raise
+    try:
+        store.update_record(
+            KIND,
+            id,
+            {
+                "response": response.dict(exclude_unset=True),
+                "session_id": response.id,
+            },
+            PROFILE,
+        )
+    except Exception as err:
+        # The session exists, a retry must not create another one. Left
+        # without a response the claim would be taken for an abandoned one.
+        logger.error("could not store the idempotent response", err=str(err))
+        store.update_record(KIND, id, {"failed": True}, PROFILE)
+    return response, False
+
+
+async def create_once(
+    db: Database,
+    api_key: Optional[str],
+    idempotency_key: str,
+    request: AgeVerificationModelCreate,
+    create: Callable[[], Awaitable[AgeVerificationModelCreateRead]],
+) -> Tuple[AgeVerificationModelCreateRead, bool]:
+    """Run `create` once per key, returns the response and whether it was a replay."""
+    if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+        raise HTTPException(
+            status_code=http_status.HTTP_400_BAD_REQUEST,
+            detail=f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters",
+        )
+    id = record_id(api_key, idempotency_key)
+    request_fingerprint = fingerprint(request)
+
+    if id in _in_flight:
+        in_flight_fingerprint, future = _in_flight[id]
+        if in_flight_fingerprint != request_fingerprint:
+            _key_reused()
+        response, _ = await asyncio.shield(future)
+        return response, True
+
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[id] = (request_fingerprint, future)
+    try:
+        result = await _claim_and_create(db, id, request_fingerprint, create)
+        future.set_result(result)
+        return result
+    except BaseException as err:
+        future.set_exception(err)
+        # Nobody may be waiting, don't warn about it
+        future.exception()
+        raise
+    finally:
+        del _in_flight[id]
@@ -0,0 +1,74 @@
+"""Short codes that stand for a presentation exchange in QR codes.
+
+`CONTROLLER_URL/i/<code>` is shorter than `CONTROLLER_URL/url/pres_exch/<uuid>`,
+which keeps the QR code a few versions smaller, quicker to render and easier
+to scan on low-end phones. A code is CONTROLLER_INVITATION_CODE_LENGTH random
+base62 characters, kept as an `invitation_code` record of the session store
+until shortly after its QR code expires.
+"""
+import secrets
+from datetime import datetime, timedelta
+from typing import Optional
+
+import structlog
+from pymongo.database import Database
+
+from ..core.config import settings
+from ..db.collections import COLLECTION_NAMES
+from ..db.store import get_store
+
+logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
+
+ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+PATH = "/i/"
+# Retries of a code that is already taken, which is rare at any sane length
+MAX_ATTEMPTS = 5
+# Kept past the QR code's expiry for scans that started just before it
+GRACE = timedelta(seconds=60)
+
+
+def base62(number: int, length: int) -> str:
+    digits = []
+    for _ in range(length):
+        number, digit = divmod(number, len(ALPHABET))
+        digits.append(ALPHABET[digit])
+    return "".join(reversed(digits))
+
+
+def new_code(length: int) -> str:
+    return base62(secrets.randbelow(len(ALPHABET) ** length), length)
+
+
+def is_valid(code: str) -> bool:
+    return len(code) == int(settings.CONTROLLER_INVITATION_CODE_LENGTH) and all(
+        c in ALPHABET for c in code
+    )
+
+
+def create(db: Database, pres_exch_id: str) -> str:
+    """A new code for the exchange, forgotten once its QR code expires."""
+    store = get_store(db)
+    # In UTC as the TTL index expects
+    expires_at = (
+        datetime.utcnow()
+        + timedelta(seconds=int(settings.CONTROLLER_PRESENTATION_EXPIRE_TIME))
+        + GRACE
+    )
+    length = int(settings.CONTROLLER_INVITATION_CODE_LENGTH)
+    for _ in range(MAX_ATTEMPTS):
+        code = new_code(length)
+        if store.insert_record(
+            COLLECTION_NAMES.INVITATION_CODE,
+            {"_id": code, "pres_exch_id": pres_exch_id, "expires_at": expires_at},
+        ):
+            return code
+        logger.info("invitation code taken, drawing another")
+    raise RuntimeError("could not draw a free invitation code")
+
+
+def resolve(db: Database, code: str) -> Optional[str]:
+    """The exchange of a code, None when unknown or expired."""
+    if not is_valid(code):
+        return None
+    record = get_store(db).get_record(COLLECTION_NAMES.INVITATION_CODE, code)
+    return record["pres_exch_id"] if record else None
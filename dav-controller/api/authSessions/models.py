@@ -18,14 +18,37 @@ class AuthSessionState(StrEnum):
     ABORTED = auto()
 
 
+TERMINAL_STATES = (
+    AuthSessionState.SUCCESS,
+    AuthSessionState.FAILURE,
+    AuthSessionState.EXPIRED,
+    AuthSessionState.ABORTED,
+)
+
+
+class LifecycleStage(StrEnum):
+    CREATED = auto()
+    SCANNED = auto()
+    PRESENTATION_RECEIVED = auto()
+    SUCCESS = auto()
+    FAILURE = auto()
+    EXPIRED = auto()
+
+
 class AuthSessionBase(BaseModel):
     pres_exch_id: str
+    # Computed per session, not once when the module is imported
     expired_timestamp: datetime = Field(
-        default=datetime.now()
-        + timedelta(seconds=settings.CONTROLLER_PRESENTATION_EXPIRE_TIME)
+        default_factory=lambda: datetime.now()
+        + timedelta(seconds=int(settings.CONTROLLER_PRESENTATION_EXPIRE_TIME))
     )
     metadata: Optional[dict] = None
     notify_endpoint: Optional[str] = None
+    # Copied from the pres_ex_id_to_proof_req_config_id mapping so that
+    # searches can filter on it, unset on sessions created before
+    proof_req_config_id: Optional[str] = None
+    # When the session reached each LifecycleStage, see authSessions/funnel.py
+    lifecycle_timestamps: Dict[str, datetime] = Field(default_factory=dict)
 
     # @validator('metadata')
     # def prevent_dict_none(cls, v):
@@ -43,6 +66,11 @@ class AuthSessionBase(BaseModel):
 
 class AuthSession(AuthSessionBase, UUIDModel):
     proof_status: AuthSessionState = Field(default=AuthSessionState.INITIATED)
+    # Only written by the presentation exchange cleanup, they are left out of
+    # AuthSessionPatch so that stale copies of a session cannot reset them.
+    revealed_attributes: Optional[Dict[str, str]] = None
+    pres_exch_deleted_at: Optional[datetime] = None
+    pres_exch_cleanup_attempts: int = 0
 
     @property
     def presentation_exchange(self) -> Dict:
@@ -50,6 +78,24 @@ class AuthSession(AuthSessionBase, UUIDModel):
         return client.get_presentation_request(self.pres_exch_id)
 
 
+class AuthSessionStatus(UUIDModel):
+    """What status checks read, fetched with `AuthSessionStatus.projection()`.
+
+    Read only, mutations go through the full AuthSession.
+    """
+
+    pres_exch_id: str
+    proof_status: AuthSessionState = Field(default=AuthSessionState.INITIATED)
+    expired_timestamp: datetime
+    metadata: Optional[dict] = None
+    notify_endpoint: Optional[str] = None
+    revealed_attributes: Optional[Dict[str, str]] = None
+
+    @classmethod
+    def projection(cls) -> Dict[str, int]:
+        return {field.alias: 1 for field in cls.__fields__.values()}
+
+
 class AuthSessionCreate(AuthSessionBase):
     pass
 
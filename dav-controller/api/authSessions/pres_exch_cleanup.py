@@ -0,0 +1,89 @@
+"""Delete presentation exchange records from the agent once they are done with.
+
+ACA-Py keeps every exchange record in its wallet storage unless told
+otherwise. Once a session reaches a terminal state the controller only needs
+the revealed attributes, which are copied onto the session before the record
+is deleted through the admin API. They stay in MongoDB, a photo included when
+the proof configuration requests one, until the session is archived, which is
+why the cleanup is disabled by default.
+"""
+import asyncio
+from datetime import datetime
+import structlog
+from pymongo.database import Database
+
+from ..core.acapy.client import AcapyClient, get_revealed_attributes
+from ..core.config import settings
+from ..core.jobs import Job
+from .crud import AuthSessionCRUD
+from .models import AuthSession, AuthSessionState
+
+logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
+
+# Sessions are skipped after this many failed attempts
+MAX_ATTEMPTS = 5
+
+stats = {
+    "runs": 0,
+    "deleted": 0,
+    "already_deleted": 0,
+    "errors": 0,
+    "last_run_at": None,
+}
+
+
+async def _cleanup_session(
+    crud: AuthSessionCRUD, client: AcapyClient, auth_session: AuthSession
+):
+    if (
+        auth_session.proof_status == AuthSessionState.SUCCESS
+        and auth_session.revealed_attributes is None
+    ):
+        pres_exch = await asyncio.to_thread(
+            client.get_presentation_request, auth_session.pres_exch_id
+        )
+        await crud.set_revealed_attributes(
+            auth_session.id, get_revealed_attributes(pres_exch)
+        )
+
+    deleted = await asyncio.to_thread(
+        client.delete_presentation_request, auth_session.pres_exch_id
+    )
+    await crud.mark_pres_exch_deleted(auth_session.id)
+    stats["deleted" if deleted else "already_deleted"] += 1
+
+
+async def cleanup_batch(db: Database, batch_size: int, rate: float) -> int:
+    """Clean up one batch, at most `rate` agent deletions per second."""
+    crud = AuthSessionCRUD(db)
+    client = AcapyClient(db=db)
+    batch = await crud.get_pres_exch_cleanup_batch(batch_size, MAX_ATTEMPTS)
+    for auth_session in batch:
+        try:
+            await _cleanup_session(crud, client, auth_session)
+        except Exception as err:
+            stats["errors"] += 1
+            logger.warning(
+                "presentation exchange cleanup failed",
+                pres_exch_id=auth_session.pres_exch_id,
+                err=str(err),
+            )
+            await crud.mark_pres_exch_cleanup_failed(auth_session.id)
+        await asyncio.sleep(1 / rate)
+    stats["runs"] += 1
+    stats["last_run_at"] = datetime.now()
+    return len(batch)
+
+
+async def run(db: Database) -> bool:
+    batch_size = settings.CONTROLLER_PRES_EXCH_CLEANUP_BATCH_SIZE
+    cleaned = await cleanup_batch(
+        db, batch_size, settings.CONTROLLER_PRES_EXCH_CLEANUP_RATE
+    )
+    # Keep going while there is a backlog, the rate limit still applies
+    return cleaned >= batch_size
+
+
+JOB = Job(
+    "pres_exch_cleanup", run, lambda: settings.CONTROLLER_PRES_EXCH_CLEANUP_INTERVAL
+)
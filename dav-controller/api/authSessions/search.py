@@ -0,0 +1,218 @@
+"""Search and export of sessions for verification reports.
+
+Results are ordered newest first by `_id`, which also holds the creation
+time, so the time range and the position of a page are both bounds on
+`_id`. A page is a single range scan of the (proof_status, _id) or
+(proof_req_config_id, _id) index however deep it is, and the cursor handed
+to the client is the id of the last session it got.
+
+Exports go through one server side cursor, CONTROLLER_EXPORT_BATCH_SIZE
+sessions at a time, and are streamed as they are read. Revealed attributes
+are never part of a report.
+"""
+import csv
+import io
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import structlog
+from bson import ObjectId
+from fastapi import HTTPException, Query
+from fastapi import status as http_status
+from pydantic import BaseModel
+from pymongo import DESCENDING
+from pymongo.database import Database
+
+from ..core.config import settings
+from ..core.models import PyObjectId
+from ..core.serialization import dumps
+from ..db.collections import COLLECTION_NAMES
+from ..db.profiles import DB_PROFILES, get_collection
+from ..db.store import SESSION_STORE_MEMORY
+from .models import AuthSessionState, LifecycleStage
+
+logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
+
+REPORT_PROJECTION = {
+    "_id": 1,
+    "pres_exch_id": 1,
+    "proof_status": 1,
+    "proof_req_config_id": 1,
+    "expired_timestamp": 1,
+    "lifecycle_timestamps": 1,
+    "metadata": 1,
+}
+
+CSV_COLUMNS = [
+    "id",
+    "status",
+    "pres_exch_id",
+    "proof_req_config_id",
+    "created_at",
+    "expired_timestamp",
+    *(f"lifecycle_{stage}" for stage in LifecycleStage),
+    "metadata",
+]
+
+# Bytes gathered before a chunk of an export is sent
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+class SessionFilter(BaseModel):
+    states: Optional[List[AuthSessionState]] = None
+    # Naive datetimes are UTC, like the creation time in `_id`
+    created_after: Optional[datetime] = None
+    created_before: Optional[datetime] = None
+    proof_req_config_id: Optional[str] = None
+
+    def query(self, after: Optional[str] = None) -> Dict:
+        """The MongoDB query, for the sessions that follow `after` if given."""
+        query = {}
+        if self.states:
+            query["proof_status"] = {"$in": [str(state) for state in self.states]}
+        if self.proof_req_config_id:
+            query["proof_req_config_id"] = self.proof_req_config_id
+        id_range = {}
+        if self.created_after:
+            id_range["$gte"] = ObjectId.from_datetime(self.created_after)
+        if self.created_before:
+            id_range["$lt"] = ObjectId.from_datetime(self.created_before)
+        if after is not None:
+            # Results are newest first, the next page is below the cursor
+            cursor_id = ObjectId(after)
+            id_range["$lt"] = min(id_range.get("$lt", cursor_id), cursor_id)
+        if id_range:
+            query["_id"] = id_range
+        return query
+
+
+def require_searchable_store():
+    """Searches read the `auth_session` collection, which the memory session
+    store leaves empty, so they are refused rather than answered empty."""
+    if settings.CONTROLLER_SESSION_STORE == SESSION_STORE_MEMORY:
+        raise HTTPException(
+            status_code=http_status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Search and export need CONTROLLER_SESSION_STORE=mongo",
+        )
+
+
+def session_filter(
+    state: Optional[List[AuthSessionState]] = Query(default=None),
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    proof_config: Optional[str] = None,
+) -> SessionFilter:
+    """Query parameters of the search and export endpoints."""
+    return SessionFilter(
+        states=state,
+        created_after=created_after,
+        created_before=created_before,
+        proof_req_config_id=proof_config,
+    )
+
+
+def report_row(auth_session: dict) -> Dict:
+    return {
+        "id": str(auth_session["_id"]),
+        "status": auth_session.get("proof_status"),
+        "pres_exch_id": auth_session.get("pres_exch_id"),
+        "proof_req_config_id": auth_session.get("proof_req_config_id"),
+        "created_at": auth_session["_id"].generation_time.replace(tzinfo=None),
+        "expired_timestamp": auth_session.get("expired_timestamp"),
+        "lifecycle_timestamps": auth_session.get("lifecycle_timestamps") or {},
+        "metadata": auth_session.get("metadata"),
+    }
+
+
+def search(
+    db: Database,
+    session_filter: SessionFilter,
+    limit: int,
+    cursor: Optional[str] = None,
+) -> Tuple[List[Dict], Optional[str]]:
+    """One page of reports and the cursor of the next page, if any."""
+    if cursor is not None and not PyObjectId.is_valid(cursor):
+        raise HTTPException(
+            status_code=http_status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid cursor: {cursor}",
+        )
+    col = get_collection(db, COLLECTION_NAMES.AUTH_SESSION, DB_PROFILES.STALE_OK_READ)
+    # One more than asked tells whether there is a next page
+    found = list(
+        col.find(session_filter.query(cursor), REPORT_PROJECTION)
+        .sort("_id", DESCENDING)
+        .limit(limit + 1)
+    )
+    items = [report_row(auth_session) for auth_session in found[:limit]]
+    next_cursor = items[-1]["id"] if len(found) > limit else None
+    return items, next_cursor
+
+
+def export_rows(db: Database, session_filter: SessionFilter) -> Iterator[Dict]:
+    col = get_collection(db, COLLECTION_NAMES.AUTH_SESSION, DB_PROFILES.STALE_OK_READ)
+    cursor = col.find(
+        session_filter.query(),
+        REPORT_PROJECTION,
+        batch_size=int(settings.CONTROLLER_EXPORT_BATCH_SIZE),
+    ).sort("_id", DESCENDING)
+    try:
+        for auth_session in cursor:
+            yield report_row(auth_session)
+    finally:
+        # Also reached when the client goes away mid export
+        cursor.close()
+
+
+def _chunked(lines: Iterator[bytes]) -> Iterator[bytes]:
+    """Group lines so the response is not sent one row at a time."""
+    chunk = []
+    size = 0
+    for line in lines:
+        chunk.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield b"".join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield b"".join(chunk)
+
+
+def _isoformat(value: Optional[datetime]) -> str:
+    return value.isoformat() if value is not None else ""
+
+
+def _csv_lines(rows: Iterator[Dict]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(values) -> bytes:
+        writer.writerow(values)
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value.encode("utf-8")
+
+    yield line(CSV_COLUMNS)
+    for row in rows:
+        lifecycle = row["lifecycle_timestamps"]
+        yield line(
+            [
+                row["id"],
+                row["status"],
+                row["pres_exch_id"],
+                row["proof_req_config_id"] or "",
+                _isoformat(row["created_at"]),
+                _isoformat(row["expired_timestamp"]),
+                *(_isoformat(lifecycle.get(str(stage))) for stage in LifecycleStage),
+                dumps(row["metadata"]).decode("utf-8") if row["metadata"] else "",
+            ]
+        )
+
+
+def export_ndjson(db: Database, session_filter: SessionFilter) -> Iterator[bytes]:
+    return _chunked(dumps(row) + b"\n" for row in export_rows(db, session_filter))
+
+
+def export_csv(db: Database, session_filter: SessionFilter) -> Iterator[bytes]:
+    return _chunked(_csv_lines(export_rows(db, session_filter)))
@@ -0,0 +1,168 @@
+"""In-process cache of session status snapshots, filled by reads.
+
+`AuthSessionCRUD.get_status` reads through the cache and every write of
+`AuthSessionCRUD` invalidates the session it wrote, so within a worker a
+cached status is never older than the last write. A read only fills the
+cache when no invalidation of that session happened while it was reading,
+which keeps a slow read from putting back what a write just replaced.
+
+Writes made by other workers are seen through a MongoDB change stream when
+the deployment has one (replica sets), otherwise entries expire after
+CONTROLLER_STATUS_CACHE_TTL seconds, which bounds how stale they can be.
+The memory session store is only written by its own worker, there is
+nothing to watch.
+"""
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import structlog
+from pymongo.database import Database
+from pymongo.errors import OperationFailure, PyMongoError
+
+from ..core.config import settings
+from ..db.collections import COLLECTION_NAMES
+from ..db.profiles import DB_PROFILES, get_collection
+from ..db.store import get_store
+from .models import AuthSessionStatus
+
+logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
+
+stats = {
+    "hits": 0,
+    "misses": 0,
+    "invalidations": 0,
+    "stale_fills_skipped": 0,
+    "change_stream": "stopped",
+}
+
+
+class StatusCache:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, Tuple[float, AuthSessionStatus]] = OrderedDict()
+        # Generation of the last invalidation of each recent session, older
+        # ones are folded into _floor so the map stays bounded
+        self._invalidated: OrderedDict[str, int] = OrderedDict()
+        self._floor = 0
+        self._generations = itertools.count(1)
+        self._generation = 0
+        # Invalidations also come from the change stream thread
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.ttl > 0
+
+    def get(self, id: str) -> Optional[AuthSessionStatus]:
+        with self._lock:
+            entry = self._entries.get(id)
+            if entry is None or entry[0] < time.monotonic():
+                stats["misses"] += 1
+                return None
+            self._entries.move_to_end(id)
+            stats["hits"] += 1
+            return entry[1]
+
+    def token(self) -> int:
+        """Taken before reading from MongoDB, handed back to `put`."""
+        return self._generation
+
+    def put(self, id: str, status: AuthSessionStatus, token: int):
+        with self._lock:
+            if self._invalidated.get(id, self._floor) > token:
+                stats["stale_fills_skipped"] += 1
+                return
+            self._entries[id] = (time.monotonic() + self.ttl, status)
+            self._entries.move_to_end(id)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, id: str):
+        with self._lock:
+            self._generation = next(self._generations)
+            self._entries.pop(id, None)
+            self._invalidated[id] = self._generation
+            self._invalidated.move_to_end(id)
+            if len(self._invalidated) > self.max_size:
+                _, generation = self._invalidated.popitem(last=False)
+                self._floor = max(self._floor, generation)
+            stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation = next(self._generations)
+            self._entries.clear()
+            self._invalidated.clear()
+            self._floor = self._generation
+
+
+cache = StatusCache(
+    settings.CONTROLLER_STATUS_CACHE_SIZE
+    if settings.CONTROLLER_STATUS_CACHE_ENABLED
+    else 0,
+    settings.CONTROLLER_STATUS_CACHE_TTL,
+)
+
+_thread: Optional[threading.Thread] = None
+_stop = threading.Event()
+
+
+def _watch(db: Database, stop: threading.Event):
+    col = get_collection(db, COLLECTION_NAMES.AUTH_SESSION, DB_PROFILES.DEFAULT)
+    pipeline = [{"$project": {"documentKey": 1, "operationType": 1}}]
+    while not stop.is_set():
+        try:
+            with col.watch(pipeline, max_await_time_ms=1000) as stream:
+                # Anything written before the stream opened may be missed
+                cache.clear()
+                stats["change_stream"] = "running"
+                while not stop.is_set():
+                    change = stream.try_next()
+                    if change is not None and "documentKey" in change:
+                        cache.invalidate(str(change["documentKey"]["_id"]))
+        except OperationFailure as err:
+            # Standalone servers have no change streams, the TTL applies
+            stats["change_stream"] = "unavailable"
+            logger.warning("no change stream for the status cache", err=str(err))
+            return
+        except PyMongoError as err:
+            stats["change_stream"] = "reconnecting"
+            logger.warning("status cache change stream failed", err=str(err))
+            stop.wait(5)
+        except Exception as err:
+            stats["change_stream"] = "failed"
+            logger.error("status cache change stream stopped", err=str(err))
+            return
+    stats["change_stream"] = "stopped"
+
+
+def start(db: Database):
+    """Watch the sessions on a thread of its own.
+
+    The watch never returns, under asyncio.to_thread it would hold one of the
+    default executor's threads, which agent calls and probes share, for good.
+    """
+    global _thread
+    if _thread is None and cache.enabled and get_store(db).uses_mongodb:
+        _stop.clear()
+        _thread = threading.Thread(
+            target=_watch, args=(db, _stop), name="status-cache-watch", daemon=True
+        )
+        _thread.start()
+
+
+def stop():
+    global _thread
+    if _thread is not None:
+        _stop.set()
+        # try_next returns at least every max_await_time_ms
+        _thread.join(timeout=2)
+        _thread = None
+
+
+def get_stats() -> Dict:
+    return {**stats, "size": len(cache._entries), "ttl": cache.ttl}
@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta
+
+from pymongo.errors import PyMongoError
+
+from api.authSessions import funnel
+from api.authSessions.models import AuthSessionCreate, LifecycleStage
+from api.db.store import MongoSessionStore
+
+
+def new_session() -> AuthSessionCreate:
+    return AuthSessionCreate(pres_exch_id="pres-exch", proof_req_config_id="config")
+
+
+def test_stages_are_counted_once(db):
+    auth_session = new_session()
+    funnel.mark_stage(db, auth_session, LifecycleStage.CREATED)
+    funnel.mark_stage(db, auth_session, LifecycleStage.CREATED)
+    funnel.mark_stage(db, auth_session, LifecycleStage.SCANNED)
+    report = funnel.get_recent_funnel(db, 5)
+    assert report["counts"][LifecycleStage.CREATED] == 1
+    assert report["counts"][LifecycleStage.SCANNED] == 1
+    assert report["latency"]["scan"]["count"] == 1
+
+
+def test_counts_are_best_effort(db, monkeypatch):
+    def fail(*args):
+        raise PyMongoError("no primary")
+
+    monkeypatch.setattr(MongoSessionStore, "count_funnel", fail)
+    auth_session = new_session()
+    assert funnel.stamp_stage(auth_session, LifecycleStage.CREATED)
+    funnel.count_stage(db, auth_session, LifecycleStage.CREATED)
+    assert LifecycleStage.CREATED in auth_session.lifecycle_timestamps
+
+
+def test_cohorts_are_summed_over_the_window(db):
+    auth_session = new_session()
+    created = datetime.now() - timedelta(minutes=10)
+    auth_session.lifecycle_timestamps[LifecycleStage.CREATED] = created
+    funnel.count_stage(db, auth_session, LifecycleStage.CREATED)
+    assert funnel.get_recent_funnel(db, 5)["counts"][LifecycleStage.CREATED] == 0
+    assert funnel.get_recent_funnel(db, 15)["counts"][LifecycleStage.CREATED] == 1
@@ -0,0 +1,161 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from api.authSessions import idempotency
+from api.core.config import settings
+from api.core.models import AgeVerificationModelCreate, AgeVerificationModelCreateRead
+from api.db.store import MongoSessionStore, get_store
+
+REQUEST = AgeVerificationModelCreate(notify_endpoint=None, metadata={"till": 3})
+
+
+class Creator:
+    """Stands for creating a session, counting the calls."""
+
+    def __init__(self, delay: float = 0, error: BaseException = None):
+        self.calls = 0
+        self.delay = delay
+        self.error = error
+
+    async def __call__(self) -> AgeVerificationModelCreateRead:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return AgeVerificationModelCreateRead(
+            id=f"session-{self.calls}", status="initiated", url="https://qr"
+        )
+
+
+def claim_elsewhere(db, key: str, age: float = 0, **fields):
+    """A claim of the key by another worker, `age` seconds ago."""
+    created_at = datetime.utcnow().replace(microsecond=0) - timedelta(seconds=age)
+    get_store(db).insert_record(
+        idempotency.KIND,
+        {
+            "_id": idempotency.record_id(None, key),
+            "fingerprint": idempotency.fingerprint(REQUEST),
+            "created_at": created_at,
+            "expires_at": created_at + timedelta(hours=1),
+            "response": None,
+            **fields,
+        },
+    )
+
+
+async def create_once(db, create, key: str = "key", request=REQUEST):
+    return await idempotency.create_once(db, None, key, request, create)
+
+
+@pytest.mark.asyncio
+async def test_replays_the_stored_response(db):
+    create = Creator()
+    response, replayed = await create_once(db, create)
+    assert (response.id, replayed) == ("session-1", False)
+    response, replayed = await create_once(db, create)
+    assert (response.id, replayed) == ("session-1", True)
+    # Keys are scoped to the api key
+    response, _ = await idempotency.create_once(db, "other", "key", REQUEST, create)
+    assert response.id == "session-2"
+
+
+@pytest.mark.asyncio
+async def test_changed_request_is_rejected(db):
+    await create_once(db, Creator())
+    changed = AgeVerificationModelCreate(notify_endpoint=None, metadata={"till": 4})
+    with pytest.raises(HTTPException) as err:
+        await create_once(db, Creator(), request=changed)
+    assert err.value.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_key_length_is_checked(db):
+    with pytest.raises(HTTPException) as err:
+        await create_once(db, Creator(), key="k" * (idempotency.MAX_KEY_LENGTH + 1))
+    assert err.value.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_duplicates_in_flight_wait_for_the_first(db):
+    create = Creator(delay=0.1)
+    results = await asyncio.gather(*[create_once(db, create) for _ in range(3)])
+    assert create.calls == 1
+    assert {response.id for response, _ in results} == {"session-1"}
+    assert sorted(replayed for _, replayed in results) == [False, True, True]
+
+
+@pytest.mark.asyncio
+async def test_waits_for_a_claim_of_another_worker(db):
+    claim_elsewhere(db, "key")
+
+    async def respond():
+        await asyncio.sleep(0.2)
+        get_store(db).update_record(
+            idempotency.KIND,
+            idempotency.record_id(None, "key"),
+            {"response": {"id": "theirs", "status": "initiated", "url": "u"}},
+        )
+
+    create = Creator()
+    (response, replayed), _ = await asyncio.gather(create_once(db, create), respond())
+    assert (response.id, replayed, create.calls) == ("theirs", True, 0)
+
+
+@pytest.mark.asyncio
+async def test_gives_up_waiting_on_a_live_claim(db, monkeypatch):
+    monkeypatch.setattr(settings, "CONTROLLER_IDEMPOTENCY_WAIT_TIMEOUT", 0.2)
+    claim_elsewhere(db, "key")
+    create = Creator()
+    with pytest.raises(HTTPException) as err:
+        await create_once(db, create)
+    assert (err.value.status_code, create.calls) == (409, 0)
+
+
+@pytest.mark.asyncio
+async def test_takes_over_an_abandoned_claim(db):
+    age = float(settings.CONTROLLER_IDEMPOTENCY_ABANDONED_AFTER) + 1
+    claim_elsewhere(db, "key", age=age)
+    response, replayed = await create_once(db, Creator())
+    assert (response.id, replayed) == ("session-1", False)
+
+
+@pytest.mark.asyncio
+async def test_failed_creation_can_be_retried(db):
+    with pytest.raises(RuntimeError):
+        await create_once(db, Creator(error=RuntimeError("agent down")))
+    response, replayed = await create_once(db, Creator())
+    assert (response.id, replayed) == ("session-1", False)
+
+
+@pytest.mark.asyncio
+async def test_lost_response_is_not_created_again(db, monkeypatch):
+    update_record = MongoSessionStore.update_record
+
+    def lose_responses(self, kind, id, fields, *args, **kwargs):
+        if "response" in fields:
+            raise RuntimeError("write failed")
+        return update_record(self, kind, id, fields, *args, **kwargs)
+
+    monkeypatch.setattr(MongoSessionStore, "update_record", lose_responses)
+    create = Creator()
+    response, replayed = await create_once(db, create)
+    assert (response.id, replayed) == ("session-1", False)
+    # Even once the claim looks abandoned
+    monkeypatch.setattr(settings, "CONTROLLER_IDEMPOTENCY_ABANDONED_AFTER", -1)
+    with pytest.raises(HTTPException) as err:
+        await create_once(db, create)
+    assert (err.value.status_code, create.calls) == (409, 1)
+
+
+def test_abandoned_after_must_exceed_a_creation(monkeypatch):
+    idempotency.check_settings()
+    monkeypatch.setattr(
+        settings,
+        "CONTROLLER_IDEMPOTENCY_ABANDONED_AFTER",
+        idempotency.max_creation_seconds(),
+    )
+    with pytest.raises(ValueError):
+        idempotency.check_settings()
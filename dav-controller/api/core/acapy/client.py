@@ -1,20 +1,20 @@
-import json
+import copy
 import os
 import time
-import yaml
 
 from datetime import datetime
-from fastapi.encoders import jsonable_encoder
+from functools import cache
 from pymongo.database import Database
 from pydantic import BaseModel
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Union
 from uuid import UUID
 
 import requests
 import structlog
 
-from ...db.session import COLLECTION_NAMES
+from ...db.store import get_store
 from ..config import settings
+from ..serialization import loads
 from .config import AgentConfig, MultiTenantAcapy, SingleTenantAcapy
 from .models import CreatePresentationResponse, WalletDid
 
@@ -25,6 +25,12 @@ WALLET_DID_URI = "/wallet/did"
 PUBLIC_WALLET_DID_URI = "/wallet/did/public"
 CREATE_PRESENTATION_REQUEST_URL = "/present-proof/create-request"
 PRESENT_PROOF_RECORDS = "/present-proof/records"
+STATUS_READY_URI = "/status/ready"
+PROOF_CONFIG_PATH = "/app/api/proof_config.yaml"
+
+# Wallet DIDs by whether they are the public one, they do not change while
+# the controller runs
+_wallet_dids: Dict[bool, WalletDid] = {}
 
 
 class PresExProofConfig(BaseModel):
@@ -35,6 +41,35 @@ class PresExProofConfig(BaseModel):
         allow_population_by_field_name = True
 
 
+def get_revealed_attributes(pres_exch: dict) -> Dict[str, str]:
+    """Raw values of the revealed attributes of a verified presentation."""
+    revealed_attributes = {}
+    proof_revealed_attr_group_dict = pres_exch["presentation"]["requested_proof"][
+        "revealed_attr_groups"
+    ]
+    for req_attr in proof_revealed_attr_group_dict:
+        revealed_attr_value_dict = proof_revealed_attr_group_dict[req_attr]["values"]
+        for key, value in revealed_attr_value_dict.items():
+            revealed_attributes[key] = value["raw"]
+    return revealed_attributes
+
+
+def default_proof_config_ident() -> str:
+    return os.environ.get(
+        "DAV_PROOF_CONFIG_ID", "age-verification-bc-person-credential"
+    )
+
+
+@cache
+def load_proof_config() -> dict:
+    """proof_config.yaml, read once, copy what is taken from it to change it."""
+    # Only needed here, and once
+    import yaml
+
+    with open(PROOF_CONFIG_PATH, "r") as stream:
+        return yaml.safe_load(stream)
+
+
 class AcapyClient:
     acapy_host = settings.ACAPY_ADMIN_URL
     service_endpoint = settings.ACAPY_AGENT_URL
@@ -87,17 +122,13 @@ class AcapyClient:
     ):
         proof_req_dict = None
         if not proof_config_ident:
-            proof_config_ident = os.environ.get(
-                "DAV_PROOF_CONFIG_ID", "age-verification-bc-person-credential"
+            proof_config_ident = default_proof_config_ident()
+        try:
+            proof_req_dict = copy.deepcopy(
+                load_proof_config()[proof_config_ident]["proof-request"]
             )
-        with open("/app/api/proof_config.yaml", "r") as stream:
-            config_dict = yaml.safe_load(stream)
-            try:
-                proof_req_dict = config_dict[proof_config_ident]["proof-request"]
-            except KeyError:
-                raise ValueError(
-                    f"Could not find proof request for {proof_config_ident}"
-                )
+        except KeyError:
+            raise ValueError(f"Could not find proof request for {proof_config_ident}")
         proof_req_dict = self.update_proof_req_dict(proof_req_dict)
         req_attr_dict = {}
         for i, req_attr in enumerate(proof_req_dict["requested_attributes"]):
@@ -109,7 +140,7 @@ class AcapyClient:
             label = os.environ.get("REQ_PRED_LABEL_PREFIX", "req_pred_") + str(i)
             req_pred_dict[label] = req_pred
         proof_req_dict["requested_predicates"] = req_pred_dict
-        logger.error(f"--- {proof_req_dict} ---")
+        logger.debug("generated proof request", proof_req_dict=proof_req_dict)
         return proof_req_dict
 
     def create_presentation_request(
@@ -119,9 +150,7 @@ class AcapyClient:
     ) -> CreatePresentationResponse:
         logger.debug(">>> create_presentation_request")
         if not proof_config_ident:
-            proof_config_ident = os.environ.get(
-                "DAV_PROOF_CONFIG_ID", "age-verification-bc-person-credential"
-            )
+            proof_config_ident = default_proof_config_ident()
         if presentation_request_configuration:
             present_proof_payload = {
                 "proof_request": presentation_request_configuration
@@ -136,24 +165,19 @@ class AcapyClient:
         resp_raw = requests.post(
             self.acapy_host + CREATE_PRESENTATION_REQUEST_URL,
             headers=self.agent_config.get_headers(),
+            timeout=settings.CONTROLLER_AGENT_TIMEOUT,
             json=present_proof_payload,
         )
 
         # TODO: Determine if this should assert it received a json object
         assert resp_raw.status_code == 200, resp_raw.content
 
-        resp = json.loads(resp_raw.content)
+        resp = loads(resp_raw.content)
         result = CreatePresentationResponse.parse_obj(resp)
 
         logger.debug("<<< create_presenation_request")
         pres_ex_id = result.presentation_exchange_id
-        col = self._db.get_collection(
-            COLLECTION_NAMES.PRES_EX_ID_TO_PROOF_REQ_CONFIG_ID
-        )
-        proof_ex_req_config_id = PresExProofConfig(
-            pres_exch_id=pres_ex_id, proof_req_config_id=proof_config_ident
-        )
-        db_result = col.insert_one(jsonable_encoder(proof_ex_req_config_id))
+        get_store(self._db).put_proof_config(pres_ex_id, proof_config_ident)
         return result
 
     def get_presentation_request(self, presentation_exchange_id: Union[UUID, str]):
@@ -165,14 +189,15 @@ class AcapyClient:
             + "/"
             + str(presentation_exchange_id),
             headers=self.agent_config.get_headers(),
+            timeout=settings.CONTROLLER_AGENT_TIMEOUT,
         )
 
         # TODO: Determine if this should assert it received a json object
         assert resp_raw.status_code == 200, resp_raw.content
 
-        resp = json.loads(resp_raw.content)
+        resp = loads(resp_raw.content)
 
-        logger.debug(f"<<< get_presentation_request -> {resp}")
+        logger.debug("<<< get_presentation_request", resp=resp)
         return resp
 
     def verify_presentation(self, presentation_exchange_id: Union[UUID, str]):
@@ -185,16 +210,40 @@ class AcapyClient:
             + str(presentation_exchange_id)
             + "/verify-presentation",
             headers=self.agent_config.get_headers(),
+            timeout=settings.CONTROLLER_AGENT_TIMEOUT,
         )
         assert resp_raw.status_code == 200, resp_raw.content
 
-        resp = json.loads(resp_raw.content)
+        resp = loads(resp_raw.content)
 
-        logger.debug(f"<<< verify_presentation -> {resp}")
+        logger.debug("<<< verify_presentation", resp=resp)
         return resp
 
+    def delete_presentation_request(
+        self, presentation_exchange_id: Union[UUID, str]
+    ) -> bool:
+        """Delete the exchange record, False if the agent no longer had it."""
+        logger.debug(">>> delete_presentation_request")
+
+        resp_raw = requests.delete(
+            self.acapy_host
+            + PRESENT_PROOF_RECORDS
+            + "/"
+            + str(presentation_exchange_id),
+            headers=self.agent_config.get_headers(),
+            timeout=settings.CONTROLLER_AGENT_TIMEOUT,
+        )
+        if resp_raw.status_code == 404:
+            return False
+        assert resp_raw.status_code == 200, resp_raw.content
+
+        logger.debug("<<< delete_presentation_request")
+        return True
+
     def get_wallet_did(self, public=False) -> WalletDid:
         logger.debug(">>> get_wallet_did")
+        if public in _wallet_dids:
+            return _wallet_dids[public]
         url = None
         if public:
             url = self.acapy_host + PUBLIC_WALLET_DID_URI
@@ -204,6 +253,7 @@ class AcapyClient:
         resp_raw = requests.get(
             url,
             headers=self.agent_config.get_headers(),
+            timeout=settings.CONTROLLER_AGENT_TIMEOUT,
         )
 
         # TODO: Determine if this should assert it received a json object
@@ -211,7 +261,7 @@ class AcapyClient:
             resp_raw.status_code == 200
         ), f"{resp_raw.status_code}::{resp_raw.content}"
 
-        resp = json.loads(resp_raw.content)
+        resp = loads(resp_raw.content)
 
         if public:
             resp_payload = resp["result"]
@@ -219,6 +269,29 @@ class AcapyClient:
             resp_payload = resp["results"][0]
 
         did = WalletDid.parse_obj(resp_payload)
+        _wallet_dids[public] = did
 
-        logger.debug(f"<<< get_wallet_did -> {did}")
+        logger.debug("<<< get_wallet_did", did=did)
         return did
+
+    def is_ready(self, timeout: float) -> bool:
+        """Whether the agent reports itself ready, no credentials needed."""
+        resp_raw = requests.get(self.acapy_host + STATUS_READY_URI, timeout=timeout)
+        return resp_raw.status_code == 200 and loads(resp_raw.content).get(
+            "ready", False
+        )
+
+
+def warm_up(db: Database):
+    """Fetch what the first requests would otherwise wait for."""
+    client = AcapyClient(db=db)
+    # The wallet token, with multi-tenant agents
+    client.agent_config.get_headers()
+    client.generate_verification_proof_request()
+    # The DIDs routers/presentation_request.py puts in the messages
+    client.get_wallet_did(
+        public=(not settings.USE_OOB_PRESENT_PROOF)
+        and settings.USE_OOB_LOCAL_DID_SERVICE
+    )
+    if settings.USE_OOB_PRESENT_PROOF and not settings.USE_OOB_LOCAL_DID_SERVICE:
+        client.get_wallet_did(public=True)
@@ -1,11 +1,11 @@
 import requests
 import structlog
-import json
 
 from functools import cache
 from typing import Dict, Protocol
 
 from ..config import settings
+from ..serialization import loads
 
 logger = structlog.getLogger(__name__)
 
@@ -19,16 +19,19 @@ class MultiTenantAcapy:
     wallet_id = settings.MT_ACAPY_WALLET_ID
     wallet_key = settings.MT_ACAPY_WALLET_KEY
 
+    # Shared by all instances, clients are created for every request
+    @classmethod
     @cache
-    def get_wallet_token(self):
+    def get_wallet_token(cls):
         logger.debug(">>> get_wallet_token")
         resp_raw = requests.post(
-            settings.ACAPY_ADMIN_URL + f"/multitenancy/wallet/{self.wallet_id}/token",
+            settings.ACAPY_ADMIN_URL + f"/multitenancy/wallet/{cls.wallet_id}/token",
+            timeout=settings.CONTROLLER_AGENT_TIMEOUT,
         )
         assert (
             resp_raw.status_code == 200
         ), f"{resp_raw.status_code}::{resp_raw.content}"
-        resp = json.loads(resp_raw.content)
+        resp = loads(resp_raw.content)
         wallet_token = resp["token"]
         logger.debug("<<< get_wallet_token")
 
@@ -0,0 +1,33 @@
+import pytest
+from fastapi import HTTPException
+
+from api.core.acapy.webhook_events import SeenEvents
+
+
+def test_only_done_events_are_duplicates(db):
+    worker = SeenEvents()
+    token = worker.claim(db, "event")
+    assert token is not None
+    with pytest.raises(HTTPException) as err:
+        worker.claim(db, "event")
+    assert err.value.status_code == 409
+    worker.done(db, "event", token)
+    assert worker.claim(db, "event") is None
+    # Also once the worker that processed it forgot it
+    assert SeenEvents().claim(db, "event") is None
+
+
+def test_released_claim_is_retried_on_any_worker(db):
+    first, second = SeenEvents(), SeenEvents()
+    token = first.claim(db, "event")
+    with pytest.raises(HTTPException):
+        second.claim(db, "event")
+    first.release(db, "event", token)
+    retry = second.claim(db, "event")
+    assert retry is not None
+    # A stale release does not drop the claim of the retry
+    first.release(db, "event", token)
+    with pytest.raises(HTTPException):
+        first.claim(db, "event")
+    second.done(db, "event", retry)
+    assert first.claim(db, "event") is None
@@ -0,0 +1,161 @@
+"""Record the webhooks the agent delivers, to replay them later.
+
+With CONTROLLER_WEBHOOK_CAPTURE_ENABLED every call of
+`/webhooks/topic/{topic}/` is appended to an NDJSON file in
+CONTROLLER_WEBHOOK_CAPTURE_DIR, one line per webhook:
+
+    {"received_at": 1700000000.123, "topic": "present_proof",
+     "status_code": 200, "handler_ms": 41.2, "body": {...}}
+
+Attribute values of presentations (`raw`, `encoded`, self attested values)
+are replaced with REDACTED before anything is written, the rest of the body
+is kept so that the controller handles a replayed webhook the same way.
+
+Each worker writes its own `webhooks-<opened at>-<pid>.ndjson.part` file and
+renames it to `.ndjson` once it reaches CONTROLLER_WEBHOOK_CAPTURE_MAX_BYTES,
+or when the worker stops. Only the newest CONTROLLER_WEBHOOK_CAPTURE_FILES
+finished files are kept. `python -m benchmarks.loadtest.replay` replays them.
+"""
+import glob
+import os
+from datetime import datetime
+from typing import IO, Any, Optional
+
+import structlog
+
+from ..config import settings
+from ..serialization import dumps, loads
+
+logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
+
+REDACTED = "REDACTED"
+# Values of these keys are attribute values, anywhere in a body
+REDACTED_VALUE_KEYS = frozenset(("raw", "encoded"))
+# Every value of these mappings is an attribute value
+REDACTED_MAPPING_KEYS = frozenset(("self_attested_attrs", "revealed_attrs"))
+
+FILE_PREFIX = "webhooks-"
+FINISHED_SUFFIX = ".ndjson"
+OPEN_SUFFIX = ".ndjson.part"
+
+stats = {"captured": 0, "rotated": 0, "errors": 0}
+
+
+def redact(value: Any) -> Any:
+    """Copy of a webhook body without attribute values."""
+    if isinstance(value, dict):
+        redacted = {}
+        for key, item in value.items():
+            if key in REDACTED_VALUE_KEYS and not isinstance(item, (dict, list)):
+                redacted[key] = REDACTED
+            elif key in REDACTED_MAPPING_KEYS and isinstance(item, dict):
+                redacted[key] = {
+                    name: redact(attr) if isinstance(attr, dict) else REDACTED
+                    for name, attr in item.items()
+                }
+            else:
+                redacted[key] = redact(item)
+        return redacted
+    if isinstance(value, list):
+        return [redact(item) for item in value]
+    return value
+
+
+class WebhookCapture:
+    def __init__(self, directory: str, max_bytes: int, keep_files: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.keep_files = keep_files
+        self._file: Optional[IO[bytes]] = None
+        self._path: Optional[str] = None
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        opened_at = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+        self._path = os.path.join(
+            self.directory, f"{FILE_PREFIX}{opened_at}-{os.getpid()}{OPEN_SUFFIX}"
+        )
+        self._file = open(self._path, "ab")
+
+    def _finish(self):
+        self._file.close()
+        os.replace(self._path, self._path[: -len(OPEN_SUFFIX)] + FINISHED_SUFFIX)
+        self._file = self._path = None
+
+    def _prune(self):
+        # Files still being written by other workers end in .part and are left
+        # alone, the names sort by the time they were opened
+        finished = sorted(
+            glob.glob(os.path.join(self.directory, f"{FILE_PREFIX}*{FINISHED_SUFFIX}"))
+        )
+        for path in finished[: max(len(finished) - self.keep_files, 0)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Pruned by another worker at the same time
+                pass
+
+    def write(self, line: bytes):
+        if self._file is None:
+            self._open()
+        self._file.write(line)
+        # Flushed line by line, so that a crashed worker loses nothing
+        self._file.flush()
+        if self._file.tell() >= self.max_bytes:
+            self._finish()
+            self._prune()
+            stats["rotated"] += 1
+
+    def close(self):
+        if self._file is not None:
+            self._finish()
+            self._prune()
+
+
+_capture: Optional[WebhookCapture] = None
+
+
+def enabled() -> bool:
+    return settings.CONTROLLER_WEBHOOK_CAPTURE_ENABLED
+
+
+def record(
+    topic: str,
+    raw_body: bytes,
+    received_at: float,
+    handler_s: float,
+    status_code: int,
+):
+    """Append one webhook to the capture, failures are logged and ignored."""
+    global _capture
+    try:
+        if _capture is None:
+            _capture = WebhookCapture(
+                settings.CONTROLLER_WEBHOOK_CAPTURE_DIR,
+                int(settings.CONTROLLER_WEBHOOK_CAPTURE_MAX_BYTES),
+                int(settings.CONTROLLER_WEBHOOK_CAPTURE_FILES),
+            )
+        try:
+            body = redact(loads(raw_body))
+        except ValueError:
+            # Not JSON, which the handler would have refused as well
+            body = None
+        entry = {
+            "received_at": received_at,
+            "topic": topic,
+            "status_code": status_code,
+            "handler_ms": round(handler_s * 1000, 3),
+            "body": body,
+        }
+        _capture.write(dumps(entry) + b"\n")
+        stats["captured"] += 1
+    except Exception as err:
+        stats["errors"] += 1
+        logger.warning("could not capture webhook", topic=topic, error=repr(err))
+
+
+def close():
+    global _capture
+    if _capture is not None:
+        _capture.close()
+        _capture = None
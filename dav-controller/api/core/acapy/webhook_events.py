@@ -0,0 +1,132 @@
+"""Recognise webhooks the agent delivers more than once.
+
+ACA-Py retries a webhook when the controller is slow to answer, and the
+same event would otherwise be verified and notified again. An event is
+identified by its topic, exchange id, state and the record's `updated_at`.
+The first delivery claims it with a `webhook_event` record of the session
+store and marks it done once processed, after which it is kept for
+CONTROLLER_WEBHOOK_DEDUP_TTL seconds. Only done events are duplicates:
+deliveries arriving while the first is still processing get a 409, so the
+agent delivers them again later, and a claim is released when processing
+fails. A claim whose worker died expires after as long as processing can
+take. Events done here are also remembered in memory to save the round trip.
+"""
+import hashlib
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+import structlog
+from fastapi import HTTPException
+from fastapi import status as http_status
+from pymongo.database import Database
+
+from ..config import settings
+from ...db.collections import COLLECTION_NAMES
+from ...db.profiles import DB_PROFILES
+from ...db.store import get_store
+
+logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
+
+KIND = COLLECTION_NAMES.WEBHOOK_EVENT
+PROFILE = DB_PROFILES.CRITICAL_TRANSITION
+IN_PROGRESS = "in_progress"
+DONE = "done"
+# Agent calls of one event: the wallet token, verifying the presentation and
+# fetching it for the result token
+AGENT_CALLS_PER_EVENT = 3
+
+stats = {"processed": 0, "duplicates": 0, "in_progress": 0, "released": 0}
+
+
+def event_key(topic: str, webhook_body: dict) -> Optional[str]:
+    """None when the event can't be told apart from later ones."""
+    updated_at = webhook_body.get("updated_at")
+    if not updated_at:
+        return None
+    event = ":".join(
+        [
+            topic,
+            str(webhook_body.get("presentation_exchange_id")),
+            str(webhook_body.get("state")),
+            str(updated_at),
+        ]
+    )
+    return hashlib.sha256(event.encode()).hexdigest()
+
+
+def _expires_at(seconds: float) -> datetime:
+    return datetime.utcnow() + timedelta(seconds=seconds)
+
+
+class SeenEvents:
+    def __init__(self, max_local: int = 10000):
+        self.max_local = max_local
+        # Events known to be done, never claims that may still be released
+        self._local: OrderedDict[str, None] = OrderedDict()
+
+    def _remember(self, key: str):
+        self._local[key] = None
+        self._local.move_to_end(key)
+        if len(self._local) > self.max_local:
+            self._local.popitem(last=False)
+
+    def claim(self, db: Database, key: str) -> Optional[str]:
+        """The token of a new claim on the event, None once it was processed.
+
+        Raises a 409 while another delivery of the event is being processed.
+        """
+        if key in self._local:
+            stats["duplicates"] += 1
+            return None
+        store = get_store(db)
+        token = uuid.uuid4().hex
+        processing_timeout = AGENT_CALLS_PER_EVENT * float(
+            settings.CONTROLLER_AGENT_TIMEOUT
+        )
+        while not store.insert_record(
+            KIND,
+            {
+                "_id": key,
+                "state": IN_PROGRESS,
+                "token": token,
+                "expires_at": _expires_at(processing_timeout),
+            },
+            PROFILE,
+        ):
+            record = store.get_record(KIND, key, PROFILE)
+            if record is None:
+                # Released or expired meanwhile
+                continue
+            if record["state"] == DONE:
+                self._remember(key)
+                stats["duplicates"] += 1
+                return None
+            stats["in_progress"] += 1
+            raise HTTPException(
+                status_code=http_status.HTTP_409_CONFLICT,
+                detail="The event is still being processed",
+            )
+        return token
+
+    def done(self, db: Database, key: str, token: str):
+        """Mark a claimed event processed, later deliveries are duplicates."""
+        fields = {
+            "state": DONE,
+            "expires_at": _expires_at(float(settings.CONTROLLER_WEBHOOK_DEDUP_TTL)),
+        }
+        store = get_store(db)
+        if not store.update_record(KIND, key, fields, PROFILE, match={"token": token}):
+            # Processing outlasted the claim
+            store.insert_record(KIND, {"_id": key, "token": token, **fields}, PROFILE)
+        self._remember(key)
+        stats["processed"] += 1
+
+    def release(self, db: Database, key: str, token: str):
+        """Give up a claim whose processing failed, so a retry gets through."""
+        get_store(db).delete_record(KIND, key, PROFILE, match={"token": token})
+        stats["released"] += 1
+
+
+seen_events = SeenEvents()
@@ -0,0 +1,194 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from ipaddress import ip_address, ip_network
+from typing import Optional
+
+import structlog
+from fastapi import HTTPException, Request, Security
+from fastapi import status as http_status
+
+from .auth import API_KEY, api_key_header
+from .config import settings
+
+logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> Optional[float]:
+        """Take a token, or return the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return None
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token buckets per key, the least recently used keys are forgotten."""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def take(self, key: str) -> Optional[float]:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.take()
+
+
+class TrustedProxies:
+    """Proxies allowed to set X-Forwarded-For, like uvicorn --forwarded-allow-ips.
+
+    A comma separated list of addresses and networks, `*` trusts everyone.
+    """
+
+    def __init__(self, value: str):
+        parts = [part.strip() for part in value.split(",") if part.strip()]
+        self.everyone = "*" in parts
+        self.networks = [
+            ip_network(part, strict=False) for part in parts if part != "*"
+        ]
+
+    def trusts(self, host: str) -> bool:
+        if self.everyone:
+            return True
+        try:
+            address = ip_address(host)
+        except ValueError:
+            return False
+        return any(address in network for network in self.networks)
+
+    def client_host(self, request: Request) -> Optional[str]:
+        """The address of the client, past the trusted proxies in front of it."""
+        if request.client is None:
+            return None
+        host = request.client.host
+        if not self.trusts(host):
+            return host
+        # Proxies append the address they got the request from, the last
+        # untrusted one is the client
+        forwarded_for = request.headers.get("x-forwarded-for", "")
+        for hop in reversed([hop.strip() for hop in forwarded_for.split(",")]):
+            if not hop:
+                continue
+            host = hop
+            if not self.trusts(hop):
+                break
+        return host
+
+
+class ConcurrencyGate:
+    """Caps concurrent work, with a short bounded queue of waiters."""
+
+    def __init__(self, limit: int, max_waiting: int, wait_timeout: float):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    def _overloaded(self):
+        self.rejected += 1
+        logger.warning("rejecting request, too many sessions being created")
+        raise HTTPException(
+            status_code=http_status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many verification requests in progress, please retry",
+            headers={"Retry-After": str(max(1, math.ceil(self.wait_timeout)))},
+        )
+
+    @asynccontextmanager
+    async def slot(self):
+        if not self._semaphore.locked():
+            # Doesn't suspend, unlike acquiring through wait_for
+            await self._semaphore.acquire()
+        elif self.waiting >= self.max_waiting:
+            self._overloaded()
+        else:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.wait_timeout)
+            except asyncio.TimeoutError:
+                self._overloaded()
+            finally:
+                self.waiting -= 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+        }
+
+
+api_key_limiter = RateLimiter(
+    settings.CONTROLLER_RATE_LIMIT_PER_API_KEY,
+    settings.CONTROLLER_RATE_LIMIT_PER_API_KEY_BURST,
+)
+client_ip_limiter = RateLimiter(
+    settings.CONTROLLER_RATE_LIMIT_PER_IP, settings.CONTROLLER_RATE_LIMIT_PER_IP_BURST
+)
+trusted_proxies = TrustedProxies(settings.CONTROLLER_TRUSTED_PROXIES)
+exchange_creation_gate = ConcurrencyGate(
+    settings.CONTROLLER_MAX_CONCURRENT_EXCHANGE_CREATION,
+    settings.CONTROLLER_MAX_QUEUED_EXCHANGE_CREATION,
+    settings.CONTROLLER_EXCHANGE_CREATION_QUEUE_TIMEOUT,
+)
+
+
+def _too_many_requests(retry_after: float):
+    raise HTTPException(
+        status_code=http_status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Rate limit exceeded",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+async def limit_session_creation(
+    request: Request, api_key: Optional[str] = Security(api_key_header)
+):
+    """Per x-api-key and per client IP rate limits for creating sessions.
+
+    Only a valid key gets its own bucket, so rotating made up keys doesn't
+    get around the client IP limit. Behind CONTROLLER_TRUSTED_PROXIES the
+    client IP is taken from X-Forwarded-For.
+    """
+    if api_key and (not API_KEY or api_key == API_KEY) and api_key_limiter.enabled:
+        retry_after = api_key_limiter.take(api_key)
+        if retry_after is not None:
+            _too_many_requests(retry_after)
+    client_host = trusted_proxies.client_host(request)
+    if client_host and client_ip_limiter.enabled:
+        retry_after = client_ip_limiter.take(client_host)
+        if retry_after is not None:
+            _too_many_requests(retry_after)
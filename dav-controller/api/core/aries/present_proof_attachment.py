@@ -1,9 +1,10 @@
-import json
 import base64
 
 from typing import Dict
 from pydantic import BaseModel, Field
 
+from ..serialization import dumps
+
 
 class PresentProofv10Attachment(BaseModel):
     # https://github.com/hyperledger/aries-rfcs/blob/main/features/0037-present-proof/README.md#request-presentation
@@ -17,8 +18,6 @@ class PresentProofv10Attachment(BaseModel):
     ) -> "PresentProofv10Attachment":  # bundle everything needed for the QR code
         return cls(
             data={
-                "base64": base64.b64encode(
-                    json.dumps(presentation_request).encode("ascii")
-                ).decode("ascii")
+                "base64": base64.b64encode(dumps(presentation_request)).decode("ascii")
             }
         )
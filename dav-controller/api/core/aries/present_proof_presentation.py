@@ -1,9 +1,9 @@
-import json
 import base64
 from typing import Optional, List
 
 from pydantic import BaseModel, Field
 from api.core.aries import PresentProofv10Attachment, ServiceDecorator
+from api.core.serialization import dumps
 
 
 class PresentationRequestMessage(BaseModel):
@@ -23,7 +23,5 @@ class PresentationRequestMessage(BaseModel):
         allow_population_by_field_name = True
 
     def b64_str(self):
-        # object->dict->jsonString->ascii->ENCODE->ascii
-        return base64.b64encode(
-            json.dumps(self.dict(by_alias=True)).encode("ascii")
-        ).decode("ascii")
+        # object->dict->json bytes->ENCODE->ascii
+        return base64.b64encode(dumps(self.dict(by_alias=True))).decode("ascii")
@@ -15,3 +15,17 @@ async def get_api_key(api_key_header: str = Security(api_key_header)):
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Could not validate x-api-key",
         )
+
+
+async def require_api_key(api_key_header: str = Security(api_key_header)):
+    """Like get_api_key, but refuses everyone while no key is configured.
+
+    For bulk reads of session data and operator endpoints, which must not
+    be open on a deployment that left CONTROLLER_API_KEY unset.
+    """
+    if not API_KEY:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="CONTROLLER_API_KEY is not configured",
+        )
+    return await get_api_key(api_key_header)
@@ -0,0 +1,173 @@
+"""Response compression, brotli when the client and the install support it,
+gzip otherwise.
+
+Only text responses (HTML, JSON, SVG, ...) are compressed, and responses
+that already carry a Content-Encoding, such as the precompressed static
+assets, are passed through. Streamed responses are flushed chunk by chunk
+so that they keep streaming.
+"""
+import zlib
+from typing import Dict, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "image/svg+xml",
+)
+
+
+def _accepted(accept_encoding: str) -> Dict[str, float]:
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+    return accepted
+
+
+def choose_encoding(accept_encoding: str, available=("br", "gzip")) -> Optional[str]:
+    """Best of `available` the client accepts, br before gzip on ties."""
+    accepted = _accepted(accept_encoding)
+    best, best_quality = None, 0.0
+    for coding in available:
+        if coding == "br" and brotli is None:
+            continue
+        quality = accepted.get(coding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """One shot compression at the highest level, for content built once."""
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+class _Compressor:
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            # wbits of 31 gives a gzip container
+            self._zlib = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes) -> bytes:
+        """Compress and flush, so the client gets the data right away."""
+        if self.encoding == "br":
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "br":
+            return self._brotli.process(data) + self._brotli.finish()
+        return self._zlib.compress(data) + self._zlib.flush()
+
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 500,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http":
+            encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+            if encoding:
+                responder = _CompressionResponder(
+                    send,
+                    _Compressor(encoding, self.gzip_level, self.brotli_quality),
+                    self.minimum_size,
+                )
+                await self.app(scope, receive, responder.send)
+                return
+        await self.app(scope, receive, send)
+
+
+class _CompressionResponder:
+    def __init__(self, send: Send, compressor: _Compressor, minimum_size: int):
+        self._send = send
+        self.compressor = compressor
+        self.minimum_size = minimum_size
+        self.start_message: Optional[Message] = None
+        # None until the first body message decides it
+        self.compressing: Optional[bool] = None
+
+    def _compressible(self) -> bool:
+        headers = Headers(raw=self.start_message["headers"])
+        content_type = headers.get("content-type", "")
+        return "content-encoding" not in headers and content_type.startswith(
+            COMPRESSIBLE_TYPES
+        )
+
+    def _set_headers(self, content_length: Optional[int]):
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        headers["Content-Encoding"] = self.compressor.encoding
+        headers.add_vary_header("Accept-Encoding")
+        if content_length is None:
+            del headers["Content-Length"]
+        else:
+            headers["Content-Length"] = str(content_length)
+
+    async def send(self, message: Message):
+        if message["type"] == "http.response.start":
+            # Held back until the body shows whether to compress
+            self.start_message = message
+            return
+        if message["type"] != "http.response.body":
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compressing is None:
+            self.compressing = self._compressible() and (
+                more_body or len(body) >= self.minimum_size
+            )
+            if not self.compressing:
+                await self._send(self.start_message)
+                await self._send(message)
+                return
+            if more_body:
+                self._set_headers(None)
+                message["body"] = self.compressor.chunk(body)
+            else:
+                message["body"] = self.compressor.finish(body)
+                self._set_headers(len(message["body"]))
+            await self._send(self.start_message)
+            await self._send(message)
+            return
+
+        if self.compressing:
+            message["body"] = (
+                self.compressor.chunk(body)
+                if more_body
+                else self.compressor.finish(body)
+            )
+        await self._send(message)
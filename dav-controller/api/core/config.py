@@ -2,7 +2,6 @@ import json
 import logging
 import logging.config
 import os
-import sys
 from enum import Enum
 from functools import lru_cache
 from pathlib import Path
@@ -11,6 +10,8 @@ from typing import Optional, Union
 import structlog
 from pydantic import BaseSettings
 
+from .logger_util import configure_logging
+
 
 # Removed in later versions of python
 def strtobool(val: str | bool) -> bool:
@@ -43,10 +44,6 @@ use_json_logs: bool = strtobool(
 
 time_stamp_format: str = os.environ.get("LOG_TIMESTAMP_FORMAT", "iso")
 
-with open((Path(__file__).parent.parent / "logconf.json").resolve()) as user_file:
-    file_contents: dict = json.loads(user_file.read())
-    logging.config.dictConfig(file_contents["logger"])
-
 
 def determine_log_level():
     log_level = os.environ.get("LOG_LEVEL")
@@ -62,66 +59,25 @@ def determine_log_level():
         return logging.DEBUG
 
 
-logging.basicConfig(
-    format="%(message)s",
-    stream=sys.stdout,
-    level=determine_log_level(),
-)
-
-shared_processors = [
-    structlog.contextvars.merge_contextvars,
-    structlog.stdlib.add_logger_name,
-    structlog.stdlib.PositionalArgumentsFormatter(),
-    structlog.stdlib.ExtraAdder(),
-    structlog.processors.StackInfoRenderer(),
-    structlog.stdlib.add_log_level,
-    structlog.processors.TimeStamper(fmt=time_stamp_format),
-]
-
-renderer = (
-    structlog.processors.JSONRenderer()
-    if use_json_logs
-    else structlog.dev.ConsoleRenderer()
-)
+def setup_logging():
+    """Configure logging from logconf.json and the LOG_* variables.
 
-# override uvicorn logging to use logstruct
-formatter = structlog.stdlib.ProcessorFormatter(
-    # These run ONLY on `logging` entries that do NOT originate within
-    # structlog.
-    foreign_pre_chain=shared_processors,
-    # These run on ALL entries after the pre_chain is done.
-    processors=[
-        # Remove _record & _from_structlog.
-        structlog.stdlib.ProcessorFormatter.remove_processors_meta,
-        renderer,
-    ],
-)
+    Called when the application starts rather than on import, so that
+    importing the settings has no side effects.
+    """
+    with open((Path(__file__).parent.parent / "logconf.json").resolve()) as user_file:
+        file_contents: dict = json.loads(user_file.read())
+        logging.config.dictConfig(file_contents["logger"])
+
+    configure_logging(
+        level=determine_log_level(),
+        use_json_logs=use_json_logs,
+        time_stamp_format=time_stamp_format,
+        async_emit=strtobool(os.environ.get("LOG_ASYNC", False)),
+        queue_size=int(os.environ.get("LOG_QUEUE_SIZE", 10000)),
+        sample_rates=os.environ.get("LOG_SAMPLE_RATES", ""),
+    )
 
-handler = logging.StreamHandler()
-handler.setFormatter(formatter)
-
-for _log in ["uvicorn", "uvicorn.error"]:
-    # Clear the log handlers for uvicorn loggers, and enable propagation
-    # so the messages are caught by our root logger and formatted correctly
-    # by structlog
-    logging.getLogger(_log).handlers.clear()
-    logging.getLogger(_log).addHandler(handler)
-    logging.getLogger(_log).propagate = False
-
-# This is already handled by our middleware
-logging.getLogger("uvicorn.access").handlers.clear()
-logging.getLogger("uvicorn.access").propagate = False
-
-# Configure structlog
-structlog.configure(
-    processors=[structlog.stdlib.filter_by_level] + shared_processors + [renderer],
-    context_class=dict,
-    logger_factory=structlog.stdlib.LoggerFactory(),
-    wrapper_class=structlog.make_filtering_bound_logger(
-        logging.getLogger().getEffectiveLevel()
-    ),
-    cache_logger_on_first_use=True,
-)
 
 # Setup logger for config
 logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
@@ -152,8 +108,23 @@ class GlobalConfig(BaseSettings):
     DB_USER: str = os.environ.get("DAV_CONTROLLER_DB_USER", "davcontrolleruser")
     DB_PASS: str = os.environ.get("DAV_CONTROLLER_DB_USER_PWD", "davcontrollerpass")
 
-    MONGODB_URL: str = (
-        f"""mongodb://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}?retryWrites=true&w=majority"""  # noqa: E501
+    MONGODB_URL: str = f"""mongodb://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}?retryWrites=true"""  # noqa: E501
+
+    # Write concern, read preference and read concern of each kind of
+    # database access, see api/db/profiles.py. In connection string syntax.
+    CONTROLLER_DB_PROFILE_CRITICAL_TRANSITION: str = os.environ.get(
+        "CONTROLLER_DB_PROFILE_CRITICAL_TRANSITION",
+        "w=majority&journal=true&readPreference=primary&readConcernLevel=majority",
+    )
+    CONTROLLER_DB_PROFILE_DEFAULT: str = os.environ.get(
+        "CONTROLLER_DB_PROFILE_DEFAULT", "w=majority&readPreference=primary"
+    )
+    CONTROLLER_DB_PROFILE_BEST_EFFORT_AUDIT: str = os.environ.get(
+        "CONTROLLER_DB_PROFILE_BEST_EFFORT_AUDIT", "w=1&readPreference=primary"
+    )
+    CONTROLLER_DB_PROFILE_STALE_OK_READ: str = os.environ.get(
+        "CONTROLLER_DB_PROFILE_STALE_OK_READ",
+        "readPreference=secondaryPreferred&maxStalenessSeconds=90",
     )
 
     CONTROLLER_URL: Optional[str] = os.environ.get("CONTROLLER_URL")
@@ -175,6 +146,8 @@ class GlobalConfig(BaseSettings):
     )  # valid options are "multi" and "single"
 
     ACAPY_ADMIN_URL: str = os.environ.get("ACAPY_ADMIN_URL", "http://localhost:8031")
+    # Seconds to wait for an answer to each admin API call of the agent
+    CONTROLLER_AGENT_TIMEOUT: float = os.environ.get("CONTROLLER_AGENT_TIMEOUT", 30)
 
     MT_ACAPY_WALLET_ID: Optional[str] = os.environ.get("MT_ACAPY_WALLET_ID")
     MT_ACAPY_WALLET_KEY: str = os.environ.get("MT_ACAPY_WALLET_KEY", "random-key")
@@ -195,6 +168,231 @@ class GlobalConfig(BaseSettings):
     )
     SET_NON_REVOKED: bool = strtobool(os.environ.get("SET_NON_REVOKED", True))
 
+    # Request profiling, off unless enabled. A request is profiled when it
+    # carries an x-profile header or __profile query parameter along with a
+    # valid x-api-key, or at random with the given sample rate (0 to 1).
+    CONTROLLER_PROFILING_ENABLED: bool = strtobool(
+        os.environ.get("CONTROLLER_PROFILING_ENABLED", False)
+    )
+    CONTROLLER_PROFILING_SAMPLE_RATE: float = os.environ.get(
+        "CONTROLLER_PROFILING_SAMPLE_RATE", 0.0
+    )
+    CONTROLLER_PROFILING_INTERVAL_MS: float = os.environ.get(
+        "CONTROLLER_PROFILING_INTERVAL_MS", 5
+    )
+    CONTROLLER_PROFILING_RING_SIZE: int = os.environ.get(
+        "CONTROLLER_PROFILING_RING_SIZE", 20
+    )
+
+    # Deletion of presentation exchange records from the agent once their
+    # session has reached a terminal state. Off by default, it keeps the
+    # revealed attributes (a photo included) in the session instead.
+    CONTROLLER_PRES_EXCH_CLEANUP_ENABLED: bool = strtobool(
+        os.environ.get("CONTROLLER_PRES_EXCH_CLEANUP_ENABLED", False)
+    )
+    # Seconds between runs when there is no backlog
+    CONTROLLER_PRES_EXCH_CLEANUP_INTERVAL: int = os.environ.get(
+        "CONTROLLER_PRES_EXCH_CLEANUP_INTERVAL", 60
+    )
+    CONTROLLER_PRES_EXCH_CLEANUP_BATCH_SIZE: int = os.environ.get(
+        "CONTROLLER_PRES_EXCH_CLEANUP_BATCH_SIZE", 50
+    )
+    # Maximum number of records deleted per second
+    CONTROLLER_PRES_EXCH_CLEANUP_RATE: float = os.environ.get(
+        "CONTROLLER_PRES_EXCH_CLEANUP_RATE", 10
+    )
+
+    # Archival of finished sessions out of the auth_session collection
+    CONTROLLER_SESSION_ARCHIVE_ENABLED: bool = strtobool(
+        os.environ.get("CONTROLLER_SESSION_ARCHIVE_ENABLED", False)
+    )
+    # Age in seconds (since creation) after which a finished session is archived
+    CONTROLLER_SESSION_ARCHIVE_AFTER: int = os.environ.get(
+        "CONTROLLER_SESSION_ARCHIVE_AFTER", 7 * 24 * 60 * 60
+    )
+    # "collection" (auth_session_archive) or "file" (NDJSON.gz files)
+    CONTROLLER_SESSION_ARCHIVE_TARGET: str = os.environ.get(
+        "CONTROLLER_SESSION_ARCHIVE_TARGET", "collection"
+    )
+    CONTROLLER_SESSION_ARCHIVE_DIR: str = os.environ.get(
+        "CONTROLLER_SESSION_ARCHIVE_DIR", "/app/archive"
+    )
+    CONTROLLER_SESSION_ARCHIVE_BATCH_SIZE: int = os.environ.get(
+        "CONTROLLER_SESSION_ARCHIVE_BATCH_SIZE", 500
+    )
+    CONTROLLER_SESSION_ARCHIVE_INTERVAL: int = os.environ.get(
+        "CONTROLLER_SESSION_ARCHIVE_INTERVAL", 60 * 60
+    )
+
+    # Background jobs (cleanup, archival) run on one replica at a time, the one
+    # holding the job's lease in the `job_lease` collection. A lease is renewed
+    # while its run lasts and taken over CONTROLLER_JOB_LEASE_TTL seconds after
+    # its holder stops renewing it. Intervals vary by CONTROLLER_JOB_INTERVAL_JITTER
+    # (a fraction of the interval), and on shutdown a run in progress gets
+    # CONTROLLER_JOB_SHUTDOWN_GRACE seconds to finish before it is cancelled.
+    CONTROLLER_JOB_LEASE_TTL: int = os.environ.get("CONTROLLER_JOB_LEASE_TTL", 60)
+    CONTROLLER_JOB_INTERVAL_JITTER: float = os.environ.get(
+        "CONTROLLER_JOB_INTERVAL_JITTER", 0.1
+    )
+    CONTROLLER_JOB_SHUTDOWN_GRACE: int = os.environ.get(
+        "CONTROLLER_JOB_SHUTDOWN_GRACE", 10
+    )
+
+    # Where sessions and the records around them are kept, "mongo" or
+    # "memory" (this process only, for a single kiosk or a test run without
+    # MongoDB), see api/db/store.py. The memory store drops its oldest
+    # sessions and records past CONTROLLER_SESSION_STORE_MEMORY_MAX.
+    CONTROLLER_SESSION_STORE: str = os.environ.get("CONTROLLER_SESSION_STORE", "mongo")
+    CONTROLLER_SESSION_STORE_MEMORY_MAX: int = os.environ.get(
+        "CONTROLLER_SESSION_STORE_MEMORY_MAX", 10000
+    )
+
+    # Admission control for session creation (POST /age-verification, and
+    # the page or POST /session creating browser sessions). Rate limits are
+    # token buckets in requests per second, 0 turns the limit off. Requests
+    # over the limit get a 429 with Retry-After.
+    CONTROLLER_RATE_LIMIT_PER_API_KEY: float = os.environ.get(
+        "CONTROLLER_RATE_LIMIT_PER_API_KEY", 0
+    )
+    CONTROLLER_RATE_LIMIT_PER_API_KEY_BURST: float = os.environ.get(
+        "CONTROLLER_RATE_LIMIT_PER_API_KEY_BURST", 50
+    )
+    CONTROLLER_RATE_LIMIT_PER_IP: float = os.environ.get(
+        "CONTROLLER_RATE_LIMIT_PER_IP", 0
+    )
+    CONTROLLER_RATE_LIMIT_PER_IP_BURST: float = os.environ.get(
+        "CONTROLLER_RATE_LIMIT_PER_IP_BURST", 10
+    )
+    # Proxies whose X-Forwarded-For gives the client IP of the per IP limit,
+    # comma separated addresses or networks, "*" for any
+    CONTROLLER_TRUSTED_PROXIES: str = os.environ.get("CONTROLLER_TRUSTED_PROXIES", "")
+    # Presentation requests being created with the agent at once, further
+    # requests wait in a short queue and get a 503 with Retry-After when it
+    # is full or they waited for longer than the timeout (in seconds).
+    CONTROLLER_MAX_CONCURRENT_EXCHANGE_CREATION: int = os.environ.get(
+        "CONTROLLER_MAX_CONCURRENT_EXCHANGE_CREATION", 32
+    )
+    CONTROLLER_MAX_QUEUED_EXCHANGE_CREATION: int = os.environ.get(
+        "CONTROLLER_MAX_QUEUED_EXCHANGE_CREATION", 64
+    )
+    CONTROLLER_EXCHANGE_CREATION_QUEUE_TIMEOUT: float = os.environ.get(
+        "CONTROLLER_EXCHANGE_CREATION_QUEUE_TIMEOUT", 2
+    )
+
+    # Seconds an Idempotency-Key of POST /age-verification is remembered
+    CONTROLLER_IDEMPOTENCY_KEY_TTL: int = os.environ.get(
+        "CONTROLLER_IDEMPOTENCY_KEY_TTL", 24 * 60 * 60
+    )
+    # Seconds a repeated request waits for the first one with the same key
+    # to finish in another worker, before getting a 409
+    CONTROLLER_IDEMPOTENCY_WAIT_TIMEOUT: float = os.environ.get(
+        "CONTROLLER_IDEMPOTENCY_WAIT_TIMEOUT", 10
+    )
+    # Seconds after which a key claimed by a request that never stored its
+    # response is taken over, its worker is assumed dead. Must exceed the
+    # longest a creation can take, which is checked on startup.
+    CONTROLLER_IDEMPOTENCY_ABANDONED_AFTER: float = os.environ.get(
+        "CONTROLLER_IDEMPOTENCY_ABANDONED_AFTER", 120
+    )
+
+    # Seconds a processed agent webhook is remembered, redeliveries of it
+    # within that time are acknowledged without being processed again
+    CONTROLLER_WEBHOOK_DEDUP_TTL: int = os.environ.get(
+        "CONTROLLER_WEBHOOK_DEDUP_TTL", 24 * 60 * 60
+    )
+
+    # Brotli (when installed) or gzip compression of text responses larger
+    # than the minimum size in bytes
+    CONTROLLER_COMPRESSION_ENABLED: bool = strtobool(
+        os.environ.get("CONTROLLER_COMPRESSION_ENABLED", True)
+    )
+    CONTROLLER_COMPRESSION_MIN_SIZE: int = os.environ.get(
+        "CONTROLLER_COMPRESSION_MIN_SIZE", 500
+    )
+
+    # Serve GET / as a cacheable page without a session, the page creates
+    # its session once it is visible and gets the QR code over its socket
+    CONTROLLER_LAZY_SESSION_CREATION: bool = strtobool(
+        os.environ.get("CONTROLLER_LAZY_SESSION_CREATION", False)
+    )
+
+    # JSON library of webhooks, Aries messages and responses: "orjson",
+    # "json" (the standard library) or "auto", orjson when installed
+    CONTROLLER_JSON_BACKEND: str = os.environ.get("CONTROLLER_JSON_BACKEND", "auto")
+
+    # Cache of session statuses for GET /age-verification/{pid}. Writes of
+    # this worker invalidate it right away, writes of other workers through
+    # a MongoDB change stream when there is one (replica sets), otherwise
+    # entries are at most CONTROLLER_STATUS_CACHE_TTL seconds old.
+    CONTROLLER_STATUS_CACHE_ENABLED: bool = strtobool(
+        os.environ.get("CONTROLLER_STATUS_CACHE_ENABLED", True)
+    )
+    CONTROLLER_STATUS_CACHE_TTL: float = os.environ.get(
+        "CONTROLLER_STATUS_CACHE_TTL", 5
+    )
+    CONTROLLER_STATUS_CACHE_SIZE: int = os.environ.get(
+        "CONTROLLER_STATUS_CACHE_SIZE", 10000
+    )
+
+    # Sessions read from MongoDB per round trip by the streaming export
+    CONTROLLER_EXPORT_BATCH_SIZE: int = os.environ.get(
+        "CONTROLLER_EXPORT_BATCH_SIZE", 1000
+    )
+
+    # Seconds between the dependency probes behind GET /ready, which is
+    # also how long a failed warm-up step waits before it is retried
+    CONTROLLER_READINESS_PROBE_INTERVAL: float = os.environ.get(
+        "CONTROLLER_READINESS_PROBE_INTERVAL", 10
+    )
+    CONTROLLER_READINESS_PROBE_TIMEOUT: float = os.environ.get(
+        "CONTROLLER_READINESS_PROBE_TIMEOUT", 2
+    )
+
+    # P-256 private key (PEM) that signs verification results, no results
+    # are signed without one. Its public key is served at
+    # /.well-known/jwks.json.
+    CONTROLLER_RESULT_SIGNING_KEY_PATH: Optional[str] = os.environ.get(
+        "CONTROLLER_RESULT_SIGNING_KEY_PATH"
+    )
+    CONTROLLER_RESULT_TOKEN_TTL: int = os.environ.get(
+        "CONTROLLER_RESULT_TOKEN_TTL", 900
+    )
+
+    # QR codes hold CONTROLLER_URL/i/<code> rather than the longer
+    # CONTROLLER_URL/url/pres_exch/<uuid>, codes are base62 of this length
+    CONTROLLER_SHORT_INVITATION_CODES: bool = strtobool(
+        os.environ.get("CONTROLLER_SHORT_INVITATION_CODES", True)
+    )
+    CONTROLLER_INVITATION_CODE_LENGTH: int = os.environ.get(
+        "CONTROLLER_INVITATION_CODE_LENGTH", 8
+    )
+
+    # Status events kept per session for pages that reconnect to their
+    # socket, and the sessions they are kept for (per worker)
+    CONTROLLER_SOCKET_EVENT_BUFFER_SIZE: int = os.environ.get(
+        "CONTROLLER_SOCKET_EVENT_BUFFER_SIZE", 16
+    )
+    CONTROLLER_SOCKET_EVENT_SESSIONS: int = os.environ.get(
+        "CONTROLLER_SOCKET_EVENT_SESSIONS", 10000
+    )
+
+    # Recording of agent webhooks (attribute values redacted) to NDJSON files
+    # that benchmarks/loadtest/replay.py replays. Each worker starts a new
+    # file after CONTROLLER_WEBHOOK_CAPTURE_MAX_BYTES, and only the newest
+    # CONTROLLER_WEBHOOK_CAPTURE_FILES finished files are kept.
+    CONTROLLER_WEBHOOK_CAPTURE_ENABLED: bool = strtobool(
+        os.environ.get("CONTROLLER_WEBHOOK_CAPTURE_ENABLED", False)
+    )
+    CONTROLLER_WEBHOOK_CAPTURE_DIR: str = os.environ.get(
+        "CONTROLLER_WEBHOOK_CAPTURE_DIR", "/app/captures"
+    )
+    CONTROLLER_WEBHOOK_CAPTURE_MAX_BYTES: int = os.environ.get(
+        "CONTROLLER_WEBHOOK_CAPTURE_MAX_BYTES", 64 * 1024 * 1024
+    )
+    CONTROLLER_WEBHOOK_CAPTURE_FILES: int = os.environ.get(
+        "CONTROLLER_WEBHOOK_CAPTURE_FILES", 20
+    )
+
     class Config:
         case_sensitive = True
 
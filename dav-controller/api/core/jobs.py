@@ -0,0 +1,185 @@
+"""Periodic background jobs that run on one replica at a time.
+
+Every worker of every replica schedules the registered jobs, and a run only
+happens where the job's lease in the session store could be taken, in the
+`job_lease` collection with MongoDB. The memory store keeps the leases of its
+own process, so each worker runs the jobs over the sessions it holds.
+The lease is renewed while the run lasts and given up on shutdown, so when
+its holder goes away another worker takes over after at most
+CONTROLLER_JOB_LEASE_TTL seconds. A run that loses its lease is cancelled.
+
+Intervals are spread by CONTROLLER_JOB_INTERVAL_JITTER (a fraction of the
+interval) so that replicas started together do not all query at once. A job
+returns True when it left a backlog, and runs again right away.
+"""
+import asyncio
+import os
+import random
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+import structlog
+from pymongo.database import Database
+from pymongo.errors import PyMongoError
+
+from ..db.store import get_store
+from .config import settings
+
+logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
+
+# Identifies this worker as the holder of a lease
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class Job:
+    def __init__(
+        self,
+        name: str,
+        run: Callable[[Database], Awaitable[bool]],
+        interval: Callable[[], float],
+    ):
+        self.name = name
+        self.run = run
+        # Read when needed, so that the settings can change in tests
+        self.interval = interval
+        self.stats = {
+            "leader": False,
+            "runs": 0,
+            "errors": 0,
+            "skipped": 0,
+            "lease_lost": 0,
+            "last_run_at": None,
+            "last_duration_s": None,
+            "total_duration_s": 0.0,
+        }
+
+    def acquire(self, db: Database) -> bool:
+        """Take or renew the lease, False while another worker holds it."""
+        self.stats["leader"] = get_store(db).acquire_lease(
+            self.name,
+            OWNER,
+            datetime.utcnow()
+            + timedelta(seconds=float(settings.CONTROLLER_JOB_LEASE_TTL)),
+        )
+        return self.stats["leader"]
+
+    def release(self, db: Database):
+        self.stats["leader"] = False
+        get_store(db).release_lease(self.name, OWNER)
+
+    async def _run_leased(self, db: Database) -> bool:
+        started = time.monotonic()
+        run = asyncio.create_task(self.run(db))
+        renew_every = float(settings.CONTROLLER_JOB_LEASE_TTL) / 3
+        try:
+            while True:
+                done, _ = await asyncio.wait({run}, timeout=renew_every)
+                if done:
+                    break
+                if not await asyncio.to_thread(self.acquire, db):
+                    run.cancel()
+                    self.stats["lease_lost"] += 1
+                    logger.warning("job lost its lease, run cancelled", job=self.name)
+                    return False
+            more = run.result()
+            self.stats["runs"] += 1
+            return bool(more)
+        except asyncio.CancelledError:
+            run.cancel()
+            raise
+        except Exception as err:
+            self.stats["errors"] += 1
+            logger.error("job run failed", job=self.name, err=str(err))
+            return False
+        finally:
+            duration = time.monotonic() - started
+            self.stats["last_run_at"] = datetime.now()
+            self.stats["last_duration_s"] = duration
+            self.stats["total_duration_s"] += duration
+
+    def _next_delay(self) -> float:
+        jitter = float(settings.CONTROLLER_JOB_INTERVAL_JITTER)
+        return float(self.interval()) * random.uniform(1 - jitter, 1 + jitter)
+
+    async def loop(self, db: Database, stopping: asyncio.Event):
+        # Replicas started together start their jobs at different times
+        first_delay = random.uniform(
+            0, float(self.interval()) * float(settings.CONTROLLER_JOB_INTERVAL_JITTER)
+        )
+        if await _wait(stopping, first_delay):
+            return
+        while not stopping.is_set():
+            more = False
+            try:
+                leased = await asyncio.to_thread(self.acquire, db)
+            except PyMongoError as err:
+                leased = False
+                self.stats["errors"] += 1
+                logger.warning("job lease unavailable", job=self.name, err=str(err))
+            if leased:
+                more = await self._run_leased(db)
+            else:
+                self.stats["skipped"] += 1
+            if not more and await _wait(stopping, self._next_delay()):
+                return
+
+
+async def _wait(event: asyncio.Event, timeout: float) -> bool:
+    """Sleep for `timeout` seconds, True when `event` is set meanwhile."""
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+_jobs: Dict[str, Job] = {}
+_tasks: Dict[str, asyncio.Task] = {}
+_stopping: Optional[asyncio.Event] = None
+_db: Optional[Database] = None
+
+
+def register(job: Job):
+    _jobs[job.name] = job
+
+
+def start(db: Database):
+    global _stopping, _db
+    if _tasks:
+        return
+    _db = db
+    _stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for name, job in _jobs.items():
+        _tasks[name] = loop.create_task(job.loop(db, _stopping))
+
+
+async def stop():
+    """Let runs in progress finish within the grace period, then give up leases."""
+    global _stopping
+    if not _tasks:
+        return
+    _stopping.set()
+    _, pending = await asyncio.wait(
+        _tasks.values(), timeout=float(settings.CONTROLLER_JOB_SHUTDOWN_GRACE)
+    )
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    for name in _tasks:
+        try:
+            await asyncio.to_thread(_jobs[name].release, _db)
+        except PyMongoError as err:
+            logger.warning("could not release job lease", job=name, err=str(err))
+    _tasks.clear()
+    _stopping = None
+
+
+def get_stats() -> Dict:
+    return {
+        "owner": OWNER,
+        "jobs": {name: job.stats for name, job in _jobs.items()},
+    }
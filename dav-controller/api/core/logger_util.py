@@ -1,20 +1,206 @@
-import structlog
+import atexit
+import functools
+import logging
+import logging.handlers
+import queue
+import random
+import sys
 import time
-from typing import Callable, Any
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, TextIO
+
+import structlog
+
+# Whether log events emitted while handling the current request are kept.
+# Set once per request by `sample_request` and read by `drop_unsampled`.
+_request_sampled: ContextVar[bool] = ContextVar("log_request_sampled", default=True)
+
+_sample_rates: List[tuple[str, float]] = []
+_installed_handler: Optional[logging.Handler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def debug_enabled() -> bool:
+    """Cheap guard for debug logs whose arguments are expensive to build."""
+    return logging.getLogger().isEnabledFor(logging.DEBUG)
 
 
 def log_debug(func: Callable[..., Any]) -> Callable[..., Any]:
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
+        if not debug_enabled():
+            return func(*args, **kwargs)
         logger = structlog.getLogger(func.__name__)
-        logger.debug(f" >>>> {func.__name__}")
-        logger.debug(f" ..with params={{{args}}}")
+        logger.debug(f" >>>> {func.__name__}", params=args)
         start_time = time.time()
         ret_val = func(*args, **kwargs)
         end_time = time.time()
         logger.debug(
-            f" <<<< {func.__name__} and took {end_time-start_time:.3f} seconds"
+            f" <<<< {func.__name__}",
+            took=f"{end_time-start_time:.3f}",
+            ret_val=ret_val,
         )
-        logger.debug(f" ..with ret_val={{{ret_val}}}")
         return ret_val
 
     return wrapper
+
+
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    """Parse "path_prefix=rate,..." e.g. "/health=0,/age-verification=0.1"."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        prefix, _, rate = item.rpartition("=")
+        if not prefix:
+            raise ValueError(f"invalid log sample rate {item!r}")
+        rates[prefix] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+def sample_request(path: str) -> bool:
+    """Decide whether the debug/info logs of the current request are kept."""
+    rate = 1.0
+    for prefix, prefix_rate in _sample_rates:
+        if path.startswith(prefix):
+            rate = prefix_rate
+            break
+    sampled = rate >= 1.0 or random.random() < rate
+    _request_sampled.set(sampled)
+    return sampled
+
+
+def force_sample():
+    """Keep the remaining logs of the current request, e.g. after a failure."""
+    _request_sampled.set(True)
+
+
+def drop_unsampled(logger, method_name: str, event_dict: dict) -> dict:
+    if method_name in ("debug", "info") and not _request_sampled.get():
+        raise structlog.DropEvent
+    return event_dict
+
+
+class _RecordQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener thread without rendering them first.
+
+    The stock QueueHandler formats every record in the calling thread so that
+    it can be pickled; everything stays in process here, so the structlog
+    event dict is passed along as is and rendered by the listener.
+    """
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Never block the event loop on logging, count what was lost instead
+            self.dropped += 1
+
+
+def dropped_log_records() -> int:
+    if isinstance(_installed_handler, _RecordQueueHandler):
+        return _installed_handler.dropped
+    return 0
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def configure_logging(
+    level: int = logging.DEBUG,
+    use_json_logs: bool = True,
+    time_stamp_format: str = "iso",
+    async_emit: bool = False,
+    queue_size: int = 10000,
+    sample_rates: str = "",
+    stream: Optional[TextIO] = None,
+):
+    """Configure structlog and the stdlib root logger.
+
+    Events are enriched (context variables, logger name, level, timestamp) in
+    the calling thread and rendered by a `ProcessorFormatter`. With
+    `async_emit` the formatter and the stream write run on a background
+    `QueueListener` thread, so the event loop only pays for enqueueing.
+    """
+    global _installed_handler, _listener, _sample_rates
+
+    _sample_rates = sorted(
+        parse_sample_rates(sample_rates).items(), key=lambda i: -len(i[0])
+    )
+
+    shared_processors = [
+        structlog.contextvars.merge_contextvars,
+        structlog.stdlib.add_logger_name,
+        structlog.stdlib.PositionalArgumentsFormatter(),
+        structlog.stdlib.ExtraAdder(),
+        structlog.processors.StackInfoRenderer(),
+        structlog.stdlib.add_log_level,
+        structlog.processors.TimeStamper(fmt=time_stamp_format),
+    ]
+
+    renderer = (
+        structlog.processors.JSONRenderer()
+        if use_json_logs
+        else structlog.dev.ConsoleRenderer()
+    )
+
+    formatter = structlog.stdlib.ProcessorFormatter(
+        # These run ONLY on `logging` entries that do NOT originate within
+        # structlog.
+        foreign_pre_chain=shared_processors,
+        # These run on ALL entries after the pre_chain is done.
+        processors=[
+            # Remove _record & _from_structlog.
+            structlog.stdlib.ProcessorFormatter.remove_processors_meta,
+            renderer,
+        ],
+    )
+
+    stream_handler = logging.StreamHandler(stream or sys.stdout)
+    stream_handler.setFormatter(formatter)
+
+    _stop_listener()
+    if async_emit:
+        handler = _RecordQueueHandler(queue.Queue(queue_size))
+        _listener = logging.handlers.QueueListener(handler.queue, stream_handler)
+        _listener.start()
+    else:
+        handler = stream_handler
+
+    root = logging.getLogger()
+    if _installed_handler is not None:
+        root.removeHandler(_installed_handler)
+    root.addHandler(handler)
+    root.setLevel(level)
+    _installed_handler = handler
+
+    for _log in ["uvicorn", "uvicorn.error"]:
+        # Clear the log handlers for uvicorn loggers, and route them through
+        # our handler so the messages are formatted correctly by structlog
+        logging.getLogger(_log).handlers.clear()
+        logging.getLogger(_log).addHandler(handler)
+        logging.getLogger(_log).propagate = False
+
+    # This is already handled by our middleware
+    logging.getLogger("uvicorn.access").handlers.clear()
+    logging.getLogger("uvicorn.access").propagate = False
+
+    structlog.configure(
+        processors=[structlog.stdlib.filter_by_level, drop_unsampled]
+        + shared_processors
+        + [structlog.stdlib.ProcessorFormatter.wrap_for_formatter],
+        context_class=dict,
+        logger_factory=structlog.stdlib.LoggerFactory(),
+        wrapper_class=structlog.make_filtering_bound_logger(level),
+        cache_logger_on_first_use=True,
+    )
+
+
+atexit.register(_stop_listener)
@@ -1,9 +1,8 @@
 from datetime import datetime
-from typing import TypedDict
+from typing import List, TypedDict
 
 from bson import ObjectId
 from pydantic import BaseModel, Field
-from pyop.userinfo import Userinfo
 
 
 class PyObjectId(ObjectId):
@@ -77,3 +76,27 @@ class AgeVerificationModelRead(AgeVerificationModelCreate):
 
 class AgeVerificationModelCreateRead(AgeVerificationModelRead):
     url: str
+
+
+class BrowserSessionCreate(BaseModel):
+    # socket.io session of the page that gets the QR code
+    sid: str
+    notify_endpoint: str | None
+    metadata: str | None
+
+
+class AgeVerificationReport(BaseModel):
+    id: str
+    status: str
+    pres_exch_id: str
+    proof_req_config_id: str | None
+    created_at: datetime
+    expired_timestamp: datetime | None
+    lifecycle_timestamps: dict
+    metadata: dict | None
+
+
+class AgeVerificationSearchRead(BaseModel):
+    items: List[AgeVerificationReport]
+    # Passed back as `cursor` for the next page, None on the last one
+    next_cursor: str | None
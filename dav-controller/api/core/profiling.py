@@ -0,0 +1,157 @@
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+from pathlib import Path
+from typing import Deque, Dict, Optional
+
+import structlog
+from starlette.requests import Request
+from starlette.responses import Response
+
+from .auth import API_KEY
+from .config import settings
+
+logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
+
+PROFILE_HEADER = "x-profile"
+PROFILE_QUERY_PARAM = "__profile"
+PROFILE_ID_HEADER = "x-profile-id"
+
+
+class StackSampler:
+    """Wall clock sampling profiler for a single thread.
+
+    A background thread records the target thread's Python stack every
+    `interval` seconds. Stacks are kept in the "folded" format used by
+    flamegraph.pl and speedscope: frames joined by ";" mapped to a count.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def _frame_name(frame) -> str:
+        code = frame.f_code
+        path = Path(code.co_filename)
+        return f"{code.co_name} ({path.parent.name}/{path.name}:{code.co_firstlineno})"
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class RequestProfile:
+    def __init__(
+        self, method: str, path: str, interval: float, stacks: Counter, **info
+    ):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.interval = interval
+        self.stacks = stacks
+        self.created_at = datetime.now()
+        self.info = info
+
+    def summary(self) -> Dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "created_at": self.created_at,
+            "interval_ms": self.interval * 1000,
+            "samples": sum(self.stacks.values()),
+            **self.info,
+        }
+
+    def folded(self) -> str:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+
+class ProfileStore:
+    """Bounded ring of the most recent request profiles."""
+
+    def __init__(self, size: int):
+        self._profiles: Deque[RequestProfile] = deque(maxlen=size)
+
+    def add(self, profile: RequestProfile):
+        self._profiles.append(profile)
+
+    def get(self, profile_id: str) -> Optional[RequestProfile]:
+        return next((p for p in self._profiles if p.id == profile_id), None)
+
+    def list(self):
+        return [p.summary() for p in reversed(self._profiles)]
+
+
+profiles = ProfileStore(settings.CONTROLLER_PROFILING_RING_SIZE)
+_profiling_active = False
+
+
+def _should_profile(request: Request) -> bool:
+    requested = (
+        request.headers.get(PROFILE_HEADER)
+        or request.query_params.get(PROFILE_QUERY_PARAM)
+    ) is not None
+    if requested:
+        # Same rule as api.core.auth.require_api_key, never open to everyone
+        return bool(API_KEY) and request.headers.get("x-api-key") == API_KEY
+    rate = settings.CONTROLLER_PROFILING_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+async def profiling_middleware(request: Request, call_next) -> Response:
+    """Profile the request when asked to, see CONTROLLER_PROFILING_ENABLED.
+
+    The sampler records the event loop thread, so work done for other
+    requests being served concurrently shows up in the profile as well.
+    """
+    global _profiling_active
+    if _profiling_active or not _should_profile(request):
+        return await call_next(request)
+
+    _profiling_active = True
+    interval = settings.CONTROLLER_PROFILING_INTERVAL_MS / 1000
+    sampler = StackSampler(threading.get_ident(), interval)
+    start_time = time.perf_counter()
+    sampler.start()
+    try:
+        response = await call_next(request)
+    finally:
+        sampler.stop()
+        _profiling_active = False
+
+    profile = RequestProfile(
+        request.method,
+        request.url.path,
+        interval,
+        sampler.stacks,
+        status_code=response.status_code,
+        duration_ms=(time.perf_counter() - start_time) * 1000,
+    )
+    profiles.add(profile)
+    logger.info("profiled a request", profile_id=profile.id)
+    response.headers[PROFILE_ID_HEADER] = profile.id
+    return response
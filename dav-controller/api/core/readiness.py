@@ -0,0 +1,155 @@
+"""Warm-up of a new worker and the readiness it reports.
+
+Warm-up steps run once, in order, in the background after startup: indexes,
+the agent's wallet token and DIDs, the proof request and the compiled pages.
+A step that fails is retried until it succeeds, the steps after it wait
+for it. A ConfigurationError is not retried, as retrying cannot fix the
+settings: the step is reported as misconfigured and the next steps run.
+Dependencies are probed every CONTROLLER_READINESS_PROBE_INTERVAL seconds
+and the readiness endpoint only reads the last results, so polling it never
+reaches MongoDB or the agent.
+
+The worker is ready once every step is done and every last probe passed, a
+misconfigured worker never is. Liveness is not affected by any of this.
+"""
+import asyncio
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+import structlog
+from pymongo.database import Database
+
+from ..db.store import get_store
+from .acapy.client import AcapyClient
+from .config import settings
+
+logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
+
+WarmupStep = Tuple[str, Callable[[Database], None]]
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+MISCONFIGURED = "misconfigured"
+
+warmup: Dict[str, Dict] = {}
+probes: Dict[str, Dict] = {}
+# Set on shutdown so that traffic is drained before the worker goes away
+stopping = False
+
+_tasks: List[asyncio.Task] = []
+
+
+class ConfigurationError(Exception):
+    """Raised by a warm-up step that fails on the settings, not a dependency."""
+
+
+def _probe_mongodb(db: Database):
+    get_store(db).ping(settings.CONTROLLER_READINESS_PROBE_TIMEOUT)
+
+
+def _probe_agent(db: Database):
+    if not AcapyClient(db=db).is_ready(settings.CONTROLLER_READINESS_PROBE_TIMEOUT):
+        raise RuntimeError("the agent is not ready")
+
+
+PROBES: Dict[str, Callable[[Database], None]] = {
+    "mongodb": _probe_mongodb,
+    "agent": _probe_agent,
+}
+
+
+async def _warm_up(db: Database, steps: List[WarmupStep]):
+    for name, step in steps:
+        while True:
+            warmup[name]["attempts"] += 1
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(step, db)
+            except ConfigurationError as err:
+                warmup[name].update(status=MISCONFIGURED, error=str(err))
+                logger.error("warm-up step misconfigured", step=name, err=str(err))
+                break
+            except Exception as err:
+                warmup[name].update(status=FAILED, error=str(err))
+                logger.warning("warm-up step failed", step=name, err=str(err))
+                await asyncio.sleep(settings.CONTROLLER_READINESS_PROBE_INTERVAL)
+                continue
+            warmup[name].update(
+                status=DONE,
+                error=None,
+                duration_ms=round((time.perf_counter() - started) * 1000, 1),
+            )
+            logger.info("warm-up step done", step=name, **warmup[name])
+            break
+
+
+def _probes(db: Database) -> Dict[str, Callable[[Database], None]]:
+    if get_store(db).uses_mongodb:
+        return PROBES
+    # The memory store keeps everything in the process
+    return {name: probe for name, probe in PROBES.items() if name != "mongodb"}
+
+
+async def _probe(db: Database):
+    while True:
+        for name, probe in _probes(db).items():
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(probe, db)
+                error = None
+            except Exception as err:
+                error = str(err)
+            # Logged when a probe starts failing, not on every run
+            if error and probes[name]["ok"] is not False:
+                logger.warning("readiness probe failed", probe=name, err=error)
+            probes[name] = {
+                "ok": error is None,
+                "error": error,
+                "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+                "checked_at": datetime.now(),
+            }
+        await asyncio.sleep(settings.CONTROLLER_READINESS_PROBE_INTERVAL)
+
+
+def start(db: Database, steps: List[WarmupStep]):
+    global stopping
+    if _tasks:
+        return
+    stopping = False
+    for name, _ in steps:
+        warmup[name] = {"status": PENDING, "error": None, "attempts": 0}
+    for name in _probes(db):
+        probes[name] = {"ok": None, "error": None, "checked_at": None}
+    loop = asyncio.get_running_loop()
+    _tasks.append(loop.create_task(_warm_up(db, steps)))
+    _tasks.append(loop.create_task(_probe(db)))
+
+
+def stop():
+    global stopping
+    stopping = True
+    for task in _tasks:
+        task.cancel()
+    _tasks.clear()
+
+
+def is_ready() -> bool:
+    return (
+        not stopping
+        and all(step["status"] == DONE for step in warmup.values())
+        and all(probe["ok"] for probe in probes.values())
+    )
+
+
+def report() -> Dict:
+    if stopping:
+        status = "stopping"
+    elif any(step["status"] == MISCONFIGURED for step in warmup.values()):
+        status = MISCONFIGURED
+    elif not all(step["status"] == DONE for step in warmup.values()):
+        status = "warming_up"
+    else:
+        status = "ready" if is_ready() else "unavailable"
+    return {"status": status, "warmup": warmup, "probes": probes}
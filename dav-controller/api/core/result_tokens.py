@@ -0,0 +1,176 @@
+"""Signed verification results that relying parties check on their own.
+
+When a presentation is verified the controller issues a compact JWS (ES256)
+with the session id, the outcome, the revealed attributes and the lifecycle
+timestamps. It is delivered in the notify payload and over the socket, and
+verified against the key published at /.well-known/jwks.json, so receiving
+it replaces polling GET /age-verification/{pid}.
+
+Tokens are only issued when CONTROLLER_RESULT_SIGNING_KEY_PATH points at a
+P-256 private key in PEM, every worker has to sign with the same key.
+"""
+import base64
+import hashlib
+import time
+import uuid
+from datetime import datetime
+from functools import cache
+from typing import Dict, Optional
+
+import structlog
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import (
+    decode_dss_signature,
+    encode_dss_signature,
+)
+
+from .config import settings
+from .serialization import dumps, loads
+
+logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
+
+ALGORITHM = "ES256"
+# Bytes of each of r and s in an ES256 signature
+COORDINATE_SIZE = 32
+JWKS_PATH = "/.well-known/jwks.json"
+# Members of a public JWK its RFC 7638 thumbprint covers, by key type
+THUMBPRINT_MEMBERS = {"EC": ("crv", "kty", "x", "y"), "RSA": ("e", "kty", "n")}
+
+
+class InvalidResultToken(Exception):
+    pass
+
+
+def b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def b64url_decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def thumbprint(jwk: Dict[str, str]) -> str:
+    """RFC 7638 thumbprint, over the required members in lexicographic order."""
+    members = THUMBPRINT_MEMBERS[jwk["kty"]]
+    return b64url(hashlib.sha256(dumps({k: jwk[k] for k in members})).digest())
+
+
+def public_jwk(public_key: ec.EllipticCurvePublicKey) -> Dict[str, str]:
+    numbers = public_key.public_numbers()
+    jwk = {
+        "crv": "P-256",
+        "kty": "EC",
+        "x": b64url(numbers.x.to_bytes(COORDINATE_SIZE, "big")),
+        "y": b64url(numbers.y.to_bytes(COORDINATE_SIZE, "big")),
+    }
+    return {**jwk, "kid": thumbprint(jwk), "use": "sig", "alg": ALGORITHM}
+
+
+class ResultSigner:
+    def __init__(self, private_key: ec.EllipticCurvePrivateKey):
+        if not isinstance(private_key.curve, ec.SECP256R1):
+            raise ValueError("result tokens are signed with a P-256 key")
+        self._private_key = private_key
+        self.jwk = public_jwk(private_key.public_key())
+        self._header = b64url(
+            dumps({"alg": ALGORITHM, "typ": "JWT", "kid": self.jwk["kid"]})
+        )
+
+    def sign(self, claims: Dict) -> str:
+        signing_input = f"{self._header}.{b64url(dumps(claims))}"
+        r, s = decode_dss_signature(
+            self._private_key.sign(
+                signing_input.encode("ascii"), ec.ECDSA(hashes.SHA256())
+            )
+        )
+        # JWS wants the raw r and s rather than the DER structure
+        signature = r.to_bytes(COORDINATE_SIZE, "big") + s.to_bytes(
+            COORDINATE_SIZE, "big"
+        )
+        return f"{signing_input}.{b64url(signature)}"
+
+
+@cache
+def get_signer() -> Optional[ResultSigner]:
+    path = settings.CONTROLLER_RESULT_SIGNING_KEY_PATH
+    if not path:
+        return None
+    with open(path, "rb") as key_file:
+        return ResultSigner(serialization.load_pem_private_key(key_file.read(), None))
+
+
+def jwks() -> Dict:
+    signer = get_signer()
+    return {"keys": [signer.jwk] if signer else []}
+
+
+def _epoch(value: datetime) -> int:
+    return int(value.timestamp())
+
+
+def issue(
+    session_id: str,
+    status: str,
+    revealed_attributes: Optional[Dict[str, str]],
+    lifecycle_timestamps: Dict[str, datetime],
+    metadata: Optional[dict] = None,
+) -> Optional[str]:
+    """The signed result of a session, None when no key is configured."""
+    signer = get_signer()
+    if signer is None:
+        return None
+    now = int(time.time())
+    claims = {
+        "iss": settings.CONTROLLER_URL,
+        "sub": session_id,
+        "jti": str(uuid.uuid4()),
+        "iat": now,
+        "exp": now + int(settings.CONTROLLER_RESULT_TOKEN_TTL),
+        "status": status,
+        "revealed_attributes": revealed_attributes or {},
+        "timestamps": {stage: _epoch(at) for stage, at in lifecycle_timestamps.items()},
+        "metadata": metadata,
+    }
+    return signer.sign(claims)
+
+
+def verify(token: str, keys: Dict) -> Dict:
+    """Claims of `token` checked against a JWKS, as a relying party would.
+
+    Only ES256 is accepted, whatever the header says.
+    """
+    try:
+        header, payload, signature = token.split(".")
+        decoded_header = loads(b64url_decode(header))
+        if decoded_header.get("alg") != ALGORITHM:
+            raise InvalidResultToken(f"unexpected alg: {decoded_header.get('alg')}")
+        kid = decoded_header.get("kid")
+        jwk = next(key for key in keys["keys"] if key["kid"] == kid)
+        public_key = ec.EllipticCurvePublicNumbers(
+            int.from_bytes(b64url_decode(jwk["x"]), "big"),
+            int.from_bytes(b64url_decode(jwk["y"]), "big"),
+            ec.SECP256R1(),
+        ).public_key()
+        raw = b64url_decode(signature)
+        public_key.verify(
+            encode_dss_signature(
+                int.from_bytes(raw[:COORDINATE_SIZE], "big"),
+                int.from_bytes(raw[COORDINATE_SIZE:], "big"),
+            ),
+            f"{header}.{payload}".encode("ascii"),
+            ec.ECDSA(hashes.SHA256()),
+        )
+        claims = loads(b64url_decode(payload))
+    except (
+        ValueError,
+        KeyError,
+        AttributeError,
+        StopIteration,
+        InvalidSignature,
+    ) as err:
+        raise InvalidResultToken(f"invalid result token: {err!r}") from err
+    if claims["exp"] < time.time():
+        raise InvalidResultToken("expired result token")
+    return claims
@@ -0,0 +1,99 @@
+"""JSON encoding and decoding for the controller's hot paths.
+
+Webhook bodies, Aries messages, agent responses and API responses all go
+through `dumps` and `loads`. orjson is used when it is installed, the
+standard library otherwise, and CONTROLLER_JSON_BACKEND picks one
+explicitly. Both backends produce the same compact UTF-8 output.
+"""
+import json
+from datetime import date, datetime
+from enum import Enum
+from typing import Any, Callable, Dict, Union
+
+import structlog
+from bson import ObjectId
+from pydantic import BaseModel
+from starlette.responses import JSONResponse
+
+from .config import settings
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
+
+
+def _default(obj: Any) -> Any:
+    """Types neither backend encodes on its own."""
+    if isinstance(obj, BaseModel):
+        return obj.dict(by_alias=True)
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    # Only reached with the standard library, orjson handles these natively
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Enum):
+        return obj.value
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class JSONBackend:
+    def __init__(
+        self,
+        name: str,
+        dumps: Callable[[Any], bytes],
+        loads: Callable[[Union[bytes, str]], Any],
+    ):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(
+        obj, separators=(",", ":"), ensure_ascii=False, default=_default
+    ).encode("utf-8")
+
+
+backends: Dict[str, JSONBackend] = {
+    "json": JSONBackend("json", _json_dumps, json.loads),
+}
+if orjson is not None:
+    backends["orjson"] = JSONBackend(
+        "orjson",
+        lambda obj: orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS),
+        orjson.loads,
+    )
+
+
+def use_backend(name: str) -> JSONBackend:
+    """Switch backend, "auto" being orjson when installed."""
+    global _backend
+    if name == "auto":
+        name = "orjson" if "orjson" in backends else "json"
+    if name not in backends:
+        raise ValueError(f"unknown or unavailable JSON backend: {name}")
+    _backend = backends[name]
+    return _backend
+
+
+_backend: JSONBackend = use_backend(settings.CONTROLLER_JSON_BACKEND)
+
+
+def dumps(obj: Any) -> bytes:
+    return _backend.dumps(obj)
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    return _backend.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with the configured backend."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,72 @@
+"""Static assets served under content-hashed names.
+
+Every file of the assets directory is read once, named after a hash of its
+content (`refresh.svg` becomes `refresh.<hash>.svg`) and compressed ahead of
+time with each encoding that makes it smaller. As a name only ever refers
+to one content, browsers may cache the responses forever.
+"""
+import hashlib
+import mimetypes
+import os
+from typing import Dict, Optional
+
+import structlog
+
+from .compression import brotli, compress
+
+logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
+
+ASSETS_DIR = "api/templates/assets"
+STATIC_PATH = "/static"
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+class Asset:
+    def __init__(self, name: str, content: bytes):
+        digest = hashlib.sha256(content).hexdigest()[:16]
+        stem, extension = os.path.splitext(name)
+        self.name = name
+        self.hashed_name = f"{stem}.{digest}{extension}"
+        # Weak, as the compressed variants are equivalent but not identical
+        self.etag = f'W/"{digest}"'
+        self.media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        self.variants: Dict[str, bytes] = {"identity": content}
+
+    def precompress(self):
+        encodings = ["gzip"] + (["br"] if brotli is not None else [])
+        for encoding in encodings:
+            compressed = compress(self.variants["identity"], encoding)
+            if len(compressed) < len(self.variants["identity"]):
+                self.variants[encoding] = compressed
+
+
+class AssetRegistry:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._by_name: Dict[str, Asset] = {}
+        self._by_hashed_name: Dict[str, Asset] = {}
+
+    def build(self):
+        by_name = {}
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not os.path.isfile(path):
+                continue
+            with open(path, "rb") as asset_file:
+                asset = Asset(name, asset_file.read())
+            asset.precompress()
+            by_name[name] = asset
+        self._by_name = by_name
+        self._by_hashed_name = {a.hashed_name: a for a in by_name.values()}
+        logger.info("built static assets", count=len(by_name))
+
+    def url(self, name: str) -> str:
+        if not self._by_name:
+            self.build()
+        return f"{STATIC_PATH}/{self._by_name[name].hashed_name}"
+
+    def get(self, hashed_name: str) -> Optional[Asset]:
+        return self._by_hashed_name.get(hashed_name)
+
+
+assets = AssetRegistry(ASSETS_DIR)
@@ -0,0 +1,51 @@
+import pytest
+from starlette.requests import Request
+
+from api.core.admission import TrustedProxies
+
+
+def request(client: str, forwarded_for: str = None) -> Request:
+    headers = []
+    if forwarded_for is not None:
+        headers.append((b"x-forwarded-for", forwarded_for.encode()))
+    return Request({"type": "http", "client": (client, 50000), "headers": headers})
+
+
+def test_without_trusted_proxies_the_peer_is_the_client():
+    proxies = TrustedProxies("")
+    assert proxies.client_host(request("10.0.0.5", "203.0.113.7")) == "10.0.0.5"
+
+
+def test_untrusted_peers_cannot_forward():
+    proxies = TrustedProxies("10.0.0.0/8")
+    assert proxies.client_host(request("198.51.100.1", "203.0.113.7")) == (
+        "198.51.100.1"
+    )
+
+
+@pytest.mark.parametrize(
+    "trusted, forwarded_for, client",
+    [
+        ("10.0.0.0/8", "203.0.113.7", "203.0.113.7"),
+        # A client made up hop in front of the real one is ignored
+        ("10.0.0.0/8", "192.0.2.1, 203.0.113.7", "203.0.113.7"),
+        ("10.0.0.0/8", "203.0.113.7, 10.1.2.3", "203.0.113.7"),
+        ("10.0.0.5, 10.1.2.3", "203.0.113.7, 10.1.2.3", "203.0.113.7"),
+        ("*", "192.0.2.1, 203.0.113.7", "192.0.2.1"),
+        # All hops trusted, the first one is the client
+        ("10.0.0.0/8", "10.9.9.9, 10.1.2.3", "10.9.9.9"),
+    ],
+)
+def test_trusted_proxies_forward_the_client(trusted, forwarded_for, client):
+    proxies = TrustedProxies(trusted)
+    assert proxies.client_host(request("10.0.0.5", forwarded_for)) == client
+
+
+def test_trusted_proxy_without_header():
+    proxies = TrustedProxies("10.0.0.0/8")
+    assert proxies.client_host(request("10.0.0.5")) == "10.0.0.5"
+
+
+def test_no_client():
+    proxies = TrustedProxies("*")
+    assert proxies.client_host(Request({"type": "http", "headers": []})) is None
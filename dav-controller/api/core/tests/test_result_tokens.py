@@ -0,0 +1,130 @@
+from datetime import datetime
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from api.core import result_tokens
+from api.core.config import settings
+from api.core.result_tokens import InvalidResultToken, b64url, b64url_decode
+from api.core.serialization import dumps, loads
+
+CREATED = datetime(2024, 5, 1, 12, 30)
+
+
+def write_key(path) -> str:
+    key = ec.generate_private_key(ec.SECP256R1())
+    path.write_bytes(
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+    )
+    return str(path)
+
+
+@pytest.fixture()
+def signing_key(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        settings, "CONTROLLER_RESULT_SIGNING_KEY_PATH", write_key(tmp_path / "key")
+    )
+    result_tokens.get_signer.cache_clear()
+    yield
+    result_tokens.get_signer.cache_clear()
+
+
+def issue() -> str:
+    return result_tokens.issue(
+        "session-1",
+        "success",
+        {"age_over_19": "true"},
+        {"created": CREATED},
+        {"till": 3},
+    )
+
+
+def with_header(token: str, **fields) -> str:
+    header, payload, signature = token.split(".")
+    header = b64url(dumps({**loads(b64url_decode(header)), **fields}))
+    return f"{header}.{payload}.{signature}"
+
+
+def test_no_tokens_without_a_key(monkeypatch):
+    monkeypatch.setattr(settings, "CONTROLLER_RESULT_SIGNING_KEY_PATH", None)
+    result_tokens.get_signer.cache_clear()
+    assert issue() is None
+    assert result_tokens.jwks() == {"keys": []}
+
+
+def test_verifies_against_the_published_keys(signing_key):
+    claims = result_tokens.verify(issue(), result_tokens.jwks())
+    assert claims["sub"] == "session-1"
+    assert claims["status"] == "success"
+    assert claims["revealed_attributes"] == {"age_over_19": "true"}
+    assert claims["timestamps"] == {"created": int(CREATED.timestamp())}
+    assert claims["metadata"] == {"till": 3}
+    assert claims["exp"] - claims["iat"] == int(settings.CONTROLLER_RESULT_TOKEN_TTL)
+
+
+def test_tampered_payload_is_rejected(signing_key):
+    header, payload, signature = issue().split(".")
+    claims = loads(b64url_decode(payload))
+    claims["status"] = "failure"
+    tampered = f"{header}.{b64url(dumps(claims))}.{signature}"
+    with pytest.raises(InvalidResultToken):
+        result_tokens.verify(tampered, result_tokens.jwks())
+
+
+def test_unknown_kid_is_rejected(signing_key):
+    token = issue()
+    with pytest.raises(InvalidResultToken):
+        result_tokens.verify(with_header(token, kid="unknown"), result_tokens.jwks())
+    with pytest.raises(InvalidResultToken):
+        result_tokens.verify(token, {"keys": []})
+
+
+@pytest.mark.parametrize("alg", ["none", "HS256", "ES384", None])
+def test_other_algorithms_are_rejected(signing_key, monkeypatch, alg):
+    # Signed with the right key, only the header's alg differs
+    signer = result_tokens.get_signer()
+    header = {"alg": alg, "typ": "JWT", "kid": signer.jwk["kid"]}
+    monkeypatch.setattr(signer, "_header", b64url(dumps(header)))
+    with pytest.raises(InvalidResultToken, match="alg"):
+        result_tokens.verify(issue(), result_tokens.jwks())
+
+
+def test_expired_token_is_rejected(signing_key, monkeypatch):
+    monkeypatch.setattr(settings, "CONTROLLER_RESULT_TOKEN_TTL", -1)
+    with pytest.raises(InvalidResultToken, match="expired"):
+        result_tokens.verify(issue(), result_tokens.jwks())
+
+
+@pytest.mark.parametrize("token", ["", "a.b", "a.b.c", "e30.e30.AAAA"])
+def test_malformed_token_is_rejected(signing_key, token):
+    with pytest.raises(InvalidResultToken):
+        result_tokens.verify(token, result_tokens.jwks())
+
+
+def test_thumbprint_of_rfc_7638():
+    # The example of RFC 7638 section 3.1
+    jwk = {
+        "kty": "RSA",
+        "n": "0vx7agoebGcQSuuPiLJXZptN9nndrQmbXEps2aiAFbWhM78LhWx4cbbfAAtVT86zwu1RK7aPF"
+        "FxuhDR1L6tSoc_BJECPebWKRXjBZCiFV4n3oknjhMstn64tZ_2W-5JsGY4Hc5n9yBXArwl93lqt7"
+        "_RN5w6Cf0h4QyQ5v-65YGjQR0_FDW2QvzqY368QQMicAtaSqzs8KJZgnYb9c7d0zgdAZHzu6qMQv"
+        "RL5hajrn1n91CbOpbISD08qNLyrdkt-bFTWhAI4vMQFh6WeZu0fM4lFd2NcRwr3XPksINHaQ-G_x"
+        "BniIqbw0Ls1jF44-csFCur-kEgU8awapJzKnqDKgw",
+        "e": "AQAB",
+        "alg": "RS256",
+        "kid": "2011-04-29",
+    }
+    assert (
+        result_tokens.thumbprint(jwk) == "NzbLsXh8uDCcd-6MNwXF4W_7noWXFZAfHkxZsRGC9Xs"
+    )
+
+
+def test_kid_is_the_thumbprint(signing_key):
+    (jwk,) = result_tokens.jwks()["keys"]
+    assert jwk["kid"] == result_tokens.thumbprint(jwk)
+    assert jwk["alg"] == "ES256"
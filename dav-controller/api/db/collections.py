@@ -4,3 +4,9 @@ from enum import Enum
 class COLLECTION_NAMES(str, Enum):
     AUTH_SESSION = "auth_session"
     PRES_EX_ID_TO_PROOF_REQ_CONFIG_ID = "pres_ex_id_to_proof_req_config_id"
+    SESSION_FUNNEL = "session_funnel"
+    AUTH_SESSION_ARCHIVE = "auth_session_archive"
+    IDEMPOTENCY_KEY = "idempotency_key"
+    WEBHOOK_EVENT = "webhook_event"
+    INVITATION_CODE = "invitation_code"
+    JOB_LEASE = "job_lease"
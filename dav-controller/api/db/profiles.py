@@ -0,0 +1,93 @@
+"""Durability and read routing of each kind of database access.
+
+Every collection access names the profile it needs instead of inheriting
+one write concern and read preference from MONGODB_URL:
+
+- critical-transition: state changes that must survive a failover, such as
+  a session becoming verified, an idempotency key or a webhook being claimed
+- default: everything else that reads its own writes
+- best-effort-audit: counters and bookkeeping that can be lost or redone
+- stale-ok-read: reports and exports, which may lag the primary. Status
+  polls read with the default profile, their results are cached and acted on
+
+Each profile is configured with CONTROLLER_DB_PROFILE_<NAME> in connection
+string syntax, with the options `w`, `journal`, `wtimeoutMS`,
+`readPreference`, `maxStalenessSeconds` and `readConcernLevel`, e.g.
+
+    CONTROLLER_DB_PROFILE_STALE_OK_READ="readPreference=nearest&maxStalenessSeconds=120"
+
+Options left out keep the client's defaults.
+"""
+from enum import Enum
+from functools import cache
+from typing import Any, Dict
+from urllib.parse import parse_qsl
+
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
+from pymongo.write_concern import WriteConcern
+
+from api.core.config import settings, strtobool
+
+
+class DB_PROFILES(str, Enum):
+    CRITICAL_TRANSITION = "critical-transition"
+    DEFAULT = "default"
+    BEST_EFFORT_AUDIT = "best-effort-audit"
+    STALE_OK_READ = "stale-ok-read"
+
+
+WRITE_CONCERN_OPTIONS = ("w", "journal", "wtimeoutMS")
+READ_PREFERENCE_OPTIONS = ("readPreference", "maxStalenessSeconds")
+READ_CONCERN_OPTIONS = ("readConcernLevel",)
+
+
+def parse_profile(value: str) -> Dict[str, Any]:
+    """`get_collection` keyword arguments of a profile's option string."""
+    options = dict(parse_qsl(value, strict_parsing=bool(value)))
+    unknown = set(options) - set(
+        WRITE_CONCERN_OPTIONS + READ_PREFERENCE_OPTIONS + READ_CONCERN_OPTIONS
+    )
+    if unknown:
+        raise ValueError(f"unknown database profile options: {sorted(unknown)}")
+
+    kwargs = {}
+    if any(option in options for option in WRITE_CONCERN_OPTIONS):
+        w = options.get("w")
+        kwargs["write_concern"] = WriteConcern(
+            w=int(w) if w is not None and w.isdigit() else w,
+            wtimeout=int(options["wtimeoutMS"]) if "wtimeoutMS" in options else None,
+            j=strtobool(options["journal"]) if "journal" in options else None,
+        )
+    if "readPreference" in options:
+        try:
+            mode = read_pref_mode_from_name(options["readPreference"])
+        except ValueError:
+            raise ValueError(f"unknown readPreference: {options['readPreference']}")
+        kwargs["read_preference"] = make_read_preference(
+            mode,
+            None,
+            int(options.get("maxStalenessSeconds", -1)),
+        )
+    elif "maxStalenessSeconds" in options:
+        raise ValueError("maxStalenessSeconds needs a readPreference")
+    if "readConcernLevel" in options:
+        kwargs["read_concern"] = ReadConcern(options["readConcernLevel"])
+    return kwargs
+
+
+@cache
+def collection_options(profile: DB_PROFILES) -> Dict[str, Any]:
+    return parse_profile(getattr(settings, f"CONTROLLER_DB_PROFILE_{profile.name}"))
+
+
+def check_profiles():
+    """Raise on a misconfigured profile, rather than on its first use."""
+    for profile in DB_PROFILES:
+        collection_options(profile)
+
+
+def get_collection(db: Database, name: str, profile: DB_PROFILES) -> Collection:
+    return db.get_collection(name, **collection_options(profile))
@@ -1,4 +1,7 @@
-from pymongo import MongoClient, ASCENDING
+from typing import Optional
+
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo.database import Database
 from api.core.config import settings
 from .collections import COLLECTION_NAMES
 
@@ -7,13 +10,56 @@ async def get_async_session():
     yield None
 
 
-client = MongoClient(settings.MONGODB_URL, uuidRepresentation="standard")
+_client: Optional[MongoClient] = None
+
+
+def get_client() -> MongoClient:
+    """The MongoClient, created on first use rather than on import."""
+    global _client
+    if _client is None:
+        _client = MongoClient(settings.MONGODB_URL, uuidRepresentation="standard")
+    return _client
+
+
+def close_client():
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
 
 
 async def init_db():
+    create_indexes(get_client()[settings.DB_NAME])
+
+
+def create_indexes(db: Database):
     # must be idempotent
-    db = client[settings.DB_NAME]
+    db.get_collection(COLLECTION_NAMES.SESSION_FUNNEL).create_index(
+        [("minute", ASCENDING)], unique=True
+    )
+    db.get_collection(COLLECTION_NAMES.AUTH_SESSION).create_index(
+        [("proof_status", ASCENDING), ("pres_exch_deleted_at", ASCENDING)]
+    )
+    # Searches and exports, newest first, see authSessions/search.py
+    db.get_collection(COLLECTION_NAMES.AUTH_SESSION).create_index(
+        [("proof_status", ASCENDING), ("_id", DESCENDING)]
+    )
+    db.get_collection(COLLECTION_NAMES.AUTH_SESSION).create_index(
+        [("proof_req_config_id", ASCENDING), ("_id", DESCENDING)]
+    )
+    db.get_collection(COLLECTION_NAMES.AUTH_SESSION_ARCHIVE).create_index(
+        [("created_at", ASCENDING)]
+    )
+    db.get_collection(COLLECTION_NAMES.IDEMPOTENCY_KEY).create_index(
+        [("expires_at", ASCENDING)], expireAfterSeconds=0
+    )
+    db.get_collection(COLLECTION_NAMES.WEBHOOK_EVENT).create_index(
+        [("expires_at", ASCENDING)], expireAfterSeconds=0
+    )
+    db.get_collection(COLLECTION_NAMES.INVITATION_CODE).create_index(
+        [("expires_at", ASCENDING)], expireAfterSeconds=0
+    )
 
 
 async def get_db():
-    return client[settings.DB_NAME]
+    return get_client()[settings.DB_NAME]
@@ -0,0 +1,537 @@
+"""Where sessions and the short-lived records around them are kept.
+
+AuthSessionCRUD, the agent client and the modules keeping invitation codes,
+Idempotency-Key claims, webhook claims, funnel counters and job leases go
+through a SessionStore rather than the collections, so the storage can be
+chosen with CONTROLLER_SESSION_STORE:
+
+- mongo: the collections of api/db/collections.py, with the database
+  profiles of api/db/profiles.py
+- memory: in this process, for a single kiosk or a test run without MongoDB.
+  Everything is lost on restart and only visible to the worker that wrote
+  it, and the oldest sessions and records are dropped past
+  CONTROLLER_SESSION_STORE_MEMORY_MAX of each kind.
+
+Searches, exports and archival query MongoDB and are not available with the
+memory store. New kinds of short-lived records (an outbox, a cache) belong
+here, as records or as further methods implemented by every store.
+`python -m benchmarks.bench_store` compares the latency of the stores,
+api/db/tests/test_store.py checks that they behave alike.
+"""
+import copy
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import pymongo
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.database import Database
+from pymongo.errors import DuplicateKeyError
+
+from api.core.config import settings
+
+from .collections import COLLECTION_NAMES
+from .profiles import DB_PROFILES, get_collection
+from .session import create_indexes
+
+SESSION_STORE_MONGO = "mongo"
+SESSION_STORE_MEMORY = "memory"
+
+
+def _match_query(match: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        k: {"$in": v} if isinstance(v, list) else v for k, v in (match or {}).items()
+    }
+
+
+def _matches(doc: Dict[str, Any], match: Optional[Dict[str, Any]]) -> bool:
+    return all(
+        doc.get(k) in (v if isinstance(v, list) else [v])
+        for k, v in (match or {}).items()
+    )
+
+
+class SessionStore(ABC):
+    """Sessions are documents keyed by an ObjectId `_id`.
+
+    Records are short-lived documents of one of COLLECTION_NAMES, keyed by
+    their `_id` and kept until their `expires_at` (naive UTC). Documents
+    handed out are the caller's to modify. `profile` tells the MongoDB store
+    the durability or read routing a call needs, other stores ignore it.
+    """
+
+    # Whether what is stored is in MongoDB, shared by every worker
+    uses_mongodb: bool
+
+    @abstractmethod
+    def insert_session(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        """Store a new session, returned with its `_id`."""
+
+    @abstractmethod
+    def get_session(
+        self,
+        id: ObjectId,
+        projection: Optional[Dict[str, int]] = None,
+        profile: DB_PROFILES = DB_PROFILES.DEFAULT,
+    ) -> Optional[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def find_session(self, pres_exch_id: str) -> Optional[Dict[str, Any]]:
+        """The session of a presentation exchange."""
+
+    @abstractmethod
+    def update_session(
+        self,
+        id: ObjectId,
+        fields: Dict[str, Any],
+        profile: DB_PROFILES = DB_PROFILES.CRITICAL_TRANSITION,
+        match: Optional[Dict[str, Any]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Set top-level fields, returns the session as updated.
+
+        With `match`, only while the session's top-level fields still have
+        those values, or one of them for a list (None for a missing field),
+        None otherwise.
+        """
+
+    @abstractmethod
+    def increment_session(
+        self,
+        id: ObjectId,
+        field: str,
+        profile: DB_PROFILES = DB_PROFILES.BEST_EFFORT_AUDIT,
+    ):
+        pass
+
+    @abstractmethod
+    def delete_session(self, id: ObjectId) -> bool:
+        pass
+
+    @abstractmethod
+    def pres_exch_cleanup_batch(
+        self, proof_statuses: List[str], batch_size: int, max_attempts: int
+    ) -> List[Dict[str, Any]]:
+        """Sessions in one of `proof_statuses` whose agent record remains,
+        skipping those that failed to clean up `max_attempts` times."""
+
+    @abstractmethod
+    def put_proof_config(self, pres_exch_id: str, proof_req_config_id: str):
+        pass
+
+    @abstractmethod
+    def get_proof_config(self, pres_exch_id: str) -> Optional[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def insert_record(
+        self,
+        kind: COLLECTION_NAMES,
+        doc: Dict[str, Any],
+        profile: DB_PROFILES = DB_PROFILES.DEFAULT,
+    ) -> bool:
+        """Store a record, False while its `_id` is taken by one not expired."""
+
+    @abstractmethod
+    def get_record(
+        self,
+        kind: COLLECTION_NAMES,
+        id: str,
+        profile: DB_PROFILES = DB_PROFILES.DEFAULT,
+    ) -> Optional[Dict[str, Any]]:
+        """The record, None once it expired."""
+
+    @abstractmethod
+    def update_record(
+        self,
+        kind: COLLECTION_NAMES,
+        id: str,
+        fields: Dict[str, Any],
+        profile: DB_PROFILES = DB_PROFILES.DEFAULT,
+        match: Optional[Dict[str, Any]] = None,
+    ) -> bool:
+        """Set top-level fields of a record not expired, `match` as for sessions."""
+
+    @abstractmethod
+    def delete_record(
+        self,
+        kind: COLLECTION_NAMES,
+        id: str,
+        profile: DB_PROFILES = DB_PROFILES.DEFAULT,
+        match: Optional[Dict[str, Any]] = None,
+    ) -> bool:
+        pass
+
+    @abstractmethod
+    def count_funnel(self, minute: datetime, inc: Dict[str, int]):
+        """Add to the counters of a funnel cohort, named as `$inc` would."""
+
+    @abstractmethod
+    def get_funnel(self, since: datetime, until: datetime) -> List[Dict[str, Any]]:
+        """The cohorts of the minutes in [since, until), without their `_id`."""
+
+    @abstractmethod
+    def acquire_lease(self, name: str, owner: str, expires_at: datetime) -> bool:
+        """Take or renew a lease, False while another owner holds it."""
+
+    @abstractmethod
+    def release_lease(self, name: str, owner: str):
+        pass
+
+    @abstractmethod
+    def create_indexes(self):
+        pass
+
+    @abstractmethod
+    def ping(self, timeout: float):
+        """Raise when the storage does not answer within `timeout` seconds."""
+
+
+class MongoSessionStore(SessionStore):
+    uses_mongodb = True
+
+    def __init__(self, db: Database):
+        self._db = db
+
+    def _sessions(self, profile: DB_PROFILES):
+        return get_collection(self._db, COLLECTION_NAMES.AUTH_SESSION, profile)
+
+    def _proof_configs(self):
+        return get_collection(
+            self._db,
+            COLLECTION_NAMES.PRES_EX_ID_TO_PROOF_REQ_CONFIG_ID,
+            DB_PROFILES.DEFAULT,
+        )
+
+    def insert_session(self, doc):
+        col = self._sessions(DB_PROFILES.DEFAULT)
+        result = col.insert_one(doc)
+        return col.find_one({"_id": result.inserted_id})
+
+    def get_session(self, id, projection=None, profile=DB_PROFILES.DEFAULT):
+        return self._sessions(profile).find_one({"_id": id}, projection)
+
+    def find_session(self, pres_exch_id):
+        return self._sessions(DB_PROFILES.DEFAULT).find_one(
+            {"pres_exch_id": pres_exch_id}
+        )
+
+    def update_session(
+        self, id, fields, profile=DB_PROFILES.CRITICAL_TRANSITION, match=None
+    ):
+        return self._sessions(profile).find_one_and_update(
+            {**_match_query(match), "_id": id},
+            {"$set": fields},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def increment_session(self, id, field, profile=DB_PROFILES.BEST_EFFORT_AUDIT):
+        self._sessions(profile).update_one({"_id": id}, {"$inc": {field: 1}})
+
+    def delete_session(self, id):
+        return bool(
+            self._sessions(DB_PROFILES.DEFAULT).find_one_and_delete({"_id": id})
+        )
+
+    def pres_exch_cleanup_batch(self, proof_statuses, batch_size, max_attempts):
+        cursor = (
+            self._sessions(DB_PROFILES.DEFAULT)
+            .find(
+                {
+                    "proof_status": {"$in": proof_statuses},
+                    "pres_exch_deleted_at": None,
+                    "pres_exch_cleanup_attempts": {"$not": {"$gte": max_attempts}},
+                }
+            )
+            .limit(batch_size)
+        )
+        return list(cursor)
+
+    def put_proof_config(self, pres_exch_id, proof_req_config_id):
+        self._proof_configs().insert_one(
+            {"pres_exch_id": pres_exch_id, "proof_req_config_id": proof_req_config_id}
+        )
+
+    def get_proof_config(self, pres_exch_id):
+        return self._proof_configs().find_one({"pres_exch_id": pres_exch_id})
+
+    def insert_record(self, kind, doc, profile=DB_PROFILES.DEFAULT):
+        col = get_collection(self._db, kind, profile)
+        # Expired records may still be around until the TTL monitor runs
+        col.delete_one({"_id": doc["_id"], "expires_at": {"$lte": datetime.utcnow()}})
+        try:
+            col.insert_one(doc)
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def get_record(self, kind, id, profile=DB_PROFILES.DEFAULT):
+        return get_collection(self._db, kind, profile).find_one(
+            {"_id": id, "expires_at": {"$gt": datetime.utcnow()}}
+        )
+
+    def update_record(self, kind, id, fields, profile=DB_PROFILES.DEFAULT, match=None):
+        result = get_collection(self._db, kind, profile).update_one(
+            {
+                **_match_query(match),
+                "_id": id,
+                "expires_at": {"$gt": datetime.utcnow()},
+            },
+            {"$set": fields},
+        )
+        return result.matched_count == 1
+
+    def delete_record(self, kind, id, profile=DB_PROFILES.DEFAULT, match=None):
+        result = get_collection(self._db, kind, profile).delete_one(
+            {**_match_query(match), "_id": id}
+        )
+        return result.deleted_count == 1
+
+    def count_funnel(self, minute, inc):
+        get_collection(
+            self._db, COLLECTION_NAMES.SESSION_FUNNEL, DB_PROFILES.BEST_EFFORT_AUDIT
+        ).update_one({"minute": minute}, {"$inc": inc}, upsert=True)
+
+    def get_funnel(self, since, until):
+        col = get_collection(
+            self._db, COLLECTION_NAMES.SESSION_FUNNEL, DB_PROFILES.STALE_OK_READ
+        )
+        return list(col.find({"minute": {"$gte": since, "$lt": until}}, {"_id": 0}))
+
+    def acquire_lease(self, name, owner, expires_at):
+        try:
+            get_collection(
+                self._db, COLLECTION_NAMES.JOB_LEASE, DB_PROFILES.CRITICAL_TRANSITION
+            ).update_one(
+                {
+                    "_id": name,
+                    "$or": [
+                        {"owner": owner},
+                        {"expires_at": {"$lte": datetime.utcnow()}},
+                    ],
+                },
+                {"$set": {"owner": owner, "expires_at": expires_at}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # The lease exists and is held by someone else
+            return False
+        return True
+
+    def release_lease(self, name, owner):
+        get_collection(
+            self._db, COLLECTION_NAMES.JOB_LEASE, DB_PROFILES.CRITICAL_TRANSITION
+        ).update_one(
+            {"_id": name, "owner": owner},
+            {"$set": {"expires_at": datetime.utcnow()}},
+        )
+
+    def create_indexes(self):
+        create_indexes(self._db)
+
+    def ping(self, timeout):
+        with pymongo.timeout(timeout):
+            self._db.command("ping")
+
+
+class MemorySessionStore(SessionStore):
+    uses_mongodb = False
+
+    def __init__(self, max_sessions: int):
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        # Oldest first, the order eviction goes in
+        self._sessions: OrderedDict[ObjectId, Dict[str, Any]] = OrderedDict()
+        self._by_pres_exch_id: Dict[str, ObjectId] = {}
+        self._proof_configs: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+        self._records: Dict[str, OrderedDict[str, Dict[str, Any]]] = {}
+        self._funnel: OrderedDict[datetime, Dict[str, Any]] = OrderedDict()
+        self._leases: Dict[str, Dict[str, Any]] = {}
+
+    def _forget(self, doc: Dict[str, Any]):
+        pres_exch_id = doc.get("pres_exch_id")
+        if self._by_pres_exch_id.get(pres_exch_id) == doc["_id"]:
+            del self._by_pres_exch_id[pres_exch_id]
+            self._proof_configs.pop(pres_exch_id, None)
+
+    def insert_session(self, doc):
+        doc = copy.deepcopy(doc)
+        doc.setdefault("_id", ObjectId())
+        with self._lock:
+            self._sessions[doc["_id"]] = doc
+            if doc.get("pres_exch_id") is not None:
+                self._by_pres_exch_id[doc["pres_exch_id"]] = doc["_id"]
+            while len(self._sessions) > self.max_sessions:
+                self._forget(self._sessions.popitem(last=False)[1])
+            return copy.deepcopy(doc)
+
+    def get_session(self, id, projection=None, profile=DB_PROFILES.DEFAULT):
+        with self._lock:
+            doc = self._sessions.get(id)
+            if doc is None:
+                return None
+            if projection is not None:
+                doc = {k: v for k, v in doc.items() if k == "_id" or k in projection}
+            return copy.deepcopy(doc)
+
+    def find_session(self, pres_exch_id):
+        with self._lock:
+            id = self._by_pres_exch_id.get(pres_exch_id)
+            return copy.deepcopy(self._sessions[id]) if id is not None else None
+
+    def update_session(
+        self, id, fields, profile=DB_PROFILES.CRITICAL_TRANSITION, match=None
+    ):
+        with self._lock:
+            doc = self._sessions.get(id)
+            if doc is None or not _matches(doc, match):
+                return None
+            doc.update(copy.deepcopy(fields))
+            return copy.deepcopy(doc)
+
+    def increment_session(self, id, field, profile=DB_PROFILES.BEST_EFFORT_AUDIT):
+        with self._lock:
+            doc = self._sessions.get(id)
+            if doc is not None:
+                doc[field] = doc.get(field, 0) + 1
+
+    def delete_session(self, id):
+        with self._lock:
+            doc = self._sessions.pop(id, None)
+            if doc is None:
+                return False
+            self._forget(doc)
+            return True
+
+    def pres_exch_cleanup_batch(self, proof_statuses, batch_size, max_attempts):
+        batch = []
+        with self._lock:
+            for doc in self._sessions.values():
+                if len(batch) == batch_size:
+                    break
+                if (
+                    doc.get("proof_status") in proof_statuses
+                    and doc.get("pres_exch_deleted_at") is None
+                    and doc.get("pres_exch_cleanup_attempts", 0) < max_attempts
+                ):
+                    batch.append(copy.deepcopy(doc))
+        return batch
+
+    def put_proof_config(self, pres_exch_id, proof_req_config_id):
+        with self._lock:
+            self._proof_configs[pres_exch_id] = {
+                "pres_exch_id": pres_exch_id,
+                "proof_req_config_id": proof_req_config_id,
+            }
+            # Also bounds the mappings of exchanges that never got a session
+            while len(self._proof_configs) > self.max_sessions:
+                self._proof_configs.popitem(last=False)
+
+    def get_proof_config(self, pres_exch_id):
+        with self._lock:
+            proof_config = self._proof_configs.get(pres_exch_id)
+            return dict(proof_config) if proof_config is not None else None
+
+    def _record(self, kind: str, id: str) -> Optional[Dict[str, Any]]:
+        records = self._records.get(kind, {})
+        doc = records.get(id)
+        if doc is not None and doc["expires_at"] <= datetime.utcnow():
+            del records[id]
+            return None
+        return doc
+
+    def insert_record(self, kind, doc, profile=DB_PROFILES.DEFAULT):
+        with self._lock:
+            if self._record(kind, doc["_id"]) is not None:
+                return False
+            records = self._records.setdefault(kind, OrderedDict())
+            records[doc["_id"]] = copy.deepcopy(doc)
+            while len(records) > self.max_sessions:
+                records.popitem(last=False)
+            return True
+
+    def get_record(self, kind, id, profile=DB_PROFILES.DEFAULT):
+        with self._lock:
+            return copy.deepcopy(self._record(kind, id))
+
+    def update_record(self, kind, id, fields, profile=DB_PROFILES.DEFAULT, match=None):
+        with self._lock:
+            doc = self._record(kind, id)
+            if doc is None or not _matches(doc, match):
+                return False
+            doc.update(copy.deepcopy(fields))
+            return True
+
+    def delete_record(self, kind, id, profile=DB_PROFILES.DEFAULT, match=None):
+        with self._lock:
+            records = self._records.get(kind, {})
+            doc = records.get(id)
+            if doc is None or not _matches(doc, match):
+                return False
+            del records[id]
+            return True
+
+    def count_funnel(self, minute, inc):
+        with self._lock:
+            cohort = self._funnel.setdefault(minute, {"minute": minute})
+            for path, amount in inc.items():
+                *parents, leaf = path.split(".")
+                counters = cohort
+                for key in parents:
+                    counters = counters.setdefault(key, {})
+                counters[leaf] = counters.get(leaf, 0) + amount
+            while len(self._funnel) > self.max_sessions:
+                self._funnel.popitem(last=False)
+
+    def get_funnel(self, since, until):
+        with self._lock:
+            return [
+                copy.deepcopy(cohort)
+                for minute, cohort in self._funnel.items()
+                if since <= minute < until
+            ]
+
+    def acquire_lease(self, name, owner, expires_at):
+        with self._lock:
+            lease = self._leases.get(name)
+            if (
+                lease is not None
+                and lease["owner"] != owner
+                and lease["expires_at"] > datetime.utcnow()
+            ):
+                return False
+            self._leases[name] = {"owner": owner, "expires_at": expires_at}
+            return True
+
+    def release_lease(self, name, owner):
+        with self._lock:
+            lease = self._leases.get(name)
+            if lease is not None and lease["owner"] == owner:
+                lease["expires_at"] = datetime.utcnow()
+
+    def create_indexes(self):
+        pass
+
+    def ping(self, timeout):
+        pass
+
+
+_memory_store: Optional[MemorySessionStore] = None
+
+
+def get_store(db: Database) -> SessionStore:
+    global _memory_store
+    if settings.CONTROLLER_SESSION_STORE == SESSION_STORE_MONGO:
+        return MongoSessionStore(db)
+    if settings.CONTROLLER_SESSION_STORE == SESSION_STORE_MEMORY:
+        if _memory_store is None:
+            _memory_store = MemorySessionStore(
+                int(settings.CONTROLLER_SESSION_STORE_MEMORY_MAX)
+            )
+        return _memory_store
+    raise ValueError(
+        f"unknown CONTROLLER_SESSION_STORE: {settings.CONTROLLER_SESSION_STORE}"
+    )
@@ -0,0 +1,248 @@
+"""Every session store must behave alike, whichever CONTROLLER_SESSION_STORE
+is chosen. The mongo store runs on the mongomock database of conftest.py."""
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from api.authSessions.models import (
+    AuthSession,
+    AuthSessionCreate,
+    AuthSessionState,
+    AuthSessionStatus,
+)
+from api.db.collections import COLLECTION_NAMES
+from api.db.store import (
+    SESSION_STORE_MEMORY,
+    SESSION_STORE_MONGO,
+    MemorySessionStore,
+    MongoSessionStore,
+)
+
+PROOF_CONFIG_ID = "age-verification-bc-person-credential"
+KIND = COLLECTION_NAMES.IDEMPOTENCY_KEY
+
+
+@pytest.fixture(params=[SESSION_STORE_MONGO, SESSION_STORE_MEMORY])
+def store(request, db):
+    if request.param == SESSION_STORE_MONGO:
+        return MongoSessionStore(db)
+    return MemorySessionStore(100)
+
+
+def new_session(**fields) -> dict:
+    auth_session = AuthSessionCreate(
+        pres_exch_id=str(uuid.uuid4()),
+        metadata={"other_system_id": 123, "store": "Victoria"},
+        notify_endpoint="https://integrator.example/webhook#api-key",
+        proof_req_config_id=PROOF_CONFIG_ID,
+    )
+    return {**jsonable_encoder(auth_session), **fields}
+
+
+def new_record(id: str = "key", expires_in: float = 60, **fields) -> dict:
+    # MongoDB keeps milliseconds
+    now = datetime.utcnow().replace(microsecond=0)
+    return {"_id": id, "expires_at": now + timedelta(seconds=expires_in), **fields}
+
+
+def test_insert_and_get(store):
+    doc = new_session()
+    inserted = store.insert_session(dict(doc))
+    assert isinstance(inserted["_id"], ObjectId)
+    assert inserted["pres_exch_id"] == doc["pres_exch_id"]
+    assert store.get_session(inserted["_id"]) == inserted
+    assert store.get_session(ObjectId()) is None
+    AuthSession(**inserted)
+
+
+def test_projection(store):
+    inserted = store.insert_session(new_session())
+    status = store.get_session(inserted["_id"], AuthSessionStatus.projection())
+    assert set(status) <= set(AuthSessionStatus.projection()) | {"_id"}
+    assert "lifecycle_timestamps" not in status
+    assert AuthSessionStatus(**status).pres_exch_id == inserted["pres_exch_id"]
+
+
+def test_find_by_pres_exch_id(store):
+    inserted = store.insert_session(new_session())
+    store.insert_session(new_session())
+    assert store.find_session(inserted["pres_exch_id"])["_id"] == inserted["_id"]
+    assert store.find_session(str(uuid.uuid4())) is None
+
+
+def test_update(store):
+    inserted = store.insert_session(new_session())
+    deleted_at = datetime.now().replace(microsecond=0)
+    updated = store.update_session(
+        inserted["_id"],
+        {
+            "proof_status": str(AuthSessionState.SUCCESS),
+            "pres_exch_deleted_at": deleted_at,
+        },
+    )
+    assert updated["proof_status"] == AuthSessionState.SUCCESS
+    assert updated["pres_exch_deleted_at"] == deleted_at
+    assert updated["metadata"] == inserted["metadata"]
+    assert store.update_session(ObjectId(), {"proof_status": "failure"}) is None
+
+
+def test_conditional_update(store):
+    inserted = store.insert_session(new_session())
+    initiated = {"proof_status": [str(AuthSessionState.INITIATED), None]}
+    expired = store.update_session(
+        inserted["_id"], {"proof_status": "expired"}, match=initiated
+    )
+    assert expired["proof_status"] == "expired"
+    assert (
+        store.update_session(
+            inserted["_id"], {"proof_status": "expired"}, match=initiated
+        )
+        is None
+    )
+    assert (
+        store.update_session(
+            inserted["_id"],
+            {"proof_status": "success"},
+            match={"proof_status": "expired"},
+        )["proof_status"]
+        == "success"
+    )
+
+
+def test_documents_are_copies(store):
+    inserted = store.insert_session(new_session())
+    inserted["metadata"]["store"] = "changed"
+    fetched = store.get_session(inserted["_id"])
+    assert fetched["metadata"]["store"] == "Victoria"
+    fetched["metadata"]["store"] = "changed"
+    assert (
+        store.find_session(inserted["pres_exch_id"])["metadata"]["store"] == "Victoria"
+    )
+
+
+def test_increment(store):
+    inserted = store.insert_session(new_session())
+    store.increment_session(inserted["_id"], "pres_exch_cleanup_attempts")
+    store.increment_session(inserted["_id"], "pres_exch_cleanup_attempts")
+    assert store.get_session(inserted["_id"])["pres_exch_cleanup_attempts"] == 2
+    store.increment_session(ObjectId(), "pres_exch_cleanup_attempts")
+
+
+def test_cleanup_batch(store):
+    terminal = [str(AuthSessionState.SUCCESS), str(AuthSessionState.EXPIRED)]
+    due = [
+        store.insert_session(new_session(proof_status="success"))["_id"],
+        store.insert_session(new_session(proof_status="expired"))["_id"],
+        store.insert_session(
+            new_session(proof_status="success", pres_exch_cleanup_attempts=2)
+        )["_id"],
+    ]
+    store.insert_session(new_session(proof_status="initiated"))
+    store.insert_session(
+        new_session(proof_status="success", pres_exch_deleted_at=datetime.now())
+    )
+    store.insert_session(
+        new_session(proof_status="failure", pres_exch_cleanup_attempts=0)
+    )
+    store.insert_session(
+        new_session(proof_status="success", pres_exch_cleanup_attempts=5)
+    )
+    batch = store.pres_exch_cleanup_batch(terminal, 10, 5)
+    assert sorted(doc["_id"] for doc in batch) == sorted(due)
+    assert len(store.pres_exch_cleanup_batch(terminal, 2, 5)) == 2
+
+
+def test_delete(store):
+    inserted = store.insert_session(new_session())
+    assert store.delete_session(inserted["_id"]) is True
+    assert store.get_session(inserted["_id"]) is None
+    assert store.find_session(inserted["pres_exch_id"]) is None
+    assert store.delete_session(inserted["_id"]) is False
+
+
+def test_proof_config(store):
+    pres_exch_id = str(uuid.uuid4())
+    store.put_proof_config(pres_exch_id, PROOF_CONFIG_ID)
+    proof_config = store.get_proof_config(pres_exch_id)
+    assert proof_config["pres_exch_id"] == pres_exch_id
+    assert proof_config["proof_req_config_id"] == PROOF_CONFIG_ID
+    assert store.get_proof_config(str(uuid.uuid4())) is None
+
+
+def test_records(store):
+    record = new_record(response=None)
+    assert store.insert_record(KIND, dict(record)) is True
+    assert store.insert_record(KIND, new_record()) is False
+    assert store.get_record(KIND, "key") == record
+    assert store.get_record(KIND, "other") is None
+    # Kinds do not share ids
+    assert store.insert_record(COLLECTION_NAMES.WEBHOOK_EVENT, new_record()) is True
+
+    assert store.update_record(KIND, "key", {"response": {"id": "1"}}) is True
+    assert store.get_record(KIND, "key")["response"] == {"id": "1"}
+    assert store.update_record(KIND, "other", {"response": None}) is False
+
+    assert store.delete_record(KIND, "key", match={"response": None}) is False
+    assert store.delete_record(KIND, "key") is True
+    assert store.delete_record(KIND, "key") is False
+    assert store.get_record(KIND, "key") is None
+
+
+def test_expired_records(store):
+    assert store.insert_record(KIND, new_record(expires_in=-1)) is True
+    assert store.get_record(KIND, "key") is None
+    assert store.update_record(KIND, "key", {"response": None}) is False
+    # Taken over although no TTL monitor removed it
+    assert store.insert_record(KIND, new_record()) is True
+    assert store.get_record(KIND, "key") is not None
+
+
+def test_funnel(store):
+    minute = datetime(2024, 5, 1, 12, 30)
+    store.count_funnel(minute, {"counts.created": 1})
+    store.count_funnel(
+        minute, {"counts.created": 1, "counts.success": 1, "latency.total.5000": 1}
+    )
+    store.count_funnel(minute + timedelta(minutes=1), {"counts.created": 1})
+    cohorts = store.get_funnel(minute, minute + timedelta(minutes=1))
+    assert cohorts == [
+        {
+            "minute": minute,
+            "counts": {"created": 2, "success": 1},
+            "latency": {"total": {"5000": 1}},
+        }
+    ]
+    assert len(store.get_funnel(minute, minute + timedelta(minutes=2))) == 2
+    assert store.get_funnel(minute - timedelta(minutes=1), minute) == []
+
+
+def test_leases(store):
+    later = datetime.utcnow() + timedelta(seconds=60)
+    assert store.acquire_lease("job", "a", later) is True
+    assert store.acquire_lease("job", "b", later) is False
+    # Renewed by its owner
+    assert store.acquire_lease("job", "a", later) is True
+    assert store.acquire_lease("other", "b", later) is True
+    store.release_lease("job", "b")
+    assert store.acquire_lease("job", "b", later) is False
+    store.release_lease("job", "a")
+    assert store.acquire_lease("job", "b", later) is True
+
+
+def test_ping(store):
+    store.create_indexes()
+    store.ping(1)
+
+
+def test_memory_store_is_bounded():
+    store = MemorySessionStore(2)
+    first, *_ = [store.insert_session(new_session()) for _ in range(3)]
+    assert store.get_session(first["_id"]) is None
+    assert store.find_session(first["pres_exch_id"]) is None
+    for id in ("a", "b", "c"):
+        store.insert_record(KIND, new_record(id))
+    assert store.get_record(KIND, "a") is None
+    assert store.get_record(KIND, "c") is not None
@@ -5,22 +5,31 @@ import time
 import uuid
 from pathlib import Path
 
-import uvicorn
-from api.core.config import settings
+from api.core.compression import CompressionMiddleware
+from api.core.config import settings, setup_logging
+from api.core.logger_util import force_sample, sample_request
+from api.core.profiling import profiling_middleware
+from api.core.serialization import FastJSONResponse
+from api.core.static_assets import assets
 from fastapi import FastAPI
 from starlette.requests import Request
 from starlette.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import status as http_status
-from fastapi.responses import JSONResponse
 
-from .db.session import get_db, init_db
+from .authSessions import archive, idempotency, pres_exch_cleanup, status_cache
+from .core import jobs, readiness, result_tokens
+from .core.acapy import client as acapy_client, webhook_capture
+from .db.profiles import check_profiles
+from .db.session import close_client, get_db
+from .db.store import get_store
 from .routers import (
     acapy_handler,
+    admin,
     age_verification,
     presentation_request,
+    static_assets,
 )
-from .db.session import init_db, get_db
 from .routers.socketio import sio_app
 
 logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
@@ -40,6 +49,7 @@ def get_application() -> FastAPI:
         title=settings.TITLE,
         description=settings.DESCRIPTION,
         debug=settings.DEBUG,
+        default_response_class=FastJSONResponse,
     )
     return application
 
@@ -50,6 +60,8 @@ app.include_router(presentation_request.router, include_in_schema=False)
 app.include_router(
     age_verification.router, tags=["age-verification"], include_in_schema=True
 )
+app.include_router(admin.router, prefix="/admin", include_in_schema=False)
+app.include_router(static_assets.router, include_in_schema=False)
 # Connect the websocket server to run within the FastAPI app
 app.mount("/ws", sio_app)
 
@@ -64,17 +76,28 @@ if origins:
         allow_headers=["*"],
     )
 
+if settings.CONTROLLER_COMPRESSION_ENABLED:
+    app.add_middleware(
+        CompressionMiddleware, minimum_size=settings.CONTROLLER_COMPRESSION_MIN_SIZE
+    )
+
+
+# Registered only when enabled so that requests pay nothing otherwise
+if settings.CONTROLLER_PROFILING_ENABLED:
+    app.middleware("http")(profiling_middleware)
+
 
 @app.middleware("http")
 async def logging_middleware(request: Request, call_next) -> Response:
-    structlog.threadlocal.clear_threadlocal()
-    structlog.threadlocal.bind_threadlocal(
-        logger="uvicorn.access",
+    # Only bind what is needed to correlate a request's logs. The ASGI scope
+    # and cookies are large, and the query string may carry metadata.
+    structlog.contextvars.clear_contextvars()
+    structlog.contextvars.bind_contextvars(
         request_id=str(uuid.uuid4()),
-        cookies=request.cookies,
-        scope=request.scope,
-        url=str(request.url),
+        method=request.method,
+        path=request.url.path,
     )
+    sample_request(request.url.path)
     start_time = time.time()
     try:
         response: Response = await call_next(request)
@@ -90,6 +113,7 @@ async def logging_middleware(request: Request, call_next) -> Response:
             )
         # Otherwise, extract the exception from traceback, log and return a 500 response
         else:
+            force_sample()
             logger.info(
                 "failed to process a request",
                 status_code=http_status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -99,7 +123,7 @@ async def logging_middleware(request: Request, call_next) -> Response:
             # Need to explicitly log the traceback
             logger.error(traceback.format_exc())
 
-            return JSONResponse(
+            return FastJSONResponse(
                 status_code=http_status.HTTP_500_INTERNAL_SERVER_ERROR,
                 content={
                     "status": "error",
@@ -112,21 +136,63 @@ async def logging_middleware(request: Request, call_next) -> Response:
 @app.on_event("startup")
 async def on_tenant_startup():
     """Register any events we need to respond to."""
+    setup_logging()
     logger.info(">>> Starting up new app...")
-    await init_db()
+    check_profiles()
+    idempotency.check_settings()
+    # Raises on an unknown CONTROLLER_SESSION_STORE
+    store = get_store(await get_db())
+    assets.build()
+    # In the background, GET /ready reports the progress
+    readiness.start(
+        await get_db(),
+        [
+            ("indexes", lambda db: store.create_indexes()),
+            ("agent", acapy_client.warm_up),
+            ("page", age_verification.warm_up),
+            ("camera_page", presentation_request.warm_up),
+            ("result_signing_key", lambda db: result_tokens.get_signer()),
+        ],
+    )
+    # Each of these runs on one replica at a time, see api/core/jobs.py
+    if settings.CONTROLLER_PRES_EXCH_CLEANUP_ENABLED:
+        jobs.register(pres_exch_cleanup.JOB)
+    # Archival moves sessions between MongoDB collections
+    if settings.CONTROLLER_SESSION_ARCHIVE_ENABLED and store.uses_mongodb:
+        jobs.register(archive.JOB)
+    jobs.start(await get_db())
+    status_cache.start(await get_db())
 
 
 @app.on_event("shutdown")
-def on_tenant_shutdown():
-    """TODO no-op for now."""
+async def on_tenant_shutdown():
+    """Stop background work."""
     logger.warning(">>> Shutting down app ...")
+    readiness.stop()
+    await jobs.stop()
+    status_cache.stop()
+    webhook_capture.close()
+    close_client()
 
 
-@app.get("/health", tags=["liveness", "readiness"])
+@app.get("/health", tags=["liveness"])
 def main():
     return {"status": "ok", "health": "ok"}
 
 
+@app.get("/ready", tags=["readiness"])
+async def ready():
+    """Warm-up progress and the last dependency probes, 503 until ready."""
+    return FastJSONResponse(
+        readiness.report(),
+        status_code=http_status.HTTP_200_OK
+        if readiness.is_ready()
+        else http_status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
+
+
 if __name__ == "__main__":
+    import uvicorn
+
     logger.info("main.")
     uvicorn.run(app, host="0.0.0.0", port=5100)
@@ -1,31 +1,67 @@
-import json
+import asyncio
+import time
 import structlog
 from datetime import datetime, timedelta
+from typing import Optional
 
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, HTTPException, Request
 from pymongo.database import Database
 
 from ..authSessions.crud import AuthSessionCRUD
-from ..authSessions.models import AuthSession, AuthSessionPatch, AuthSessionState
-from ..core.acapy.client import AcapyClient
+from ..authSessions.funnel import mark_stage
+from ..authSessions.models import (
+    AuthSession,
+    AuthSessionPatch,
+    AuthSessionState,
+    LifecycleStage,
+)
+from ..core import result_tokens
+from ..core.acapy import webhook_capture
+from ..core.acapy.client import AcapyClient, get_revealed_attributes
+from ..core.acapy.webhook_events import event_key, seen_events
+from ..core.serialization import loads
 from ..db.session import get_db
 
 from ..core.config import settings
 
 logger = structlog.getLogger(__name__)
-from ..routers.socketio import sio, connections_reload
+from ..routers.socketio import emit_status
 from ..routers.webhook_deliverer import deliver_notification
 
 router = APIRouter()
 
 
 async def _parse_webhook_body(request: Request):
-    return json.loads((await request.body()).decode("ascii"))
+    return loads(await request.body())
 
 
 @router.post("/topic/{topic}/")
 async def post_topic(request: Request, topic: str, db: Database = Depends(get_db)):
     """Called by aca-py agent."""
+    if not webhook_capture.enabled():
+        return await _post_topic(request, topic, db)
+
+    received_at = time.time()
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await _post_topic(request, topic, db)
+        status_code = 200
+        return response
+    except HTTPException as err:
+        status_code = err.status_code
+        raise
+    finally:
+        webhook_capture.record(
+            topic,
+            await request.body(),
+            received_at,
+            time.perf_counter() - started,
+            status_code,
+        )
+
+
+async def _post_topic(request: Request, topic: str, db: Database):
     logger.info(f">>> post_topic : topic={topic}")
 
     client = AcapyClient(db=db)
@@ -33,71 +69,108 @@ async def post_topic(request: Request, topic: str, db: Database = Depends(get_db
         webhook_body = await _parse_webhook_body(request)
         logger.info(f">>>> pres_exch_id: {webhook_body['presentation_exchange_id']}")
 
-        auth_session: AuthSession = await AuthSessionCRUD(db).get_by_pres_exch_id(
-            webhook_body["presentation_exchange_id"]
-        )
+        event = event_key(topic, webhook_body)
+        token = seen_events.claim(db, event) if event else None
+        if event and token is None:
+            logger.info("skipping duplicate webhook", state=webhook_body.get("state"))
+            return {}
+        try:
+            await _handle_present_proof(db, client, webhook_body)
+        except BaseException:
+            if event:
+                seen_events.release(db, event, token)
+            raise
+        if event:
+            seen_events.done(db, event, token)
+    else:
+        logger.debug("skipping webhook")
 
-        # Get the saved websocket session
-        pid = str(auth_session.id)
-        connections = connections_reload()
-        sid = connections.get(pid)
-
-        if webhook_body["state"] == "presentation_received":
-            logger.info("GOT A PRESENTATION, TIME TO VERIFY")
-            client.verify_presentation(auth_session.pres_exch_id)
-            # This state is the default on the front end.. So don't send a status
-
-        if webhook_body["state"] == "verified":
-            logger.info("VERIFIED")
-            if webhook_body["verified"] == "true":
-                auth_session.proof_status = AuthSessionState.SUCCESS
-                await sio.emit("status", {"status": "success"}, to=sid)
-                if auth_session.notify_endpoint:
-                    deliver_notification(
-                        "status", {"status": "success"}, auth_session.notify_endpoint
-                    )
-            else:
-                auth_session.proof_status = AuthSessionState.FAILURE
-                await sio.emit("status", {"status": "failure"}, to=sid)
-                if auth_session.notify_endpoint:
-                    deliver_notification(
-                        "status", {"status": "failure"}, auth_session.notify_endpoint
-                    )
-
-            await AuthSessionCRUD(db).patch(
-                str(auth_session.id), AuthSessionPatch(**auth_session.dict())
-            )
+    return {}
 
-        # Calcuate the expiration time of the proof
-        now_time = datetime.now()
-        expired_time = now_time + timedelta(
-            seconds=settings.CONTROLLER_PRESENTATION_EXPIRE_TIME
-        )
 
-        # Update the expiration time of the proof
-        auth_session.expired_timestamp = expired_time
+async def _issue_result_token(
+    client: AcapyClient, auth_session: AuthSession, webhook_body: dict
+) -> Optional[str]:
+    if result_tokens.get_signer() is None:
+        return None
+    revealed_attributes = None
+    if auth_session.proof_status == AuthSessionState.SUCCESS:
+        pres_exch = webhook_body
+        if "presentation" not in pres_exch:
+            # Webhooks may leave the presentation out, the agent has it
+            pres_exch = await asyncio.to_thread(
+                client.get_presentation_request, auth_session.pres_exch_id
+            )
+        revealed_attributes = get_revealed_attributes(pres_exch)
+    return result_tokens.issue(
+        str(auth_session.id),
+        str(auth_session.proof_status),
+        revealed_attributes,
+        {str(k): v for k, v in auth_session.lifecycle_timestamps.items()},
+        auth_session.metadata,
+    )
+
+
+async def _handle_present_proof(db: Database, client: AcapyClient, webhook_body: dict):
+    auth_session: AuthSession = await AuthSessionCRUD(db).get_by_pres_exch_id(
+        webhook_body["presentation_exchange_id"]
+    )
+
+    pid = str(auth_session.id)
+
+    if webhook_body["state"] == "presentation_received":
+        logger.info("GOT A PRESENTATION, TIME TO VERIFY")
+        # Persisted along with the expiration time below
+        mark_stage(db, auth_session, LifecycleStage.PRESENTATION_RECEIVED)
+        client.verify_presentation(auth_session.pres_exch_id)
+        # This state is the default on the front end.. So don't send a status
+
+    if webhook_body["state"] == "verified":
+        logger.info("VERIFIED")
+        if webhook_body["verified"] == "true":
+            auth_session.proof_status = AuthSessionState.SUCCESS
+            mark_stage(db, auth_session, LifecycleStage.SUCCESS)
+            status = {"status": "success"}
+        else:
+            auth_session.proof_status = AuthSessionState.FAILURE
+            mark_stage(db, auth_session, LifecycleStage.FAILURE)
+            status = {"status": "failure"}
+        result_token = await _issue_result_token(client, auth_session, webhook_body)
+        if result_token:
+            status["result_token"] = result_token
+        await emit_status(pid, status)
+        if auth_session.notify_endpoint:
+            deliver_notification("status", status, auth_session.notify_endpoint)
+
         await AuthSessionCRUD(db).patch(
             str(auth_session.id), AuthSessionPatch(**auth_session.dict())
         )
 
-        # Check if expired. But only if the proof has not been started.
-        if (
-            expired_time < now_time
-            and auth_session.proof_status == AuthSessionState.INITIATED
-        ):
-            logger.info("EXPIRED")
-            auth_session.proof_status = AuthSessionState.EXPIRED
-            await sio.emit("status", {"status": "expired"}, to=sid)
-            if auth_session.notify_endpoint:
-                deliver_notification(
-                    "status", {"status": "expired"}, auth_session.notify_endpoint
-                )
-            await AuthSessionCRUD(db).patch(
-                str(auth_session.id), AuthSessionPatch(**auth_session.dict())
+    # Calcuate the expiration time of the proof
+    now_time = datetime.now()
+    expired_time = now_time + timedelta(
+        seconds=settings.CONTROLLER_PRESENTATION_EXPIRE_TIME
+    )
+
+    # Update the expiration time of the proof
+    auth_session.expired_timestamp = expired_time
+    await AuthSessionCRUD(db).patch(
+        str(auth_session.id), AuthSessionPatch(**auth_session.dict())
+    )
+
+    # Check if expired. But only if the proof has not been started.
+    if (
+        expired_time < now_time
+        and auth_session.proof_status == AuthSessionState.INITIATED
+    ):
+        logger.info("EXPIRED")
+        auth_session.proof_status = AuthSessionState.EXPIRED
+        mark_stage(db, auth_session, LifecycleStage.EXPIRED)
+        await emit_status(pid, {"status": "expired"})
+        if auth_session.notify_endpoint:
+            deliver_notification(
+                "status", {"status": "expired"}, auth_session.notify_endpoint
             )
-
-        pass
-    else:
-        logger.debug("skipping webhook")
-
-    return {}
+        await AuthSessionCRUD(db).patch(
+            str(auth_session.id), AuthSessionPatch(**auth_session.dict())
+        )
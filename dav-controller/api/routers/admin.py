@@ -0,0 +1,87 @@
+import structlog
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import status as http_status
+from fastapi.responses import PlainTextResponse
+from pymongo.database import Database
+
+from ..authSessions import archive, pres_exch_cleanup, status_cache
+from ..authSessions.funnel import get_recent_funnel
+from ..core.acapy import webhook_capture, webhook_events
+from ..core import jobs
+from ..core.admission import exchange_creation_gate
+from ..core.auth import require_api_key
+from ..core.profiling import profiles
+from ..db.session import get_db
+
+logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
+
+router = APIRouter(dependencies=[Depends(require_api_key)])
+
+
+@router.get("/profiles")
+async def list_profiles():
+    """Most recent request profiles first."""
+    return profiles.list()
+
+
+@router.get("/profiles/{profile_id}", response_class=PlainTextResponse)
+async def get_profile(profile_id: str):
+    """Folded stacks, ready for flamegraph.pl or speedscope."""
+    profile = profiles.get(profile_id)
+    if profile is None:
+        raise HTTPException(
+            status_code=http_status.HTTP_404_NOT_FOUND,
+            detail="The profile hasn't been found!",
+        )
+    return profile.folded()
+
+
+@router.get("/funnel")
+async def get_session_funnel(
+    minutes: int = Query(default=60, ge=1, le=7 * 24 * 60),
+    db: Database = Depends(get_db),
+):
+    """Stage counts, conversion and latency percentiles of recent sessions."""
+    return get_recent_funnel(db, minutes)
+
+
+@router.get("/pres-exch-cleanup")
+async def get_pres_exch_cleanup_stats():
+    """Counters of the agent presentation exchange record cleanup."""
+    return pres_exch_cleanup.stats
+
+
+@router.get("/session-archive")
+async def get_session_archive_stats():
+    """Counters of the session archival."""
+    return archive.stats
+
+
+@router.get("/jobs")
+async def get_job_stats():
+    """Lease and run counters of the background jobs of this worker."""
+    return jobs.get_stats()
+
+
+@router.get("/admission")
+async def get_admission_stats():
+    """State of the session creation concurrency cap."""
+    return exchange_creation_gate.stats()
+
+
+@router.get("/webhook-dedup")
+async def get_webhook_dedup_stats():
+    """Counters of the agent webhooks processed and skipped as duplicates."""
+    return webhook_events.stats
+
+
+@router.get("/webhook-capture")
+async def get_webhook_capture_stats():
+    """Webhooks written to the capture files, and failures to write them."""
+    return {"enabled": webhook_capture.enabled(), **webhook_capture.stats}
+
+
+@router.get("/status-cache")
+async def get_status_cache_stats():
+    """Hit rate, size and change stream state of the session status cache."""
+    return status_cache.get_stats()
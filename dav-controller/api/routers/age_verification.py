@@ -1,49 +1,177 @@
+import asyncio
 import base64
+import hashlib
 import io
 import json
-import os
-import uuid
 from datetime import datetime
-from typing import Mapping, cast
+from typing import Mapping, Optional, Tuple, cast
 from urllib.parse import urlencode
 
-import qrcode
 import structlog
-import yaml
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    Security,
+)
 from fastapi import status as http_status
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
-from jinja2 import Template
+from fastapi.responses import (
+    HTMLResponse,
+    JSONResponse,
+    RedirectResponse,
+    StreamingResponse,
+)
 from pymongo.database import Database
-from pyop.exceptions import InvalidAuthenticationRequest
 
+from ..authSessions import idempotency, invitation_codes, search
 from ..authSessions.crud import AuthSessionCreate, AuthSessionCRUD
-from ..authSessions.models import AuthSessionPatch, AuthSessionState
-from ..core.acapy.client import AcapyClient, PresExProofConfig
-from ..core.auth import get_api_key
+from ..authSessions.funnel import count_stage, stamp_stage
+from ..authSessions.models import (
+    AuthSession,
+    AuthSessionPatch,
+    AuthSessionState,
+    LifecycleStage,
+)
+from ..authSessions.search import SessionFilter
+from ..core.acapy.client import (
+    AcapyClient,
+    PresExProofConfig,
+    default_proof_config_ident,
+    get_revealed_attributes,
+    load_proof_config,
+)
+from ..core import result_tokens
+from ..core.admission import exchange_creation_gate, limit_session_creation
+from ..core.auth import api_key_header, get_api_key, require_api_key
 from ..core.config import settings
 from ..core.logger_util import log_debug
 from ..core.models import (
     AgeVerificationModelCreate,
     AgeVerificationModelRead,
     AgeVerificationModelCreateRead,
+    AgeVerificationSearchRead,
+    BrowserSessionCreate,
     GenericErrorMessage,
 )
-from ..db.collections import COLLECTION_NAMES
 from ..db.session import get_db
+from ..db.store import get_store
 
 # Access to the websocket
-from ..routers.socketio import connections_reload, sio
+from ..routers.socketio import emit_status, register_connection, sio
 from ..routers.webhook_deliverer import deliver_notification
 
 # This allows the templates to insert assets like css, js or svg.
-from ..templates.helpers import add_asset
+from ..templates.helpers import add_asset, asset_url, get_template
 
 logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
 
 router = APIRouter()
 
 
+@router.get(
+    "/age-verification",
+    response_description="Search age verification records, newest first",
+    status_code=http_status.HTTP_200_OK,
+    response_model=AgeVerificationSearchRead,
+    responses={http_status.HTTP_400_BAD_REQUEST: {"model": GenericErrorMessage}},
+    dependencies=[
+        Depends(require_api_key),
+        Depends(search.require_searchable_store),
+    ],
+)
+async def search_dav_requests(
+    session_filter: SessionFilter = Depends(search.session_filter),
+    limit: int = Query(default=50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: Database = Depends(get_db),
+):
+    """Pass `next_cursor` back as `cursor` for the following page."""
+    items, next_cursor = await asyncio.to_thread(
+        search.search, db, session_filter, limit, cursor
+    )
+    return {"items": items, "next_cursor": next_cursor}
+
+
+# Declared before /age-verification/{pid}, which would match it otherwise
+@router.get(
+    "/age-verification/export",
+    response_description="Stream the matching age verification records",
+    status_code=http_status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    dependencies=[
+        Depends(require_api_key),
+        Depends(search.require_searchable_store),
+    ],
+)
+async def export_dav_requests(
+    session_filter: SessionFilter = Depends(search.session_filter),
+    format: str = Query(default="ndjson", regex="^(ndjson|csv)$"),
+    db: Database = Depends(get_db),
+):
+    """Every matching record, as NDJSON or CSV, newest first."""
+    filename = f"age-verification-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}"
+    if format == "csv":
+        content, media_type = search.export_csv(db, session_filter), "text/csv"
+    else:
+        content = search.export_ndjson(db, session_filter)
+        media_type = "application/x-ndjson"
+    return StreamingResponse(
+        content,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{format}"'},
+    )
+
+
+@router.get(
+    result_tokens.JWKS_PATH,
+    response_description="Keys that verify the signed verification results",
+    status_code=http_status.HTTP_200_OK,
+)
+async def get_result_token_keys(response: Response):
+    response.headers["Cache-Control"] = "public, max-age=3600"
+    return result_tokens.jwks()
+
+
+async def _expire(db: Database, pid: str) -> AuthSession:
+    """Expire a session that is still INITIATED past its expiry.
+
+    The status the caller decided on may be cached, and the session may have
+    been scanned or verified since. Only the write that still finds it
+    INITIATED expires it and notifies, otherwise the session is returned as
+    it is now.
+    """
+    crud = AuthSessionCRUD(db)
+    # Expiry writes the session, which takes the full model
+    auth_session = await crud.get(pid)
+    if not (
+        auth_session.proof_status == AuthSessionState.INITIATED
+        and auth_session.expired_timestamp < datetime.now()
+    ):
+        return auth_session
+    auth_session.proof_status = AuthSessionState.EXPIRED
+    stamp_stage(auth_session, LifecycleStage.EXPIRED)
+    expired = await crud.patch(
+        pid,
+        AuthSessionPatch(**auth_session.dict()),
+        expected_status=AuthSessionState.INITIATED,
+    )
+    if expired is None:
+        return await crud.get(pid)
+    logger.info("PROOF EXPIRED")
+    count_stage(db, auth_session, LifecycleStage.EXPIRED)
+    # Send message through the websocket.
+    await emit_status(pid, {"status": "expired"})
+    if auth_session.notify_endpoint:
+        deliver_notification(
+            "status", {"status": "expired"}, auth_session.notify_endpoint
+        )
+    return auth_session
+
+
 @log_debug
 @router.get(
     f"/age-verification/{{pid}}",
@@ -56,11 +184,9 @@ router = APIRouter()
 )
 async def get_dav_request(pid: str, db: Database = Depends(get_db)):
     """Called by authorize webpage to see if request is verified."""
-    auth_session = await AuthSessionCRUD(db).get(pid)
+    auth_session = await AuthSessionCRUD(db).get_status(pid)
 
     pid = str(auth_session.id)
-    connections = connections_reload()
-    sid = connections.get(pid)
 
     """
      Check if proof is expired. But only if the proof has not been started.
@@ -70,38 +196,25 @@ async def get_dav_request(pid: str, db: Database = Depends(get_db)):
         auth_session.expired_timestamp < datetime.now()
         and auth_session.proof_status == AuthSessionState.INITIATED
     ):
-        logger.info("PROOF EXPIRED")
-        auth_session.proof_status = AuthSessionState.EXPIRED
-        await AuthSessionCRUD(db).patch(
-            str(auth_session.id), AuthSessionPatch(**auth_session.dict())
-        )
-        # Send message through the websocket.
-        await sio.emit("status", {"status": "expired"}, to=sid)
-        if auth_session.notify_endpoint:
-            deliver_notification(
-                "status", {"status": "expired"}, auth_session.notify_endpoint
-            )
+        auth_session = await _expire(db, pid)
     if auth_session.proof_status == AuthSessionState.SUCCESS:
-        pres_exch = auth_session.presentation_exchange
-        logger.debug(f"PRES_EXCH: {pres_exch}")
-        col = db.get_collection(COLLECTION_NAMES.PRES_EX_ID_TO_PROOF_REQ_CONFIG_ID)
-        pres_ex_proof_req_id_dict = col.find_one(
-            {"pres_exch_id": auth_session.pres_exch_id}
+        pres_ex_proof_req_id_dict = get_store(db).get_proof_config(
+            auth_session.pres_exch_id
         )
         pres_ex_proof_req_id = PresExProofConfig(**pres_ex_proof_req_id_dict)
         proof_req_id = pres_ex_proof_req_id.proof_req_config_id
-        resp_incl_revealed_attibs = {}
-        proof_revealed_attr_group_dict = pres_exch["presentation"]["requested_proof"][
-            "revealed_attr_groups"
-        ]
-        for req_attr in proof_revealed_attr_group_dict:
-            revealed_attr_value_dict = proof_revealed_attr_group_dict[req_attr][
-                "values"
-            ]
-            for key, value in revealed_attr_value_dict.items():
-                resp_incl_revealed_attibs[key] = value["raw"]
-
-        metadata = auth_session.metadata or {}
+
+        # Persisted once the agent's record has been cleaned up
+        resp_incl_revealed_attibs = auth_session.revealed_attributes
+        if resp_incl_revealed_attibs is None:
+            pres_exch = AcapyClient().get_presentation_request(
+                auth_session.pres_exch_id
+            )
+            logger.debug("PRES_EXCH", pres_exch=pres_exch)
+            resp_incl_revealed_attibs = get_revealed_attributes(pres_exch)
+
+        # A copy, the session may be shared through the status cache
+        metadata = dict(auth_session.metadata or {})
         metadata["revealed_attributes"] = resp_incl_revealed_attibs
 
         # Needs to be made flexible for different proof requests
@@ -111,8 +224,6 @@ async def get_dav_request(pid: str, db: Database = Depends(get_db)):
             notify_endpoint=auth_session.notify_endpoint,
             metadata=metadata,
         )
-        # Testing
-        logger.error(f" --- {str(response)}")
         return response
 
     return AgeVerificationModelRead(
@@ -130,37 +241,90 @@ async def get_dav_request(pid: str, db: Database = Depends(get_db)):
     response_description="Get the specified age verification record",
     status_code=http_status.HTTP_201_CREATED,
     response_model=AgeVerificationModelCreateRead,
-    responses={http_status.HTTP_409_CONFLICT: {"model": GenericErrorMessage}},
+    responses={
+        http_status.HTTP_409_CONFLICT: {"model": GenericErrorMessage},
+        http_status.HTTP_422_UNPROCESSABLE_ENTITY: {"model": GenericErrorMessage},
+        http_status.HTTP_429_TOO_MANY_REQUESTS: {"model": GenericErrorMessage},
+        http_status.HTTP_503_SERVICE_UNAVAILABLE: {"model": GenericErrorMessage},
+    },
     response_model_exclude_unset=True,
-    dependencies=[Depends(get_api_key)],
+    dependencies=[Depends(limit_session_creation)],
 )
 async def new_dav_request(
-    request: AgeVerificationModelCreate, db: Database = Depends(get_db)
+    request: AgeVerificationModelCreate,
+    http_response: Response,
+    db: Database = Depends(get_db),
+    api_key: Optional[str] = Depends(get_api_key),
+    idempotency_key: Optional[str] = Header(default=None),
 ):
     logger.debug(">>> new_dav_request")
 
+    if idempotency_key is None:
+        return await _create_dav_request(request, db)
+
+    response, replayed = await idempotency.create_once(
+        db,
+        api_key,
+        idempotency_key,
+        request,
+        lambda: _create_dav_request(request, db),
+    )
+    if replayed:
+        http_response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _invitation_url(db: Database, auth_session: AuthSession) -> str:
+    """What the QR code holds, the wallet fetches the presentation request there."""
+    controller_host = settings.CONTROLLER_URL
+    if settings.CONTROLLER_SHORT_INVITATION_CODES:
+        code = invitation_codes.create(db, auth_session.pres_exch_id)
+        return controller_host + invitation_codes.PATH + code
+    return controller_host + "/url/pres_exch/" + str(auth_session.pres_exch_id)
+
+
+async def _create_session(
+    db: Database, notify_endpoint: Optional[str], metadata: Optional[dict]
+) -> Tuple[AuthSession, str]:
+    """Create the agent's presentation request and its session.
+
+    Shared by the API and the page, returns the session and the URL its QR
+    code holds.
+    """
     # retrieve presentation_request config.
     client = AcapyClient(db=db)
 
-    # Create presentation_request to show on screen
-    response = client.create_presentation_request()
+    # Create presentation_request to show on screen, off the event loop so
+    # the concurrency cap holds across requests
+    proof_config_ident = default_proof_config_ident()
+    async with exchange_creation_gate.slot():
+        response = await asyncio.to_thread(
+            client.create_presentation_request, proof_config_ident
+        )
 
     new_auth_session = AuthSessionCreate(
-        metadata=request.metadata,
+        metadata=metadata,
         pres_exch_id=response.presentation_exchange_id,
         presentation_exchange=response.dict(),
-        notify_endpoint=request.notify_endpoint,
+        notify_endpoint=notify_endpoint,
+        proof_req_config_id=proof_config_ident,
     )
+    stamp_stage(new_auth_session, LifecycleStage.CREATED)
 
-    # save AuthSession
+    # save AuthSession, counted in the funnel once it was
     auth_session = await AuthSessionCRUD(db).create(new_auth_session)
+    count_stage(db, auth_session, LifecycleStage.CREATED)
 
     # QR CONTENTS
-    controller_host = settings.CONTROLLER_URL
-    url_to_message = (
-        controller_host + "/url/pres_exch/" + str(auth_session.pres_exch_id)
-    )
+    return auth_session, _invitation_url(db, auth_session)
+
 
+async def _create_dav_request(
+    request: AgeVerificationModelCreate, db: Database
+) -> AgeVerificationModelCreateRead:
+    auth_session, url_to_message = await _create_session(
+        db, request.notify_endpoint, request.metadata
+    )
     return AgeVerificationModelCreateRead(
         id=str(auth_session.id),
         status=AuthSessionState.INITIATED,
@@ -170,63 +334,113 @@ async def new_dav_request(
     )
 
 
-@log_debug
-@router.get("/", response_class=HTMLResponse)
-async def render_new_dav_request(request: Request, db: Database = Depends(get_db)):
-    logger.debug(">>> render new_dav_request HTML page")
+async def _create_browser_session(
+    db: Database, notify_endpoint: Optional[str], metadata: Optional[str]
+) -> Tuple[AuthSession, dict]:
+    """Create a session for the page, with the QR code to show for it."""
+    auth_session, url_to_message = await _create_session(db, notify_endpoint, metadata)
+    # CREATE the image, qrcode brings in PIL so it is imported when needed
+    import qrcode
 
-    req_query_params = request.query_params._dict
+    buff = io.BytesIO()
+    qrcode.make(url_to_message).save(buff, format="PNG")
+    image_contents = base64.b64encode(buff.getvalue()).decode("utf-8")
+
+    return auth_session, {
+        "url": url_to_message,
+        "image_contents": image_contents,
+        "deep_link_url": f"bcwallet://aries_connection_invitation?{url_to_message}",
+    }
 
-    #  create proof for this request
-    new_user_id = str(uuid.uuid4())
 
-    # retrieve presentation_request config.
-    client = AcapyClient(db=db)
+def _render_page(data: dict) -> str:
+    display_msg = load_proof_config()[default_proof_config_ident()]["display-text"]
+    data = {
+        "add_asset": add_asset,
+        "asset_url": asset_url,
+        "controller_host": settings.CONTROLLER_URL,
+        "display_msg": display_msg,
+        **data,
+    }
 
-    # Create presentation_request to show on screen
-    response = client.create_presentation_request()
+    # Render and return the template
+    return get_template("verified_credentials.html").render(data)
 
-    new_auth_session = AuthSessionCreate(
-        metadata=req_query_params.get("metadata"),
-        pres_exch_id=response.presentation_exchange_id,
-        presentation_exchange=response.dict(),
-        notify_endpoint=req_query_params.get("notify_endpoint"),
-    )
 
-    # save AuthSession
-    auth_session = await AuthSessionCRUD(db).create(new_auth_session)
+# The page without a session, the same for everyone
+SHELL_CACHE_CONTROL = "public, max-age=60"
+_shell: Optional[Tuple[str, str]] = None
 
-    # QR CONTENTS
-    controller_host = settings.CONTROLLER_URL
-    url_to_message = (
-        controller_host + "/url/pres_exch/" + str(auth_session.pres_exch_id)
+
+def _get_shell() -> Tuple[str, str]:
+    global _shell
+    if _shell is None:
+        html = _render_page({})
+        # Weak, the compression middleware sends it along with encoded bodies
+        _shell = (html, f'W/"{hashlib.sha256(html.encode()).hexdigest()[:16]}"')
+    return _shell
+
+
+def warm_up(db: Database):
+    """Compile the page and the assets it inlines before the first request."""
+    if settings.CONTROLLER_LAZY_SESSION_CREATION:
+        _get_shell()
+    else:
+        _render_page({})
+
+
+@log_debug
+@router.get("/", response_class=HTMLResponse)
+async def render_new_dav_request(
+    request: Request,
+    db: Database = Depends(get_db),
+    api_key: Optional[str] = Security(api_key_header),
+):
+    logger.debug(">>> render new_dav_request HTML page")
+
+    if settings.CONTROLLER_LAZY_SESSION_CREATION:
+        html, etag = _get_shell()
+        headers = {"Cache-Control": SHELL_CACHE_CONTROL, "ETag": etag}
+        if etag in request.headers.get("if-none-match", ""):
+            return Response(
+                status_code=http_status.HTTP_304_NOT_MODIFIED, headers=headers
+            )
+        return HTMLResponse(html, headers=headers)
+
+    # Only rate limited when it creates a session, the shell doesn't
+    await limit_session_creation(request, api_key)
+    req_query_params = request.query_params._dict
+    auth_session, qr = await _create_browser_session(
+        db, req_query_params.get("notify_endpoint"), req_query_params.get("metadata")
     )
-    # CREATE the image
-    buff = io.BytesIO()
-    qrcode.make(url_to_message).save(buff, format="PNG")
-    image_contents = base64.b64encode(buff.getvalue()).decode("utf-8")
 
     # This is the payload to send to the template
-    deep_link_proof_url = f"bcwallet://aries_connection_invitation?{url_to_message}"
-    with open("/app/api/proof_config.yaml", "r") as stream:
-        config_dict = yaml.safe_load(stream)
-    proof_config_ident = os.environ.get(
-        "DAV_PROOF_CONFIG_ID", "age-verification-bc-person-credential"
+    return _render_page(
+        {
+            **qr,
+            "pres_exch_id": auth_session.pres_exch_id,
+            "pid": auth_session.id,
+        }
     )
-    display_msg = config_dict[proof_config_ident]["display-text"]
-    data = {
-        "image_contents": image_contents,
-        "url": url_to_message,
-        "add_asset": add_asset,
-        "pres_exch_id": auth_session.pres_exch_id,
-        "pid": auth_session.id,
-        "controller_host": controller_host,
-        "deep_link_url": deep_link_proof_url,
-        "display_msg": display_msg,
-    }
 
-    # Prepare the template
-    template_file = open("api/templates/verified_credentials.html", "r").read()
-    template = Template(template_file)
-    # Render and return the template
-    return template.render(data)
+
+@router.post(
+    "/session",
+    status_code=http_status.HTTP_201_CREATED,
+    dependencies=[Depends(limit_session_creation)],
+    include_in_schema=False,
+)
+async def new_browser_session(
+    request: BrowserSessionCreate, db: Database = Depends(get_db)
+):
+    """Called by the page shell once it is visible, see `render_new_dav_request`.
+
+    The QR code is delivered over the page's socket.
+    """
+    auth_session, qr = await _create_browser_session(
+        db, request.notify_endpoint, request.metadata
+    )
+    pid = str(auth_session.id)
+    register_connection(pid, request.sid)
+    await sio.emit("session", {"pid": pid, **qr}, to=request.sid)
+    return {"id": pid}
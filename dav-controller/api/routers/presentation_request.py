@@ -1,12 +1,22 @@
+from typing import Optional
+
 import structlog
 
-from fastapi import APIRouter, Depends, Request
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
-from jinja2 import Template
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import status as http_status
+from fastapi.responses import HTMLResponse, RedirectResponse
 from pymongo.database import Database
 
+from ..authSessions import invitation_codes
 from ..authSessions.crud import AuthSessionCRUD
-from ..authSessions.models import AuthSession, AuthSessionState
+from ..authSessions.funnel import count_stage, stamp_stage
+from ..authSessions.models import (
+    AuthSession,
+    AuthSessionPatch,
+    AuthSessionState,
+    LifecycleStage,
+)
+from ..core import readiness
 from ..core.acapy.client import AcapyClient
 from ..core.aries import (
     OOBServiceDecorator,
@@ -17,16 +27,52 @@ from ..core.aries import (
     ServiceDecorator,
 )
 from ..core.config import settings
-from ..routers.socketio import sio, connections_reload
+from ..core.serialization import FastJSONResponse
+from ..routers.socketio import emit_status
 from ..routers.webhook_deliverer import deliver_notification
 from ..db.session import get_db
-from ..templates.helpers import add_asset
+from ..templates.helpers import add_asset, asset_url, get_template
 
 logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
 
 router = APIRouter()
 
 
+def _camera_template() -> Optional[str]:
+    """The template shown to mobile cameras, None without one or for a URL."""
+    redirect = settings.CONTROLLER_CAMERA_REDIRECT_URL
+    if not redirect or ".html" in redirect:
+        return None
+    return f"{redirect}.html"
+
+
+def warm_up(db: Database):
+    """Compile the page shown to mobile cameras before the first request."""
+    name = _camera_template()
+    if name is None:
+        return
+    try:
+        get_template(name)
+    except FileNotFoundError:
+        raise readiness.ConfigurationError(
+            f"CONTROLLER_CAMERA_REDIRECT_URL names no template: {name}"
+        )
+
+
+@router.get(invitation_codes.PATH + "{code}")
+async def send_connectionless_proof_req_by_code(
+    code: str, req: Request, db: Database = Depends(get_db)
+):
+    """The short form of the QR code's URL, see authSessions/invitation_codes.py."""
+    pres_exch_id = invitation_codes.resolve(db, code)
+    if pres_exch_id is None:
+        raise HTTPException(
+            status_code=http_status.HTTP_404_NOT_FOUND,
+            detail="The invitation code is unknown or has expired",
+        )
+    return await send_connectionless_proof_req(pres_exch_id, req, db)
+
+
 @router.get("/url/pres_exch/{pres_exch_id}")
 async def send_connectionless_proof_req(
     pres_exch_id: str, req: Request, db: Database = Depends(get_db)
@@ -37,18 +83,18 @@ async def send_connectionless_proof_req(
     """
     data = {
         "add_asset": add_asset,
+        "asset_url": asset_url,
     }
-    # First prepare the response depending on the redirect url
-    if ".html" in settings.CONTROLLER_CAMERA_REDIRECT_URL:
-        response = RedirectResponse(settings.CONTROLLER_CAMERA_REDIRECT_URL)
-    else:
-        template_file = open(
-            f"api/templates/{settings.CONTROLLER_CAMERA_REDIRECT_URL}.html", "r"
-        ).read()
-        template = Template(template_file)
+    # First prepare the response depending on the redirect url, browsers
+    # get the presentation request too when there is none
+    response = None
+    if _camera_template() is not None:
+        template = get_template(_camera_template())
         response = HTMLResponse(template.render(data))
+    elif settings.CONTROLLER_CAMERA_REDIRECT_URL:
+        response = RedirectResponse(settings.CONTROLLER_CAMERA_REDIRECT_URL)
 
-    if "text/html" in req.headers.get("accept"):
+    if response is not None and "text/html" in req.headers.get("accept", ""):
         logger.info("Redirecting to instructions page")
         return response
 
@@ -56,19 +102,24 @@ async def send_connectionless_proof_req(
         pres_exch_id
     )
 
-    # Get the websocket session
-    connections = connections_reload()
-    sid = connections.get(str(auth_session.id))
-
     # If the qrcode has been scanned, toggle the verified flag
     if auth_session.proof_status is AuthSessionState.INITIATED:
         auth_session.proof_status = AuthSessionState.IN_PROGRESS
-        await AuthSessionCRUD(db).patch(auth_session.id, auth_session)
-        await sio.emit("status", {"status": "in_progress"}, to=sid)
-        if auth_session.notify_endpoint:
-            deliver_notification(
-                "status", {"status": "in_progress"}, auth_session.notify_endpoint
-            )
+        stamp_stage(auth_session, LifecycleStage.SCANNED)
+        scanned = await AuthSessionCRUD(db).patch(
+            auth_session.id,
+            AuthSessionPatch(**auth_session.dict()),
+            expected_status=AuthSessionState.INITIATED,
+        )
+        # Only the scan that moved the session on reports it, not one that
+        # lost the race to another scan or the expiry
+        if scanned is not None:
+            count_stage(db, auth_session, LifecycleStage.SCANNED)
+            await emit_status(str(auth_session.id), {"status": "in_progress"})
+            if auth_session.notify_endpoint:
+                deliver_notification(
+                    "status", {"status": "in_progress"}, auth_session.notify_endpoint
+                )
 
     client = AcapyClient(db=db)
     use_public_did = (
@@ -116,5 +167,6 @@ async def send_connectionless_proof_req(
             service=s_d,
         )
         msg_contents = msg
-    logger.debug(msg_contents.dict(by_alias=True))
-    return JSONResponse(msg_contents.dict(by_alias=True))
+    msg_contents_dict = msg_contents.dict(by_alias=True)
+    logger.debug("presentation request message", msg_contents=msg_contents_dict)
+    return FastJSONResponse(msg_contents_dict)
@@ -1,6 +1,16 @@
 import socketio  # For using websockets
 import logging
 import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Deque, List, Optional
+
+from fastapi import HTTPException
+
+from ..authSessions.crud import AuthSessionCRUD
+from ..authSessions.models import AuthSessionState
+from ..core.config import settings
+from ..db.session import get_db
 
 logger = logging.getLogger(__name__)
 
@@ -12,6 +22,66 @@ sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins="*")
 sio_app = socketio.ASGIApp(socketio_server=sio)
 
 
+class SessionEvents:
+    """Status events of one session, numbered from 1, the latest kept."""
+
+    def __init__(self, size: int):
+        self.seq = 0
+        self.events: Deque[dict] = deque(maxlen=size)
+
+
+class EventLog:
+    """Recent status events of the sessions of this worker.
+
+    A page that reconnects tells `initialize` the last sequence number it
+    saw and gets the events it missed. Sessions that have not had an event
+    for a while are forgotten first.
+    """
+
+    def __init__(self, max_sessions: int, events_per_session: int):
+        self.max_sessions = max_sessions
+        self.events_per_session = events_per_session
+        self._sessions: OrderedDict[str, SessionEvents] = OrderedDict()
+
+    def append(self, pid: str, data: dict) -> dict:
+        session = self._sessions.get(pid)
+        if session is None:
+            session = self._sessions[pid] = SessionEvents(self.events_per_session)
+            if len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(pid)
+        session.seq += 1
+        event = {**data, "seq": session.seq}
+        session.events.append(event)
+        return event
+
+    def seq(self, pid: str) -> int:
+        """Sequence number of the last event, 0 when none is known."""
+        session = self._sessions.get(pid)
+        return session.seq if session else 0
+
+    def since(self, pid: str, last_seq: int) -> Optional[List[dict]]:
+        """Events after `last_seq`, None when some of them are not kept."""
+        session = self._sessions.get(pid)
+        # Numbered by another worker, or by this one before it restarted
+        if session is None or last_seq > session.seq:
+            return None
+        missed = [event for event in session.events if event["seq"] > last_seq]
+        if session.seq > last_seq and missed[0]["seq"] != last_seq + 1:
+            return None
+        return missed
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+event_log = EventLog(
+    int(settings.CONTROLLER_SOCKET_EVENT_SESSIONS),
+    int(settings.CONTROLLER_SOCKET_EVENT_BUFFER_SIZE),
+)
+
+
 @sio.event
 async def connect(sid, socket):
     logger.info(f">>> connect : sid={sid}")
@@ -19,9 +89,40 @@ async def connect(sid, socket):
 
 @sio.event
 async def initialize(sid, data):
-    global connections
-    # Store websocket session matched to the presentation exchange id
-    connections[data.get("pid")] = sid
+    """Register the page of a session and bring it up to date.
+
+    Replays the events after `last_seq`, or sends the current state when
+    they are not kept any more. Acknowledged with the sequence number of the
+    last event and the seconds until the QR code expires.
+    """
+    pid = data.get("pid")
+    last_seq = data.get("last_seq") or 0
+    register_connection(pid, sid)
+
+    try:
+        status = await AuthSessionCRUD(await get_db()).get_status(pid)
+    except HTTPException:
+        return {"seq": 0, "expires_in": None}
+
+    missed = event_log.since(pid, last_seq)
+    if missed is None:
+        missed = []
+        if status.proof_status != AuthSessionState.INITIATED:
+            # Replaces whatever the page has, numbering included
+            missed.append(
+                {
+                    "status": str(status.proof_status),
+                    "seq": event_log.seq(pid),
+                    "current": True,
+                }
+            )
+    for event in missed:
+        await sio.emit("status", event, to=sid)
+
+    expires_in = None
+    if status.proof_status == AuthSessionState.INITIATED:
+        expires_in = max((status.expired_timestamp - datetime.now()).total_seconds(), 0)
+    return {"seq": event_log.seq(pid), "expires_in": expires_in}
 
 
 @sio.event
@@ -33,6 +134,21 @@ async def disconnect(sid):
         connections = {k: v for k, v in connections.items() if v != sid}
 
 
+def register_connection(pid, sid):
+    global connections
+    # Store websocket session matched to the presentation exchange id
+    connections[pid] = sid
+
+
 def connections_reload():
     global connections
     return connections
+
+
+async def emit_status(pid: str, status: dict):
+    """Number a status event, keep it for replay and send it to the page."""
+    event = event_log.append(pid, status)
+    sid = connections.get(pid)
+    # Without a page connected the event waits for its `initialize`
+    if sid is not None:
+        await sio.emit("status", event, to=sid)
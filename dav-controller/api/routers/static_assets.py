@@ -0,0 +1,38 @@
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi import status as http_status
+
+from ..core.compression import choose_encoding
+from ..core.static_assets import IMMUTABLE, STATIC_PATH, assets
+
+router = APIRouter()
+
+
+@router.get(STATIC_PATH + "/{hashed_name}")
+async def get_static_asset(hashed_name: str, request: Request):
+    asset = assets.get(hashed_name)
+    if asset is None:
+        raise HTTPException(
+            status_code=http_status.HTTP_404_NOT_FOUND,
+            detail="The asset hasn't been found!",
+        )
+
+    headers = {
+        "Cache-Control": IMMUTABLE,
+        "ETag": asset.etag,
+        "Vary": "Accept-Encoding",
+    }
+    if_none_match = request.headers.get("if-none-match", "")
+    if asset.etag in if_none_match or if_none_match.strip() == "*":
+        return Response(status_code=http_status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    encoding = choose_encoding(
+        request.headers.get("accept-encoding", ""),
+        tuple(e for e in ("br", "gzip") if e in asset.variants),
+    )
+    if encoding is None:
+        encoding = "identity"
+    else:
+        headers["Content-Encoding"] = encoding
+    return Response(
+        asset.variants[encoding], media_type=asset.media_type, headers=headers
+    )
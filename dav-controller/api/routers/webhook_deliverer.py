@@ -1,12 +1,30 @@
-import json
-
 import requests
+import structlog
+
+from ..core.serialization import dumps
+
+logger: structlog.typing.FilteringBoundLogger = structlog.getLogger(__name__)
+
+# Seconds to wait for the integrator, the caller is handling a webhook
+TIMEOUT = 5
+
 
+def deliver_notification(event: str, payload: dict, endpoint: str):
+    """POST `payload` and the event name to `endpoint`, "url#api-key".
 
-def deliver_notification(payload: dict, endpoint: str):
-    url = endpoint.split("#")[0]
-    api_key = endpoint.split("#")[1]
+    A failed delivery is logged and does not fail the caller.
+    """
+    url, _, api_key = endpoint.partition("#")
     headers = {"Content-Type": "application/json"}
-    if api_key is not None:
+    if api_key:
         headers["x-api-key"] = api_key
-    return requests.post(url=url, data=json.dumps(payload), headers=headers)
+    try:
+        return requests.post(
+            url=url,
+            data=dumps({"event": event, **payload}),
+            headers=headers,
+            timeout=TIMEOUT,
+        )
+    except requests.RequestException as err:
+        logger.warning("notification delivery failed", event=event, err=str(err))
+        return None
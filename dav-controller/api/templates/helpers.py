@@ -1,3 +1,24 @@
+from functools import cache
+
+from jinja2 import Template
+
+from ..core.static_assets import assets
+
+
 # Add assets to templates, like css, js or svg.
+@cache
 def add_asset(name):
     return open(f"api/templates/assets/{name}", "r").read()
+
+
+# Link to assets served from the static route, cacheable by the browser.
+# Use add_asset instead when the page styles the inside of the asset.
+def asset_url(name):
+    return assets.url(name)
+
+
+# Templates of api/templates, compiled once.
+@cache
+def get_template(name) -> Template:
+    with open(f"api/templates/{name}", "r") as template_file:
+        return Template(template_file.read())
@@ -0,0 +1,212 @@
+"""Serialization cost per message type on the controller's hot paths.
+
+Compares the previous code (stdlib json with ASCII round trips, starlette's
+JSONResponse) with api.core.serialization on each available backend.
+
+    python -m benchmarks.bench_json --iterations 20000
+"""
+import argparse
+import base64
+import json
+import sys
+import time
+import uuid
+
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse
+
+from api.core import serialization
+from api.core.aries import (
+    PresentationRequestMessage,
+    PresentProofv10Attachment,
+    ServiceDecorator,
+)
+from api.core.models import AgeVerificationModelCreateRead
+
+PROOF_REQUEST = {
+    "name": "age-verification",
+    "version": "1.0",
+    "nonce": "1234567890123456789012345",
+    "requested_attributes": {
+        "req_attr_0": {
+            "names": ["picture", "given_names", "family_name", "country"],
+            "restrictions": [
+                {"schema_name": "Person", "issuer_did": "RGjWbW1eycP7FrMf4QJvX8"}
+            ],
+        }
+    },
+    "requested_predicates": {
+        "req_pred_0": {
+            "name": "birthdate_dateint",
+            "p_type": "<=",
+            "p_value": 20040101,
+            "restrictions": [{"schema_name": "Person"}],
+        }
+    },
+}
+
+WEBHOOK = {
+    "presentation_exchange_id": str(uuid.uuid4()),
+    "thread_id": str(uuid.uuid4()),
+    "state": "presentation_received",
+    "role": "verifier",
+    "initiator": "self",
+    "trace": False,
+    "auto_present": False,
+    "created_at": "2023-06-01T17:02:11.163718Z",
+    "updated_at": "2023-06-01T17:02:29.411922Z",
+    "presentation_request": PROOF_REQUEST,
+    "presentation": {
+        "requested_proof": {
+            "revealed_attr_groups": {
+                "req_attr_0": {
+                    "sub_proof_index": 0,
+                    "values": {
+                        "given_names": {"raw": "JANE", "encoded": "1" * 70},
+                        "family_name": {"raw": "DOE", "encoded": "2" * 70},
+                        "country": {"raw": "CANADA", "encoded": "3" * 70},
+                        "picture": {"raw": "data:image/jpeg;base64," + "A" * 2048},
+                    },
+                }
+            },
+            "predicates": {"req_pred_0": {"sub_proof_index": 0}},
+        },
+        "proof": {"aggregated_proof": {"c_hash": "9" * 77, "c_list": [[7] * 256] * 4}},
+        "identifiers": [
+            {
+                "schema_id": "RGjWbW1eycP7FrMf4QJvX8:2:Person:1.0",
+                "cred_def_id": "x" * 60,
+            }
+        ],
+    },
+}
+WEBHOOK_BODY = json.dumps(WEBHOOK).encode("ascii")
+
+SERVICE = ServiceDecorator(
+    service_endpoint="https://agent.example/",
+    recipient_keys=["8HH5gYEeNc3z7PYXmd54d4x6qAfCNrqQqEB3nS7Zfu7K"],
+)
+CREATE_READ = AgeVerificationModelCreateRead(
+    id="65a1f0c2e4b0a1b2c3d4e5f6",
+    status="initiated",
+    url="https://controller.example/url/pres_exch/" + str(uuid.uuid4()),
+    notify_endpoint="https://integrator.example/webhook#api-key",
+    metadata={"other_system_id": 123, "store": "Victoria"},
+)
+
+
+def _message(attachment):
+    return PresentationRequestMessage(
+        id=WEBHOOK["thread_id"], request=[attachment], service=SERVICE
+    )
+
+
+# The previous implementations, as they were in the tree
+
+
+def legacy_webhook():
+    return json.loads(WEBHOOK_BODY.decode("ascii"))
+
+
+def legacy_attachment():
+    return PresentProofv10Attachment(
+        data={
+            "base64": base64.b64encode(
+                json.dumps(PROOF_REQUEST).encode("ascii")
+            ).decode("ascii")
+        }
+    )
+
+
+LEGACY_MESSAGE = _message(legacy_attachment())
+
+
+def legacy_b64_str():
+    return base64.b64encode(
+        json.dumps(LEGACY_MESSAGE.dict(by_alias=True)).encode("ascii")
+    ).decode("ascii")
+
+
+def legacy_presentation_response():
+    return JSONResponse(LEGACY_MESSAGE.dict(by_alias=True)).body
+
+
+def legacy_create_response():
+    return JSONResponse(jsonable_encoder(CREATE_READ)).body
+
+
+def legacy_notify():
+    return json.dumps({"status": "success"})
+
+
+# The same work through api.core.serialization
+
+
+def current_webhook():
+    return serialization.loads(WEBHOOK_BODY)
+
+
+def current_attachment():
+    return PresentProofv10Attachment.build(PROOF_REQUEST)
+
+
+def current_b64_str():
+    return LEGACY_MESSAGE.b64_str()
+
+
+def current_presentation_response():
+    return serialization.FastJSONResponse(LEGACY_MESSAGE.dict(by_alias=True)).body
+
+
+def current_create_response():
+    return serialization.FastJSONResponse(jsonable_encoder(CREATE_READ)).body
+
+
+def current_notify():
+    return serialization.dumps({"status": "success"})
+
+
+CASES = [
+    ("webhook body parse", legacy_webhook, current_webhook),
+    ("attachment build", legacy_attachment, current_attachment),
+    ("request message b64_str", legacy_b64_str, current_b64_str),
+    (
+        "presentation request response",
+        legacy_presentation_response,
+        current_presentation_response,
+    ),
+    ("create response", legacy_create_response, current_create_response),
+    ("notify payload", legacy_notify, current_notify),
+]
+
+
+def per_call_us(fn, iterations):
+    for _ in range(min(iterations, 500)):
+        fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="JSON serialization cost")
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    names = list(serialization.backends)
+    print(
+        f"{'message (us/call)':<32}{'legacy':>10}" + "".join(f"{n:>10}" for n in names)
+    )
+    for label, legacy, current in CASES:
+        row = f"{label:<32}{per_call_us(legacy, args.iterations):>10.2f}"
+        for name in names:
+            serialization.use_backend(name)
+            row += f"{per_call_us(current, args.iterations):>10.2f}"
+        print(row)
+    serialization.use_backend("auto")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
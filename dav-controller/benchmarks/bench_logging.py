@@ -0,0 +1,198 @@
+"""Per-request logging cost, as paid by the thread serving the request.
+
+Compares the previous pipeline (whole ASGI scope and cookies bound through
+structlog.threadlocal, eager f-string debug logs, synchronous rendering) with
+the current one (selected fields bound through contextvars, lazy key/value
+logs, rendering on a QueueListener thread, optional per-route sampling).
+
+    python -m benchmarks.bench_logging --requests 20000
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+import uuid
+import warnings
+
+import structlog
+
+from api.core import logger_util
+
+PAYLOAD = {
+    "name": "age-verification",
+    "version": "1.0",
+    "requested_attributes": {
+        "req_attr_0": {
+            "names": ["picture", "given_names", "family_name", "country"],
+            "restrictions": [{"schema_name": "Person"}],
+        }
+    },
+    "requested_predicates": {
+        "req_pred_0": {
+            "name": "birthdate_dateint",
+            "p_type": "<=",
+            "p_value": 20040101,
+            "restrictions": [{"schema_name": "Person"}],
+        }
+    },
+}
+
+
+class SlowSink:
+    """A stream whose writes block, like stdout piped to a busy log shipper."""
+
+    def __init__(self, stream, latency: float):
+        self._stream = stream
+        self._latency = latency
+
+    def write(self, data):
+        time.sleep(self._latency)
+        return self._stream.write(data)
+
+    def flush(self):
+        self._stream.flush()
+
+
+def _scope():
+    # Roughly what starlette hands the middleware for a browser request
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.3"},
+        "http_version": "1.1",
+        "server": ("127.0.0.1", 5000),
+        "client": ("10.0.0.12", 53211),
+        "scheme": "http",
+        "method": "GET",
+        "root_path": "",
+        "path": "/age-verification/65a1f0c2e4b0a1b2c3d4e5f6",
+        "raw_path": b"/age-verification/65a1f0c2e4b0a1b2c3d4e5f6",
+        "query_string": b"",
+        "headers": [
+            (b"host", b"controller.example"),
+            (b"user-agent", b"Mozilla/5.0 (X11; Linux x86_64) Gecko/20100101"),
+            (b"accept", b"application/json"),
+            (b"accept-language", b"en-CA,en;q=0.9"),
+            (b"cookie", b"session=abcdef0123456789; theme=dark"),
+        ],
+    }
+
+
+def legacy_request(logger, devnull):
+    scope = _scope()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        structlog.threadlocal.clear_threadlocal()
+        structlog.threadlocal.bind_threadlocal(
+            logger="uvicorn.access",
+            request_id=str(uuid.uuid4()),
+            cookies={"session": "abcdef0123456789", "theme": "dark"},
+            scope=scope,
+            url="http://controller.example" + scope["path"],
+        )
+    logger.error(f"--- {PAYLOAD} ---")
+    logger.debug(f"<<< get_presentation_request -> {PAYLOAD}")
+    logger.info("processed a request", status_code=200, process_time=0.001)
+
+
+def current_request(logger, devnull):
+    scope = _scope()
+    structlog.contextvars.clear_contextvars()
+    structlog.contextvars.bind_contextvars(
+        request_id=str(uuid.uuid4()),
+        method=scope["method"],
+        path=scope["path"],
+    )
+    logger_util.sample_request(scope["path"])
+    logger.debug("generated proof request", proof_req_dict=PAYLOAD)
+    logger.debug("<<< get_presentation_request", resp=PAYLOAD)
+    logger.info("processed a request", status_code=200, process_time=0.001)
+
+
+def configure_legacy(devnull):
+    """The pipeline as it was configured in api/core/config.py."""
+    root = logging.getLogger()
+    root.handlers.clear()
+    handler = logging.StreamHandler(devnull)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    structlog.configure(
+        processors=[
+            structlog.stdlib.filter_by_level,
+            structlog.contextvars.merge_contextvars,
+            structlog.stdlib.add_logger_name,
+            structlog.stdlib.PositionalArgumentsFormatter(),
+            structlog.stdlib.ExtraAdder(),
+            structlog.processors.StackInfoRenderer(),
+            structlog.stdlib.add_log_level,
+            structlog.processors.TimeStamper(fmt="iso"),
+            structlog.processors.JSONRenderer(),
+        ],
+        context_class=dict,
+        logger_factory=structlog.stdlib.LoggerFactory(),
+        wrapper_class=structlog.make_filtering_bound_logger(logging.INFO),
+        cache_logger_on_first_use=True,
+    )
+
+
+def run(name, request_fn, requests, devnull):
+    logger = structlog.getLogger("bench")
+    for _ in range(min(requests, 500)):
+        request_fn(logger, devnull)
+    start = time.perf_counter()
+    for _ in range(requests):
+        request_fn(logger, devnull)
+    caller = time.perf_counter() - start
+    # Wait for the listener to catch up so the queued work is reported too
+    while logger_util._listener and not logger_util._listener.queue.empty():
+        time.sleep(0.001)
+    total = time.perf_counter() - start
+    per_request = f"{caller / requests * 1e6:>16.1f}{total / requests * 1e6:>16.1f}"
+    print(f"{name:<36}{per_request}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="per-request logging cost")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--sample-rate", type=float, default=0.1)
+    parser.add_argument(
+        "--sink-latency-us",
+        type=float,
+        default=0.0,
+        help="block every write to the output stream for this long",
+    )
+    args = parser.parse_args(argv)
+
+    devnull = open(os.devnull, "w")
+    if args.sink_latency_us:
+        devnull = SlowSink(devnull, args.sink_latency_us / 1e6)
+    print(f"{'pipeline':<36}{'caller us/req':>16}{'drained us/req':>16}")
+
+    configure_legacy(devnull)
+    run("legacy (threadlocal, sync)", legacy_request, args.requests, devnull)
+
+    logger_util.configure_logging(level=logging.INFO, async_emit=False, stream=devnull)
+    run("contextvars, sync", current_request, args.requests, devnull)
+
+    logger_util.configure_logging(level=logging.INFO, async_emit=True, stream=devnull)
+    run("contextvars, queue", current_request, args.requests, devnull)
+
+    logger_util.configure_logging(
+        level=logging.INFO,
+        async_emit=True,
+        stream=devnull,
+        sample_rates=f"/age-verification={args.sample_rate}",
+    )
+    run(
+        f"contextvars, queue, {args.sample_rate:.0%} sampled",
+        current_request,
+        args.requests,
+        devnull,
+    )
+    print(f"dropped (queue full): {logger_util.dropped_log_records()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
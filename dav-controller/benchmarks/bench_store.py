@@ -0,0 +1,123 @@
+"""Latency of the session stores in api/db/store.py.
+
+Times each operation with sessions shaped like the ones the controller
+writes. That the stores behave alike is checked by api/db/tests/test_store.py.
+
+    python -m benchmarks.bench_store --iterations 2000
+    python -m benchmarks.bench_store --stores mongo --mongodb-url mongodb://db:27017
+
+The mongo store uses its own database (--db-name), which is dropped before
+and after. It is skipped when no server answers, unless asked for alone.
+"""
+import argparse
+import sys
+import time
+import uuid
+
+from fastapi.encoders import jsonable_encoder
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+from api.authSessions.models import AuthSessionCreate, AuthSessionStatus
+from api.db.store import MemorySessionStore, MongoSessionStore
+
+from .stats import StageStats, format_summary
+
+PROOF_CONFIG_ID = "age-verification-bc-person-credential"
+
+
+def new_session(**fields) -> dict:
+    auth_session = AuthSessionCreate(
+        pres_exch_id=str(uuid.uuid4()),
+        metadata={"other_system_id": 123, "store": "Victoria"},
+        notify_endpoint="https://integrator.example/webhook#api-key",
+        proof_req_config_id=PROOF_CONFIG_ID,
+    )
+    return {**jsonable_encoder(auth_session), **fields}
+
+
+def timed(stats: StageStats, stage: str, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    stats.record(stage, time.perf_counter() - start)
+    return result
+
+
+def run_latency(store, iterations: int) -> StageStats:
+    stats = StageStats()
+    ids = []
+    for _ in range(iterations):
+        doc = timed(stats, "insert", store.insert_session, new_session())
+        timed(
+            stats,
+            "put_proof_config",
+            store.put_proof_config,
+            doc["pres_exch_id"],
+            PROOF_CONFIG_ID,
+        )
+        ids.append((doc["_id"], doc["pres_exch_id"]))
+    projection = AuthSessionStatus.projection()
+    for id, pres_exch_id in ids:
+        timed(stats, "get", store.get_session, id)
+        timed(stats, "get_status", store.get_session, id, projection)
+        timed(stats, "find_session", store.find_session, pres_exch_id)
+        timed(stats, "get_proof_config", store.get_proof_config, pres_exch_id)
+        timed(stats, "update", store.update_session, id, {"proof_status": "success"})
+        timed(
+            stats,
+            "increment",
+            store.increment_session,
+            id,
+            "pres_exch_cleanup_attempts",
+        )
+    for _ in range(max(iterations // 50, 1)):
+        timed(stats, "cleanup_batch", store.pres_exch_cleanup_batch, ["success"], 50, 5)
+    for id, _ in ids:
+        timed(stats, "delete", store.delete_session, id)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Session store latency")
+    parser.add_argument("--stores", default="memory,mongo")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--mongodb-url", default="mongodb://localhost:27017")
+    parser.add_argument("--db-name", default="dav_bench_store")
+    args = parser.parse_args(argv)
+
+    stores = args.stores.split(",")
+    factories = {}
+    client = None
+    if "memory" in stores:
+        factories["memory"] = lambda: MemorySessionStore(args.iterations * 2)
+    if "mongo" in stores:
+        client = MongoClient(
+            args.mongodb_url,
+            uuidRepresentation="standard",
+            serverSelectionTimeoutMS=2000,
+        )
+        try:
+            client.admin.command("ping")
+        except PyMongoError as err:
+            print(f"mongo: no server at {args.mongodb_url} ({type(err).__name__})")
+            client = None
+            if stores == ["mongo"]:
+                return 1
+        else:
+
+            def make_mongo_store():
+                client.drop_database(args.db_name)
+                return MongoSessionStore(client[args.db_name])
+
+            factories["mongo"] = make_mongo_store
+
+    for name, make_store in factories.items():
+        print(f"{name}: {args.iterations} sessions")
+        print(format_summary(run_latency(make_store(), args.iterations).summary()))
+    if client is not None:
+        client.drop_database(args.db_name)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
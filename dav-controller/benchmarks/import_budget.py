@@ -0,0 +1,108 @@
+"""Import time budget of the controller.
+
+Imports api.main in fresh interpreters with `python -X importtime` and exits
+with 1 when the best run is over the budget, when it imports a module that
+is only meant to be imported when used, or when the import creates the
+MongoDB client or configures logging, which belong to the startup hooks.
+
+    python -m benchmarks.import_budget --budget-ms 900 --runs 5
+"""
+import argparse
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# Imported by the code that needs them, not by api.main
+DEFERRED_MODULES = ("pyop", "oic", "qrcode", "PIL", "yaml", "uvicorn")
+
+CHECK_SIDE_EFFECTS = """
+import logging
+import api.main
+import api.db.session
+print("client", api.db.session._client is not None)
+print("logging", bool(logging.getLogger().handlers))
+"""
+
+LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def import_times(module: str) -> List[Tuple[str, int, int, int]]:
+    """(module, self us, cumulative us, depth) of one cold import."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    times = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            times.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return times
+
+
+def side_effects() -> Dict[str, str]:
+    """Whether importing api.main created the MongoClient or set up logging."""
+    result = subprocess.run(
+        [sys.executable, "-c", CHECK_SIDE_EFFECTS], capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    return dict(
+        line.split(" ", 1)
+        for line in result.stdout.splitlines()
+        if line.startswith(("client ", "logging "))
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="api.main import time budget")
+    parser.add_argument("--module", default="api.main")
+    parser.add_argument("--budget-ms", type=float, default=900)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args(argv)
+
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    totals = [
+        next(cumulative for name, _, cumulative, _ in run if name == args.module)
+        for run in runs
+    ]
+    best = runs[totals.index(min(totals))]
+
+    print(f"{'slowest imports (self ms)':<48}{'self':>10}{'cumulative':>12}")
+    for name, self_us, cumulative_us, _ in sorted(best, key=lambda t: -t[1])[
+        : args.top
+    ]:
+        print(f"{name:<48}{self_us / 1000:>10.1f}{cumulative_us / 1000:>12.1f}")
+    print(
+        f"\n{args.module}: best {min(totals) / 1000:.1f} ms, "
+        f"worst {max(totals) / 1000:.1f} ms over {args.runs} runs, "
+        f"budget {args.budget_ms:.0f} ms"
+    )
+
+    failures = []
+    if min(totals) / 1000 > args.budget_ms:
+        failures.append(f"{args.module} takes {min(totals) / 1000:.1f} ms to import")
+    imported = {name.split(".")[0] for name, _, _, _ in best}
+    for module in DEFERRED_MODULES:
+        if module in imported:
+            failures.append(f"{module} is imported by {args.module}")
+    if args.module == "api.main":
+        effects = side_effects()
+        if effects.get("client") == "True":
+            failures.append("importing api.main creates the MongoClient")
+        if effects.get("logging") == "True":
+            failures.append("importing api.main configures logging")
+
+    for failure in failures:
+        print("FAIL:", failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""Drive the full verification lifecycle against a running controller.
+
+    python -m benchmarks.loadtest --controller-url http://localhost:5000 \
+        --start-agent --agent-latency-ms 30 --rate 20 --duration 60
+
+See docs/Load-Testing.md for how to point the controller at the fake agent.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from ..stats import StageStats, format_summary
+from .fake_acapy import FakeAcapyServer
+from .wallet import SimulatedWallet
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="DAV controller load test")
+    parser.add_argument("--controller-url", default="http://localhost:5000")
+    parser.add_argument("--api-key", default=None, help="controller x-api-key")
+    parser.add_argument("--agent-url", default="http://127.0.0.1:8077")
+    parser.add_argument(
+        "--start-agent",
+        action="store_true",
+        help="run the fake ACA-Py admin API in this process on --agent-url's port",
+    )
+    parser.add_argument("--agent-latency-ms", type=float, default=0.0)
+    parser.add_argument("--agent-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--agent-error-rate", type=float, default=0.0)
+    parser.add_argument("--rate", type=float, default=10.0, help="flows per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--poll-interval", type=float, default=0.2)
+    parser.add_argument("--poll-timeout", type=float, default=10.0)
+    parser.add_argument("--json", dest="json_out", help="write the report as json")
+    return parser.parse_args(argv)
+
+
+def run(args) -> dict:
+    stats = StageStats()
+    wallet = SimulatedWallet(
+        args.controller_url,
+        args.agent_url,
+        stats,
+        api_key=args.api_key,
+        poll_interval=args.poll_interval,
+        poll_timeout=args.poll_timeout,
+    )
+
+    completed = 0
+    lock = threading.Lock()
+
+    def flow():
+        nonlocal completed
+        if wallet.run():
+            with lock:
+                completed += 1
+
+    # Open loop arrivals: flows are started on schedule whether or not the
+    # previous ones have finished, so a slow controller shows up as latency
+    # and backlog instead of silently lowering the offered load.
+    interval = 1.0 / args.rate
+    total = int(args.rate * args.duration)
+    started = time.perf_counter()
+    lag = 0.0
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for i in range(total):
+            target = started + i * interval
+            delay = target - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                lag = max(lag, -delay)
+            pool.submit(flow)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "offered_rate": args.rate,
+        "flows_started": total,
+        "flows_completed": completed,
+        "elapsed_s": elapsed,
+        "throughput_per_s": completed / elapsed if elapsed else 0.0,
+        "max_schedule_lag_ms": lag * 1000,
+        "stages": stats.summary(),
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    agent = None
+    if args.start_agent:
+        port = int(args.agent_url.rsplit(":", 1)[-1].split("/")[0])
+        agent = FakeAcapyServer(
+            host="0.0.0.0",
+            port=port,
+            latency_ms=args.agent_latency_ms,
+            jitter_ms=args.agent_jitter_ms,
+            error_rate=args.agent_error_rate,
+        ).start()
+
+    try:
+        report = run(args)
+        if agent:
+            report["agent"] = requests.get(args.agent_url + "/_loadtest/stats").json()
+    finally:
+        if agent:
+            agent.stop()
+
+    print(
+        f"offered {report['offered_rate']:.1f}/s, "
+        f"completed {report['flows_completed']}/{report['flows_started']} flows "
+        f"in {report['elapsed_s']:.1f}s "
+        f"({report['throughput_per_s']:.1f}/s)"
+    )
+    print(format_summary(report["stages"]))
+    if args.json_out:
+        with open(args.json_out, "w") as out:
+            json.dump(report, out, indent=2)
+
+    return 0 if report["flows_completed"] == report["flows_started"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+"""A minimal in-memory stand-in for the ACA-Py admin API.
+
+Only the endpoints the controller calls are implemented. Every request can be
+delayed by a configurable latency and failed with a configurable error rate,
+so the controller can be exercised without a ledger, a wallet or an agent.
+
+    python -m benchmarks.loadtest.fake_acapy --port 8077 --latency-ms 20
+"""
+import argparse
+import asyncio
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+FAKE_DID = "did:sov:LoadTestDid00000000000"
+FAKE_VERKEY = "LoadTestVerkey1111111111111111111111111111111"
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class FakeAcapyState:
+    """Presentation exchange records kept by the fake agent."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.records: Dict[str, dict] = {}
+        self.by_thread_id: Dict[str, str] = {}
+
+    def create(self, proof_request: dict) -> dict:
+        pres_exch_id = str(uuid.uuid4())
+        thread_id = str(uuid.uuid4())
+        record = {
+            "presentation_exchange_id": pres_exch_id,
+            "thread_id": thread_id,
+            "state": "request_sent",
+            "role": "verifier",
+            "initiator": "self",
+            "created_at": _now(),
+            "updated_at": _now(),
+            "presentation_request": proof_request,
+            "presentation": _fake_presentation(proof_request),
+        }
+        with self._lock:
+            self.records[pres_exch_id] = record
+            self.by_thread_id[thread_id] = pres_exch_id
+        return record
+
+    def get(self, pres_exch_id: str) -> Optional[dict]:
+        return self.records.get(pres_exch_id)
+
+    def get_by_thread_id(self, thread_id: str) -> Optional[dict]:
+        pres_exch_id = self.by_thread_id.get(thread_id)
+        return self.records.get(pres_exch_id) if pres_exch_id else None
+
+    def verify(self, pres_exch_id: str) -> Optional[dict]:
+        record = self.records.get(pres_exch_id)
+        if record:
+            record.update(state="verified", verified="true", updated_at=_now())
+        return record
+
+    def delete(self, pres_exch_id: str) -> bool:
+        with self._lock:
+            record = self.records.pop(pres_exch_id, None)
+            if record:
+                self.by_thread_id.pop(record["thread_id"], None)
+        return record is not None
+
+
+def _fake_presentation(proof_request: dict) -> dict:
+    """Build a presentation revealing every requested attribute."""
+    revealed_attr_groups = {}
+    for label, req_attr in (proof_request.get("requested_attributes") or {}).items():
+        names = req_attr.get("names") or [req_attr.get("name")]
+        revealed_attr_groups[label] = {
+            "sub_proof_index": 0,
+            "values": {
+                name: {"raw": f"loadtest-{name}", "encoded": "1"}
+                for name in names
+                if name
+            },
+        }
+    return {"requested_proof": {"revealed_attr_groups": revealed_attr_groups}}
+
+
+def create_app(
+    latency_ms: float = 0.0,
+    jitter_ms: float = 0.0,
+    error_rate: float = 0.0,
+    state: Optional[FakeAcapyState] = None,
+) -> FastAPI:
+    app = FastAPI(title="fake-acapy")
+    app.state.records = state or FakeAcapyState()
+    app.state.requests = 0
+    app.state.injected_errors = 0
+
+    @app.middleware("http")
+    async def inject_latency_and_errors(request: Request, call_next):
+        app.state.requests += 1
+        delay = latency_ms + random.uniform(-jitter_ms, jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if error_rate and random.random() < error_rate:
+            app.state.injected_errors += 1
+            return JSONResponse({"error": "injected failure"}, status_code=500)
+        return await call_next(request)
+
+    def _records() -> FakeAcapyState:
+        return app.state.records
+
+    @app.get("/status/ready")
+    async def status_ready():
+        return {"ready": True}
+
+    @app.post("/multitenancy/wallet/{wallet_id}/token")
+    async def wallet_token(wallet_id: str):
+        return {"token": f"loadtest-token-{wallet_id}"}
+
+    @app.get("/wallet/did")
+    async def wallet_did():
+        return {
+            "results": [
+                {"did": FAKE_DID, "verkey": FAKE_VERKEY, "posture": "wallet_only"}
+            ]
+        }
+
+    @app.get("/wallet/did/public")
+    async def wallet_did_public():
+        return {"result": {"did": FAKE_DID, "verkey": FAKE_VERKEY, "posture": "posted"}}
+
+    @app.post("/present-proof/create-request")
+    async def create_request(request: Request):
+        body = await request.json()
+        return _records().create(body.get("proof_request", {}))
+
+    @app.get("/present-proof/records")
+    async def list_records(thread_id: Optional[str] = None):
+        if thread_id:
+            record = _records().get_by_thread_id(thread_id)
+            return {"results": [record] if record else []}
+        return {"results": list(_records().records.values())}
+
+    @app.get("/present-proof/records/{pres_exch_id}")
+    async def get_record(pres_exch_id: str):
+        record = _records().get(pres_exch_id)
+        if record is None:
+            return JSONResponse({"error": "not found"}, status_code=404)
+        return record
+
+    @app.post("/present-proof/records/{pres_exch_id}/verify-presentation")
+    async def verify_presentation(pres_exch_id: str):
+        record = _records().verify(pres_exch_id)
+        if record is None:
+            return JSONResponse({"error": "not found"}, status_code=404)
+        return record
+
+    @app.delete("/present-proof/records/{pres_exch_id}")
+    async def delete_record(pres_exch_id: str):
+        if not _records().delete(pres_exch_id):
+            return JSONResponse({"error": "not found"}, status_code=404)
+        return {}
+
+    @app.get("/_loadtest/stats")
+    async def stats():
+        return {
+            "requests": app.state.requests,
+            "injected_errors": app.state.injected_errors,
+            "records": len(_records().records),
+        }
+
+    return app
+
+
+class FakeAcapyServer:
+    """Run the fake agent in a background thread of the current process."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8077, **app_kwargs):
+        self.app = create_app(**app_kwargs)
+        self.url = f"http://{host}:{port}"
+        self._server = uvicorn.Server(
+            uvicorn.Config(self.app, host=host, port=port, log_level="warning")
+        )
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    def start(self, timeout: float = 10.0) -> "FakeAcapyServer":
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("fake ACA-Py did not start in time")
+            time.sleep(0.05)
+        return self
+
+    def stop(self):
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8077)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    app = create_app(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
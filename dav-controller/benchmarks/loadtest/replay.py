@@ -0,0 +1,281 @@
+"""Replay captured agent webhooks against a controller.
+
+Reads the NDJSON files written with CONTROLLER_WEBHOOK_CAPTURE_ENABLED and
+posts the webhooks to `/webhooks/topic/{topic}/` on the captured schedule,
+sped up by --speed (1, 10, ...) or as fast as --concurrency allows with
+`--speed max`. The webhooks of one exchange are posted in order, one after
+the other. Reports the controller's latency per topic and state next to the
+latency the handler had when the webhooks were captured.
+
+    python -m benchmarks.loadtest.replay captures/ --speed 10 \
+        --controller-url http://localhost:5000 --sessions fresh --start-agent
+
+With `--sessions captured` the webhooks are posted as they were captured,
+which needs the controller's database to hold the captured sessions (a
+restored snapshot, after clearing its webhook_event collection). With
+`--sessions fresh` a session is created for every captured exchange before
+the replay, through the controller and the fake agent as the load test
+does, and the webhooks are rewritten to point at them.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+
+from ..stats import StageStats, format_summary
+from .fake_acapy import FakeAcapyServer
+from .wallet import SimulatedWallet, StageError
+
+CAPTURE_PATTERNS = ("*.ndjson", "*.ndjson.part")
+
+
+def parse_speed(value: str) -> float:
+    """Speed up factor, 0 for `max`."""
+    if value == "max":
+        return 0.0
+    speed = float(value)
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive or max")
+    return speed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="DAV controller webhook replay")
+    parser.add_argument("captures", nargs="+", help="capture files or folders")
+    parser.add_argument("--controller-url", default="http://localhost:5000")
+    parser.add_argument("--api-key", default=None, help="controller x-api-key")
+    parser.add_argument(
+        "--speed",
+        type=parse_speed,
+        default=1.0,
+        help="1 for real time, 10 for ten times faster, max for no delays",
+    )
+    parser.add_argument("--sessions", choices=("captured", "fresh"), default="fresh")
+    parser.add_argument("--agent-url", default="http://127.0.0.1:8077")
+    parser.add_argument(
+        "--start-agent",
+        action="store_true",
+        help="run the fake ACA-Py admin API in this process on --agent-url's port",
+    )
+    parser.add_argument("--agent-latency-ms", type=float, default=0.0)
+    parser.add_argument(
+        "--concurrency", type=int, default=64, help="exchanges replayed at once"
+    )
+    parser.add_argument("--json", dest="json_out", help="write the report as json")
+    return parser.parse_args(argv)
+
+
+def capture_files(paths: List[str]) -> List[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for pattern in CAPTURE_PATTERNS:
+                files.extend(glob.glob(os.path.join(path, pattern)))
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+def load_entries(paths: List[str]) -> List[dict]:
+    """Captured webhooks of all the files, in the order they were received."""
+    entries = []
+    for path in capture_files(paths):
+        with open(path) as capture:
+            entries.extend(json.loads(line) for line in capture if line.strip())
+    entries.sort(key=lambda entry: entry["received_at"])
+    return entries
+
+
+def exchange_id(entry: dict) -> Optional[str]:
+    body = entry.get("body")
+    return body.get("presentation_exchange_id") if isinstance(body, dict) else None
+
+
+def group_by_exchange(entries: List[dict]) -> List[List[dict]]:
+    """Webhooks of each exchange in order, webhooks of no exchange alone."""
+    groups: Dict[object, List[dict]] = OrderedDict()
+    for i, entry in enumerate(entries):
+        groups.setdefault(exchange_id(entry) or i, []).append(entry)
+    return list(groups.values())
+
+
+def stage_name(entry: dict) -> str:
+    body = entry.get("body")
+    state = body.get("state") if isinstance(body, dict) else None
+    return f"{entry['topic']}:{state}" if state else entry["topic"]
+
+
+class Replayer:
+    def __init__(self, args, stats: StageStats, setup_stats: StageStats):
+        self.args = args
+        self.controller_url = args.controller_url.rstrip("/")
+        self.stats = stats
+        self.wallet = SimulatedWallet(
+            args.controller_url, args.agent_url, setup_stats, api_key=args.api_key
+        )
+        self.exchanges: Dict[str, dict] = {}
+        self._local = threading.local()
+
+    @property
+    def http(self) -> requests.Session:
+        # requests.Session is not thread safe, keep one per worker thread
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def create_session(self, captured_id: str):
+        """Create a session standing in for a captured exchange."""
+        try:
+            created = self.wallet.create()
+            message = self.wallet.scan(created["url"])
+            self.exchanges[captured_id] = self.wallet.resolve_record(message["@id"])
+        except StageError:
+            pass
+
+    def body(self, entry: dict) -> Optional[dict]:
+        body = entry.get("body")
+        captured_id = exchange_id(entry)
+        if self.args.sessions == "captured" or captured_id is None:
+            return body
+        record = self.exchanges.get(captured_id)
+        if record is None:
+            return None
+        return {
+            **body,
+            "presentation_exchange_id": record["presentation_exchange_id"],
+            "thread_id": record["thread_id"],
+        }
+
+    def post(self, entry: dict):
+        stage = stage_name(entry)
+        body = self.body(entry)
+        if body is None:
+            # Its session could not be created
+            self.stats.error(stage)
+            return
+        start = time.perf_counter()
+        try:
+            resp = self.http.post(
+                self.controller_url + f"/webhooks/topic/{entry['topic']}/",
+                data=json.dumps(body),
+                headers={"Content-Type": "application/json"},
+            )
+        except requests.RequestException:
+            self.stats.error(stage)
+            return
+        duration = time.perf_counter() - start
+        if resp.status_code >= 400:
+            self.stats.error(stage)
+        else:
+            self.stats.record(stage, duration)
+
+    def replay_exchange(self, group: List[dict], started: float, first_at: float):
+        for entry in group:
+            if self.args.speed:
+                due = started + (entry["received_at"] - first_at) / self.args.speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            self.post(entry)
+
+
+def run(args) -> dict:
+    entries = load_entries(args.captures)
+    if not entries:
+        raise SystemExit("no captured webhooks found")
+    groups = group_by_exchange(entries)
+
+    stats = StageStats()
+    setup_stats = StageStats()
+    captured = StageStats()
+    for entry in entries:
+        if entry["status_code"] >= 400:
+            captured.error(stage_name(entry))
+        else:
+            captured.record(stage_name(entry), entry["handler_ms"] / 1000)
+
+    replayer = Replayer(args, stats, setup_stats)
+    if args.sessions == "fresh":
+        ids = [exchange_id(group[0]) for group in groups if exchange_id(group[0])]
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(replayer.create_session, ids))
+
+    # Open loop: every exchange starts on schedule whether or not the earlier
+    # ones are done, so a slow controller shows up as latency and backlog.
+    # At max speed the pool's size bounds the exchanges in flight.
+    first_at = entries[0]["received_at"]
+    started = time.perf_counter()
+    lag = 0.0
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for group in groups:
+            if args.speed:
+                due = started + (group[0]["received_at"] - first_at) / args.speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    lag = max(lag, -delay)
+            pool.submit(replayer.replay_exchange, group, started, first_at)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "webhooks": len(entries),
+        "exchanges": len(groups),
+        "captured_span_s": entries[-1]["received_at"] - first_at,
+        "speed": args.speed or "max",
+        "elapsed_s": elapsed,
+        "throughput_per_s": len(entries) / elapsed if elapsed else 0.0,
+        "max_schedule_lag_ms": lag * 1000,
+        "setup": setup_stats.summary(),
+        "captured": captured.summary(),
+        "stages": stats.summary(),
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    agent = None
+    if args.start_agent:
+        port = int(args.agent_url.rsplit(":", 1)[-1].split("/")[0])
+        agent = FakeAcapyServer(
+            host="0.0.0.0", port=port, latency_ms=args.agent_latency_ms
+        ).start()
+
+    try:
+        report = run(args)
+    finally:
+        if agent:
+            agent.stop()
+
+    if report["setup"]:
+        print("session setup")
+        print(format_summary(report["setup"]))
+        print()
+    print("handler latency when captured")
+    print(format_summary(report["captured"]))
+    print(
+        f"\nreplayed {report['webhooks']} webhooks of {report['exchanges']} "
+        f"exchanges ({report['captured_span_s']:.1f}s captured) at speed "
+        f"{report['speed']} in {report['elapsed_s']:.1f}s "
+        f"({report['throughput_per_s']:.1f}/s)"
+    )
+    print(format_summary(report["stages"]))
+    if args.json_out:
+        with open(args.json_out, "w") as out:
+            json.dump(report, out, indent=2)
+
+    failed = sum(stage["errors"] for stage in report["stages"].values())
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""Simulated wallet and controller client used by the load test driver."""
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+from urllib.parse import urlsplit
+
+import requests
+
+from ..stats import StageStats
+
+
+class StageError(Exception):
+    def __init__(self, stage: str, detail: str):
+        super().__init__(f"{stage}: {detail}")
+        self.stage = stage
+
+
+class SimulatedWallet:
+    """Drives one create -> scan -> verify -> poll lifecycle per call to `run`.
+
+    The wallet talks to the controller like an integrator and a mobile wallet
+    would, and plays the part of the agent by posting the `present_proof`
+    webhooks the controller would normally receive from ACA-Py.
+    """
+
+    def __init__(
+        self,
+        controller_url: str,
+        agent_url: str,
+        stats: StageStats,
+        api_key: Optional[str] = None,
+        poll_interval: float = 0.2,
+        poll_timeout: float = 10.0,
+    ):
+        self.controller_url = controller_url.rstrip("/")
+        self.agent_url = agent_url.rstrip("/")
+        self.stats = stats
+        self.api_key = api_key
+        self.poll_interval = poll_interval
+        self.poll_timeout = poll_timeout
+        self._local = threading.local()
+
+    @property
+    def http(self) -> requests.Session:
+        # requests.Session is not thread safe, keep one per worker thread
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+            if self.api_key:
+                self._local.session.headers["x-api-key"] = self.api_key
+        return self._local.session
+
+    def _timed(self, stage: str, method: str, url: str, **kwargs) -> requests.Response:
+        start = time.perf_counter()
+        try:
+            resp = self.http.request(method, url, **kwargs)
+        except requests.RequestException as err:
+            self.stats.error(stage)
+            raise StageError(stage, str(err)) from err
+        elapsed = time.perf_counter() - start
+        if resp.status_code >= 400:
+            self.stats.error(stage)
+            raise StageError(stage, f"{resp.status_code} {resp.text[:200]}")
+        self.stats.record(stage, elapsed)
+        return resp
+
+    def _webhook(self, stage: str, record: dict, state: str, **extra):
+        body = {
+            "presentation_exchange_id": record["presentation_exchange_id"],
+            "thread_id": record["thread_id"],
+            "state": state,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            **extra,
+        }
+        self._timed(
+            stage,
+            "POST",
+            self.controller_url + "/webhooks/topic/present_proof/",
+            json=body,
+        )
+
+    def create(self) -> dict:
+        resp = self._timed(
+            "create", "POST", self.controller_url + "/age-verification", json={}
+        )
+        return resp.json()
+
+    def scan(self, invitation_url: str) -> dict:
+        # The invitation points at the public CONTROLLER_URL, which is not
+        # necessarily reachable from the load generator.
+        parts = urlsplit(invitation_url)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        resp = self._timed(
+            "scan",
+            "GET",
+            self.controller_url + path,
+            headers={"Accept": "application/json"},
+        )
+        return resp.json()
+
+    def resolve_record(self, thread_id: str) -> dict:
+        resp = self.http.get(
+            self.agent_url + "/present-proof/records",
+            params={"thread_id": thread_id},
+        )
+        results = resp.json().get("results") if resp.ok else None
+        if not results:
+            self.stats.error("resolve")
+            raise StageError("resolve", f"no record for thread {thread_id}")
+        return results[0]
+
+    def poll(self, pid: str) -> dict:
+        deadline = time.monotonic() + self.poll_timeout
+        while True:
+            resp = self._timed(
+                "poll", "GET", self.controller_url + f"/age-verification/{pid}"
+            )
+            data = resp.json()
+            if data.get("status") in ("success", "failure", "expired"):
+                return data
+            if time.monotonic() > deadline:
+                self.stats.error("poll_timeout")
+                raise StageError("poll_timeout", f"last status {data.get('status')}")
+            time.sleep(self.poll_interval)
+
+    def run(self) -> bool:
+        start = time.perf_counter()
+        try:
+            created = self.create()
+            message = self.scan(created["url"])
+            record = self.resolve_record(message["@id"])
+            self._webhook("presentation_received", record, "presentation_received")
+            self._webhook("verified", record, "verified", verified="true")
+            result = self.poll(created["id"])
+        except StageError:
+            self.stats.error("flow")
+            return False
+        if result.get("status") != "success":
+            self.stats.error("flow")
+            return False
+        self.stats.record("flow", time.perf_counter() - start)
+        return True
@@ -0,0 +1,185 @@
+"""Fan-out benchmark of the controller's Socket.IO server.
+
+Connects N simulated verification pages, each calling `initialize` with its
+own pid, has the server emit a status event to every pid for a number of
+rounds, then disconnects them all. Reports the connect rate, connect and
+emit-to-receive latency distributions, memory per connection and how long
+the server takes to forget the disconnected clients.
+
+    python -m benchmarks.socketfanout --clients 2000 --rounds 5
+
+The server runs api.routers.socketio in a child process unless --url points
+at one started with `python -m benchmarks.socketfanout.server`.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+from typing import Dict, List
+
+import requests
+
+from ..stats import StageStats, format_summary
+from .client import SocketClient
+from .server import FanoutServer
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Socket.IO fan-out benchmark")
+    parser.add_argument("--url", help="fan-out server to use instead of starting one")
+    parser.add_argument("--port", type=int, default=5200)
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument(
+        "--connect-concurrency",
+        type=int,
+        default=100,
+        help="clients connecting at the same time",
+    )
+    parser.add_argument("--rounds", type=int, default=5, help="status fan-outs")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds per wait")
+    parser.add_argument("--json", dest="json_out", help="write the report as json")
+    return parser.parse_args(argv)
+
+
+def server_stats(url: str) -> Dict:
+    return requests.get(url + "/_fanout/stats", timeout=10).json()
+
+
+async def wait_for_connections(url: str, expected: int, timeout: float) -> float:
+    """Seconds until the server has `expected` registered connections."""
+    started = time.perf_counter()
+    while (await asyncio.to_thread(server_stats, url))["connections"] != expected:
+        if time.perf_counter() - started > timeout:
+            raise TimeoutError(f"the server did not reach {expected} connections")
+        await asyncio.sleep(0.05)
+    return time.perf_counter() - started
+
+
+async def run(args, url: str) -> Dict:
+    stats = StageStats()
+    received: Dict[int, int] = {}
+    round_done = asyncio.Event()
+    current_round = 0
+
+    def on_event(event: str, data):
+        if event != "status" or not isinstance(data, dict) or "sent_at" not in data:
+            return
+        now = time.time()
+        stats.record("emit_to_receive", now - data["sent_at"])
+        stats.record("burst_to_receive", now - data["burst_at"])
+        received[current_round] = received.get(current_round, 0) + 1
+        if received[current_round] == args.clients:
+            round_done.set()
+
+    baseline = await asyncio.to_thread(server_stats, url)
+    clients: List[SocketClient] = []
+    listeners: List[asyncio.Task] = []
+    gate = asyncio.Semaphore(args.connect_concurrency)
+
+    async def connect(i: int):
+        client = SocketClient(url, on_event)
+        async with gate:
+            started = time.perf_counter()
+            try:
+                await client.connect(f"fanout-{i}-{uuid.uuid4().hex[:8]}")
+            except Exception:
+                stats.error("connect")
+                return
+            stats.record("connect", time.perf_counter() - started)
+        clients.append(client)
+        listeners.append(asyncio.create_task(client.listen()))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(connect(i) for i in range(args.clients)))
+    connect_s = time.perf_counter() - started
+    register_s = await wait_for_connections(url, len(clients), args.timeout)
+    connected = await asyncio.to_thread(server_stats, url)
+
+    missed = 0
+    for current_round in range(1, args.rounds + 1):
+        round_done.clear()
+        started = time.perf_counter()
+        emitted = await asyncio.to_thread(
+            lambda: requests.post(url + "/_fanout/emit", timeout=args.timeout).json()
+        )
+        stats.record("server_emit_all", emitted["emit_s"])
+        try:
+            await asyncio.wait_for(round_done.wait(), args.timeout)
+        except asyncio.TimeoutError:
+            stats.error("round")
+        stats.record("round", time.perf_counter() - started)
+        missed += args.clients - received.get(current_round, 0)
+
+    started = time.perf_counter()
+
+    async def close(client: SocketClient):
+        closing = time.perf_counter()
+        await client.close()
+        stats.record("disconnect", time.perf_counter() - closing)
+
+    await asyncio.gather(*(close(client) for client in clients))
+    await wait_for_connections(url, 0, args.timeout)
+    disconnect_s = time.perf_counter() - started
+    await asyncio.gather(*listeners)
+    after = await asyncio.to_thread(server_stats, url)
+
+    rss_growth = connected["rss_bytes"] - baseline["rss_bytes"]
+    return {
+        "clients": args.clients,
+        "connected": len(clients),
+        "connect_s": connect_s,
+        "connect_rate_per_s": len(clients) / connect_s if connect_s else 0.0,
+        "registration_lag_s": register_s,
+        "rounds": args.rounds,
+        "missed_messages": missed,
+        "rss_baseline_bytes": baseline["rss_bytes"],
+        "rss_connected_bytes": connected["rss_bytes"],
+        "rss_after_disconnect_bytes": after["rss_bytes"],
+        "bytes_per_connection": rss_growth / len(clients) if clients else 0.0,
+        "disconnect_all_s": disconnect_s,
+        "stages": stats.summary(),
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    server = None
+    url = args.url
+    if url is None:
+        server = FanoutServer(port=args.port).start()
+        url = server.url
+    try:
+        report = asyncio.run(run(args, url))
+    finally:
+        if server:
+            server.stop()
+
+    print(
+        f"connected {report['connected']}/{report['clients']} clients "
+        f"in {report['connect_s']:.2f}s ({report['connect_rate_per_s']:.0f}/s), "
+        f"registered {report['registration_lag_s'] * 1000:.0f} ms later"
+    )
+    print(
+        f"memory {report['bytes_per_connection'] / 1024:.1f} KiB per connection "
+        f"({report['rss_baseline_bytes'] / 2**20:.1f} -> "
+        f"{report['rss_connected_bytes'] / 2**20:.1f} MiB), "
+        f"{report['rss_after_disconnect_bytes'] / 2**20:.1f} MiB after disconnect"
+    )
+    print(
+        f"{report['rounds']} rounds, {report['missed_messages']} messages missed, "
+        f"all disconnected in {report['disconnect_all_s']:.2f}s"
+    )
+    print(format_summary(report["stages"]))
+    if args.json_out:
+        with open(args.json_out, "w") as out:
+            json.dump(report, out, indent=2)
+
+    ok = report["connected"] == report["clients"] and not report["missed_messages"]
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""Just enough of Socket.IO over a websocket to play the verification page.
+
+python-socketio's clients need aiohttp or websocket-client, which the
+controller does not depend on, while websockets comes with uvicorn[standard].
+Only the websocket transport (Engine.IO 4), the default namespace and JSON
+events are spoken, which is all the page uses.
+"""
+import json
+from typing import Callable
+
+import websockets
+
+# Engine.IO packet types
+EIO_OPEN = "0"
+EIO_PING = "2"
+EIO_PONG = "3"
+EIO_MESSAGE = "4"
+# Socket.IO packet types, inside Engine.IO messages
+SIO_CONNECT = "0"
+SIO_DISCONNECT = "1"
+SIO_EVENT = "2"
+
+
+class SocketClient:
+    def __init__(self, url: str, on_event: Callable[[str, object], None]):
+        base = url.replace("http://", "ws://").replace("https://", "wss://")
+        self.url = base.rstrip("/") + "/ws/socket.io/?EIO=4&transport=websocket"
+        self.on_event = on_event
+        self._ws = None
+
+    async def _send(self, packet_type: str, data=None):
+        body = "" if data is None else json.dumps(data, separators=(",", ":"))
+        await self._ws.send(EIO_MESSAGE + packet_type + body)
+
+    async def connect(self, pid: str, last_seq: int = 0):
+        """Connect to the default namespace and register `pid`, as the page does."""
+        # Engine.IO sends its own pings, the client only answers them
+        self._ws = await websockets.connect(self.url, ping_interval=None, max_size=None)
+        if not (await self._ws.recv()).startswith(EIO_OPEN):
+            raise ConnectionError("no Engine.IO open packet")
+        await self._ws.send(EIO_MESSAGE + SIO_CONNECT)
+        while True:
+            packet = await self._ws.recv()
+            if packet.startswith(EIO_MESSAGE + SIO_CONNECT):
+                break
+            if packet == EIO_PING:
+                await self._ws.send(EIO_PONG)
+        await self._send(SIO_EVENT, ["initialize", {"pid": pid, "last_seq": last_seq}])
+
+    async def listen(self):
+        """Hand events to `on_event` until either side disconnects."""
+        try:
+            async for packet in self._ws:
+                if packet == EIO_PING:
+                    await self._ws.send(EIO_PONG)
+                elif packet.startswith(EIO_MESSAGE + SIO_EVENT):
+                    event, *args = json.loads(packet[2:])
+                    self.on_event(event, args[0] if args else None)
+                elif packet.startswith(EIO_MESSAGE + SIO_DISCONNECT):
+                    break
+        except websockets.ConnectionClosed:
+            pass
+
+    async def close(self):
+        if self._ws is not None:
+            await self._ws.close()
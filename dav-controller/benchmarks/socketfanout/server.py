@@ -0,0 +1,101 @@
+"""The controller's Socket.IO server with the routes the fan-out benchmark drives.
+
+`api.routers.socketio.sio_app` is mounted at /ws as api.main does, without
+the rest of the controller, next to:
+
+- POST /_fanout/emit, which sends a "status" event to every registered pid
+  through `emit_status` as acapy_handler does, each stamped with the time it
+  was emitted
+- GET /_fanout/stats, registered connections and resident memory
+
+    python -m benchmarks.socketfanout.server --port 5200
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+
+import requests
+import uvicorn
+from fastapi import FastAPI
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak rather than current outside of Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def create_app() -> FastAPI:
+    from api.routers.socketio import connections_reload, emit_status, sio_app
+
+    app = FastAPI(title="socket-fanout")
+
+    @app.post("/_fanout/emit")
+    async def emit():
+        connections = dict(connections_reload())
+        burst_at = time.time()
+        for pid in connections:
+            await emit_status(
+                pid,
+                {
+                    "status": "success",
+                    "pid": pid,
+                    "burst_at": burst_at,
+                    "sent_at": time.time(),
+                },
+            )
+        return {"emitted": len(connections), "emit_s": time.time() - burst_at}
+
+    @app.get("/_fanout/stats")
+    async def stats():
+        return {"connections": len(connections_reload()), "rss_bytes": rss_bytes()}
+
+    app.mount("/ws", sio_app)
+    return app
+
+
+def serve(host: str, port: int):
+    uvicorn.run(create_app(), host=host, port=port, log_level="warning")
+
+
+class FanoutServer:
+    """Run the server in a child process, so its memory and loop are its own."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 5200):
+        self.url = f"http://{host}:{port}"
+        self._process = multiprocessing.get_context("spawn").Process(
+            target=serve, args=(host, port), daemon=True
+        )
+
+    def start(self, timeout: float = 30.0) -> "FanoutServer":
+        self._process.start()
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                requests.get(self.url + "/_fanout/stats", timeout=1)
+                return self
+            except requests.ConnectionError:
+                if time.monotonic() > deadline or not self._process.is_alive():
+                    raise RuntimeError("the fan-out server did not start in time")
+                time.sleep(0.1)
+
+    def stop(self):
+        self._process.terminate()
+        self._process.join(timeout=5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5200)
+    args = parser.parse_args()
+    serve(args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import math
+import threading
+from collections import defaultdict
+from typing import Dict, List
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an unsorted list, 0.0 when empty."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class StageStats:
+    """Thread safe collector of per stage latencies (in seconds) and errors."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples: Dict[str, List[float]] = defaultdict(list)
+        self._errors: Dict[str, int] = defaultdict(int)
+        self._stages: List[str] = []
+
+    def _track(self, stage: str):
+        if stage not in self._stages:
+            self._stages.append(stage)
+
+    def record(self, stage: str, duration: float):
+        with self._lock:
+            self._track(stage)
+            self._samples[stage].append(duration)
+
+    def error(self, stage: str):
+        with self._lock:
+            self._track(stage)
+            self._errors[stage] += 1
+
+    def count(self, stage: str) -> int:
+        return len(self._samples[stage])
+
+    def summary(self) -> Dict[str, dict]:
+        with self._lock:
+            result = {}
+            for stage in self._stages:
+                samples = self._samples[stage]
+                result[stage] = {
+                    "count": len(samples),
+                    "errors": self._errors[stage],
+                    "mean_ms": (sum(samples) / len(samples) * 1000) if samples else 0.0,
+                    "p50_ms": percentile(samples, 50) * 1000,
+                    "p95_ms": percentile(samples, 95) * 1000,
+                    "p99_ms": percentile(samples, 99) * 1000,
+                    "max_ms": max(samples) * 1000 if samples else 0.0,
+                }
+            return result
+
+
+def format_summary(summary: Dict[str, dict]) -> str:
+    header = f"{'stage':<24}{'count':>8}{'errors':>8}{'mean':>10}"
+    header += f"{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}"
+    lines = [header, "-" * len(header)]
+    for stage, s in summary.items():
+        lines.append(
+            f"{stage:<24}{s['count']:>8}{s['errors']:>8}{s['mean_ms']:>10.1f}"
+            f"{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}"
+            f"{s['max_ms']:>10.1f}"
+        )
+    lines.append("(latencies in ms)")
+    return "\n".join(lines)